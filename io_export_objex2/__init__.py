@@ -46,6 +46,14 @@ bl_info = {
     'category': 'Import-Export'}
 
 
+import time
+
+# seconds spent importing and registering the add-on, by step (see register)
+# the export engine (export_objex, export_objex_mtl, export_objex_anim, export_objex_preflight, progress_util) is only imported on first export
+# and the updater (addon_updater, addon_updater_ops) after startup in 2.80+, see register_addon_updater_ops
+startup_timings = {}
+_time_import_start = time.perf_counter()
+
 import bpy
 
 if bpy.app.version < (2, 80, 0):
@@ -64,32 +72,27 @@ from bpy_extras.io_utils import (
         )
 
 import os
-try:
-    import progress_report
-except ImportError:
-    import bpy_extras.wm_utils.progress_report as progress_report
+import sys
 
-# import/reload files
+# reload files (only those already imported, modules imported on first use stay unloaded)
 import importlib
 loc = locals()
 for n in (
-    'export_objex', 'export_objex_mtl', 'export_objex_anim',
+    'export_objex', 'export_objex_mtl', 'export_objex_anim', 'export_objex_preflight',
     'properties', 'interface', 'const_data', 'util', 'logging_util',
-    'rigging_helpers', 'data_updater', 'view3d_copybuffer_patch',
-    'addon_updater', 'addon_updater_ops', 'blender_version_compatibility',
-    'node_setup_helpers',
+    'rigging_helpers', 'data_updater', 'view3d_copybuffer_patch', 'progress_util',
+    'addon_updater', 'addon_updater_ops', 'addon_updater_prefs', 'blender_version_compatibility',
+    'node_setup_helpers', 'image_util',
 ):
     if n in loc:
         importlib.reload(loc[n])
-    else:
-        importlib.import_module('.%s' % n, __package__)
 del importlib
 
-from . import export_objex
+from . import const_data as CST
 from . import logging_util
 from . import blender_version_compatibility
 from . import util
-from . import addon_updater_ops
+from . import addon_updater_prefs
 from . import rigging_helpers
 from . import properties
 from . import data_updater
@@ -97,6 +100,8 @@ from . import interface
 from . import node_setup_helpers
 from . import view3d_copybuffer_patch
 
+startup_timings['import'] = time.perf_counter() - _time_import_start
+del _time_import_start
 
 class OBJEX_OT_export_base():
     """Save an OBJEX File"""
@@ -132,17 +137,17 @@ class OBJEX_OT_export_base():
     use_mesh_modifiers = BoolProperty(
             name='Apply Modifiers',
             description='Apply modifiers',
-            default=export_objex.ObjexWriter.default_options['APPLY_MODIFIERS'],
+            default=CST.EXPORT_DEFAULT_OPTIONS['APPLY_MODIFIERS'],
             )
     use_mesh_modifiers_render = BoolProperty(
             name='Use Modifiers Render Settings',
             description='Use render settings when applying modifiers to mesh objects',
-            default=export_objex.ObjexWriter.default_options['APPLY_MODIFIERS_RENDER'],
+            default=CST.EXPORT_DEFAULT_OPTIONS['APPLY_MODIFIERS_RENDER'],
             )
     apply_unused_armature_deform = BoolProperty(
             name='Apply unused deform',
             description='Apply armature deform modifiers when the armature is not being exported',
-            default=export_objex.ObjexWriter.default_options['APPLY_UNUSED_ARMATURE_DEFORM'],
+            default=CST.EXPORT_DEFAULT_OPTIONS['APPLY_UNUSED_ARMATURE_DEFORM'],
             )
     apply_modifiers_after_armature_deform = BoolProperty(
             name='Apply modifiers after deform',
@@ -150,82 +155,96 @@ class OBJEX_OT_export_base():
                         'If they are applied, it would be as if the armature deform was '
                         'last in the stack, since it would only be "applied" later (for example, '
                         'in-game) when the mesh is displayed animated.',
-            default=export_objex.ObjexWriter.default_options['APPLY_MODIFIERS_AFTER_ARMATURE_DEFORM'],
+            default=CST.EXPORT_DEFAULT_OPTIONS['APPLY_MODIFIERS_AFTER_ARMATURE_DEFORM'],
             )
 
     # extra data group
     use_smooth_groups = BoolProperty(
             name='Smooth Groups',
             description='Write sharp edges as smooth groups',
-            default=export_objex.ObjexWriter.default_options['EXPORT_SMOOTH_GROUPS'],
+            default=CST.EXPORT_DEFAULT_OPTIONS['EXPORT_SMOOTH_GROUPS'],
             )
     use_smooth_groups_bitflags = BoolProperty(
             name='Bitflag Smooth Groups',
             description='Same as Smooth Groups, but generate smooth groups IDs as bitflags '
                         '(produces at most 32 different smooth groups, usually much less)',
-            default=export_objex.ObjexWriter.default_options['EXPORT_SMOOTH_GROUPS_BITFLAGS'],
+            default=CST.EXPORT_DEFAULT_OPTIONS['EXPORT_SMOOTH_GROUPS_BITFLAGS'],
             )
     use_normals = BoolProperty(
             name='Write Normals',
             description='Export one normal per vertex and per face, to represent flat faces and sharp edges',
-            default=export_objex.ObjexWriter.default_options['EXPORT_NORMALS'],
+            default=CST.EXPORT_DEFAULT_OPTIONS['EXPORT_NORMALS'],
             )
     use_vertex_colors = BoolProperty(
             name='Write Vertex Colors',
             description='Export one color per vertex and per face',
-            default=export_objex.ObjexWriter.default_options['EXPORT_VERTEX_COLORS'],
+            default=CST.EXPORT_DEFAULT_OPTIONS['EXPORT_VERTEX_COLORS'],
             )
     use_uvs = BoolProperty(
             name='Include UVs',
             description='Write out the active UV coordinates',
-            default=export_objex.ObjexWriter.default_options['EXPORT_UV'],
+            default=CST.EXPORT_DEFAULT_OPTIONS['EXPORT_UV'],
             )
     use_materials = BoolProperty(
             name='Write Materials',
             description='Write out the MTLEX file',
-            default=export_objex.ObjexWriter.default_options['EXPORT_MTL'],
+            default=CST.EXPORT_DEFAULT_OPTIONS['EXPORT_MTL'],
             )
     use_skeletons = BoolProperty(
             name='Write Skeletons',
             description='Write out the SKEL file',
-            default=export_objex.ObjexWriter.default_options['EXPORT_SKEL'],
+            default=CST.EXPORT_DEFAULT_OPTIONS['EXPORT_SKEL'],
             )
     use_animations = BoolProperty(
             name='Write Animations',
             description='Write out the ANIM file',
-            default=export_objex.ObjexWriter.default_options['EXPORT_ANIM'],
+            default=CST.EXPORT_DEFAULT_OPTIONS['EXPORT_ANIM'],
             )
     use_weights = BoolProperty(
             name='Write Weights',
             description='Write out the vertex weights',
-            default=export_objex.ObjexWriter.default_options['EXPORT_WEIGHTS'],
+            default=CST.EXPORT_DEFAULT_OPTIONS['EXPORT_WEIGHTS'],
             )
     use_unique_weights = BoolProperty(
             name='Write one weight per vertex',
             description="Use vertex group with maximum weight, with weight 1.0 (doesn't write any weight if there is no vertex group assigned)",
-            default=export_objex.ObjexWriter.default_options['UNIQUE_WEIGHTS'],
+            default=CST.EXPORT_DEFAULT_OPTIONS['UNIQUE_WEIGHTS'],
             )
     use_triangles = BoolProperty(
             name='Triangulate Faces',
             description='Convert all faces to triangles',
-            default=export_objex.ObjexWriter.default_options['TRIANGULATE'],
+            default=CST.EXPORT_DEFAULT_OPTIONS['TRIANGULATE'],
             )
 
     export_packed_images = BoolProperty(
             name='Export packed images',
             description='Save packed images outside the blend file',
-            default=export_objex.ObjexWriter.default_options['EXPORT_PACKED_IMAGES'],
+            default=CST.EXPORT_DEFAULT_OPTIONS['EXPORT_PACKED_IMAGES'],
             )
     export_packed_images_dir = StringProperty(
             name='Export packed images directory',
             description='Where to save packed images',
-            default=export_objex.ObjexWriter.default_options['EXPORT_PACKED_IMAGES_DIR'],
+            default=CST.EXPORT_DEFAULT_OPTIONS['EXPORT_PACKED_IMAGES_DIR'],
             )
 
     keep_vertex_order = BoolProperty(
             name='Keep Vertex Order',
             description='',
-            default=export_objex.ObjexWriter.default_options['KEEP_VERTEX_ORDER'],
+            default=CST.EXPORT_DEFAULT_OPTIONS['KEEP_VERTEX_ORDER'],
+            )
+    deduplicate_instances = BoolProperty(
+            name='Reuse Instanced Geometry',
+            description='Convert the geometry of objects sharing the same mesh data and modifiers only once, '
+                        'and write it again for each object with its own transform.\n'
+                        'Much faster for scenes with many instances, '
+                        'may write normals slightly differently than converting each object',
+            default=CST.EXPORT_DEFAULT_OPTIONS['DEDUPLICATE_INSTANCES'],
+            )
+    fix_clamping = BoolProperty(
+            name='Fix Clamping',
+            description='Set Pixels along U/V of exported materials to the dimensions of their images '
+                        '(like the Fix clamping button of the material panel)',
+            default=CST.EXPORT_DEFAULT_OPTIONS['FIX_CLAMPING'],
             )
 
     global_scale = FloatProperty(
@@ -271,6 +290,23 @@ class OBJEX_OT_export_base():
             ),
             default='objex_export_log.txt',
             )
+    logging_file_max_size = IntProperty(
+            name='Log file size limit (MB)',
+            description=(
+                'When not 0, logs are appended to the log file instead of overwriting it,\n'
+                'and the log file is rotated (renamed with a .1, .2, .3 suffix) when it gets bigger than this size'
+            ),
+            default=0,
+            min=0,
+            )
+    trace_memory = BoolProperty(
+            name='Trace memory usage',
+            description=(
+                'Log the peak memory used by each export stage and object.\n'
+                'Makes exporting much slower'
+            ),
+            default=CST.EXPORT_DEFAULT_OPTIONS['TRACE_MEMORY'],
+            )
 
     path_mode = path_reference_mode
 
@@ -323,6 +359,8 @@ class OBJEX_OT_export_base():
         self.layout.prop(self, 'axis_forward')
         self.layout.prop(self, 'axis_up')
         self.layout.prop(self, 'keep_vertex_order')
+        self.layout.prop(self, 'deduplicate_instances')
+        self.layout.prop(self, 'fix_clamping')
         self.layout.prop(self, 'use_triangles')
         if self.export_packed_images:
             box = self.layout.box()
@@ -336,6 +374,8 @@ class OBJEX_OT_export_base():
         box.prop(self, 'logging_file_enable')
         if self.logging_file_enable:
             box.prop(self, 'logging_file_path')
+            box.prop(self, 'logging_file_max_size')
+        box.prop(self, 'trace_memory')
         self.layout.prop(self, 'path_mode')
 
     def execute(self, context):
@@ -349,6 +389,7 @@ class OBJEX_OT_export_base():
                                             'logging_level_report',
                                             'logging_file_enable',
                                             'logging_file_path',
+                                            'logging_file_max_size',
                                             ))
 
         global_matrix = blender_version_compatibility.matmul(
@@ -372,31 +413,9 @@ class OBJEX_OT_export_base():
                     export_dir, _ = os.path.split(self.filepath)
                     logfile_path = '%s/%s' % (export_dir, logfile_path)
                 log.info('Writing logs to {}', logfile_path)
-                logging_util.setLogFile(logfile_path)
+                # written from a background thread, until resetLoggingSettings (see finally below)
+                logging_util.setLogFile(logfile_path, self.logging_file_max_size * 1024 * 1024)
             logging_util.setLogOperator(self, self.logging_level_report)
-            def progress_report_print(*args, **kwargs):
-                """
-                Typical print() arguments called from progress_report:
-                
-                args = ('Progress:   1.85%\r',)
-                kwargs = {'end': ''}
-                
-                args = ('    (  0.1298 sec |   0.1198 sec) Objex Export Finished\nProgress: 100.00%\r',)
-                kwargs = {'end': ''}
-                
-                args = ('\n',)
-                kwargs = {}
-                """
-                # ignore kwargs['flush'] and kwargs['file']
-                message = '%s%s' % (kwargs.get('sep', ' ').join(args), kwargs.get('end','\n'))
-                for line in message.split('\n'):
-                    if not line:
-                        print() # \n
-                    elif line[-1] == '\r':
-                        print(line, end='')
-                    else:
-                        log.info(line)
-            progress_report.print = progress_report_print
 
             # Warn about using texture (face texture) shading in < 2.80
             if (any(material.objex_bonus.is_objex_material for material in bpy.data.materials)
@@ -414,38 +433,10 @@ class OBJEX_OT_export_base():
                             'which is required to correctly preview objex-enabled materials.',
                             shading_type)
 
-            view_transform = context.scene.view_settings.view_transform
-            if bpy.app.version < (2, 80, 0):
-                view_transform_ok = 'Default'
-            else:
-                view_transform_ok = 'Standard'
-            if view_transform != view_transform_ok:
-                log.warning('Scene uses view_transform={!r} which changes how colors are '
-                            'displayed in the viewport, reducing the preview accuracy.\n'
-                            'This can be changed under Color Management in {} properties.\n'
-                            'Recommended value: {}',
-                            view_transform, 'Scene' if bpy.app.version < (2, 80, 0) else 'Render',
-                            view_transform_ok)
-
-            display_device = context.scene.display_settings.display_device
-            # 421fixme 'Rec709' is also available in 2.79, idk what it is but it's mentioned in
-            # the tooltip for the Linear value of the Color Space property of image texture nodes
-            display_device_ok = 'None'
-            if context.scene.objex_bonus.colorspace_strategy != 'QUIET' and display_device != display_device_ok:
-                log.warning('Scene uses display_device={!r} which changes how colors are '
-                            'displayed in the viewport, reducing the preview accuracy.\n'
-                            'This can be changed under Color Management in {} properties.\n'
-                            'Note that this should also be kept consistent with the '
-                            'Color Space property of image texture nodes '
-                            '(display_device="None", Color Space="Linear").\n'
-                            '{}'
-                            'Recommended value: {}',
-                            display_device,
-                            'Scene' if bpy.app.version < (2, 80, 0) else 'Render',
-                            'In Blender 2.7x, "Color Space" can be found in the Image Editor.\n'
-                                if bpy.app.version < (2, 80, 0) else '',
-                            display_device_ok)
+            # scene color management is checked by export_objex_preflight
 
+            # imported here rather than on add-on enable, to not slow down Blender startup
+            from . import export_objex
             return export_objex.save(context, **keywords)
         except util.ObjexExportAbort as abort:
             log.error('Export abort: {}', abort.reason)
@@ -454,7 +445,6 @@ class OBJEX_OT_export_base():
             log.exception('Uncaught exception')
             raise
         finally:
-            progress_report.print = print
             logging_util.resetLoggingSettings()
 
 axis_forward = '-Z'
@@ -477,7 +467,27 @@ def menu_func_export(self, context):
     self.layout.operator(OBJEX_OT_export.bl_idname, text='Objex2 (.objex)')
 
 
-class OBJEX_AddonPreferences(bpy.types.AddonPreferences, logging_util.AddonLoggingPreferences, addon_updater_ops.AddonUpdaterPreferences):
+# True once addon_updater_ops is registered, see register_addon_updater_ops
+addon_updater_ops_registered = False
+
+def register_addon_updater_ops():
+    """
+    Import and register addon_updater_ops (importing it imports addon_updater and creates the updater)
+    In 2.80+ this runs from a one-shot timer set by register, to keep it out of the add-on startup
+    Returns None, for the timer to not run again
+    """
+    global addon_updater_ops_registered
+    if addon_updater_ops_registered:
+        return None
+    time_start = time.perf_counter()
+    from . import addon_updater_ops
+    addon_updater_ops.register(bl_info)
+    addon_updater_ops_registered = True
+    log = logging_util.getLogger('startup')
+    log.debug('Imported and registered addon_updater_ops in {:.1f} ms', (time.perf_counter() - time_start) * 1000)
+    return None
+
+class OBJEX_AddonPreferences(bpy.types.AddonPreferences, logging_util.AddonLoggingPreferences, addon_updater_prefs.AddonUpdaterPreferences):
     bl_idname = __package__
 
     colorspace_default_strategy = bpy.props.EnumProperty(
@@ -524,12 +534,16 @@ class OBJEX_AddonPreferences(bpy.types.AddonPreferences, logging_util.AddonLoggi
     )
 
     def draw(self, context):
-        addon_updater_ops.check_for_update_background()
+        # the updater UI is only drawn once registered, see register_addon_updater_ops
+        if addon_updater_ops_registered:
+            from . import addon_updater_ops
+            addon_updater_ops.check_for_update_background()
         logging_util.AddonLoggingPreferences.draw(self, context)
         self.layout.prop(self, 'colorspace_default_strategy')
         self.layout.prop(self, 'monkeyPatch_view3d_copybuffer')
-        addon_updater_ops.update_settings_ui(self, context)
-        addon_updater_ops.update_notice_box_ui(self, context)
+        if addon_updater_ops_registered:
+            addon_updater_ops.update_settings_ui(self, context)
+            addon_updater_ops.update_notice_box_ui(self, context)
 
 
 classes = (
@@ -539,6 +553,7 @@ classes = (
 
 
 def register():
+    time_start = time.perf_counter()
     util.addon_version = bl_info['version']
 
     # must register OBJEX_AddonPreferences before registerLogging
@@ -546,23 +561,46 @@ def register():
         blender_version_compatibility.make_annotations(cls)
         bpy.utils.register_class(cls)
 
-    addon_updater_ops.register(bl_info)
-
     logging_util.registerLogging('objex')
 
+    if hasattr(bpy.app, 'timers'): # 2.80+
+        # persistent, to still run if a file is loaded right after startup
+        bpy.app.timers.register(register_addon_updater_ops, first_interval=0, persistent=True)
+    else:
+        time_step = time.perf_counter()
+        register_addon_updater_ops()
+        startup_timings['addon_updater_ops'] = time.perf_counter() - time_step
+
     _MT_file_export = bpy.types.INFO_MT_file_export if hasattr(bpy.types, 'INFO_MT_file_export') else bpy.types.TOPBAR_MT_file_export
     _MT_file_export.append(menu_func_export)
 
-    rigging_helpers.register()
-    properties.register_properties()
-    data_updater.register()
-    interface.register_interface()
-    node_setup_helpers.register()
-    view3d_copybuffer_patch.register()
+    for step_name, register_step in (
+        ('rigging_helpers', rigging_helpers.register),
+        ('properties', properties.register_properties),
+        ('data_updater', data_updater.register),
+        ('interface', interface.register_interface),
+        ('node_setup_helpers', node_setup_helpers.register),
+        ('view3d_copybuffer_patch', view3d_copybuffer_patch.register),
+    ):
+        time_step = time.perf_counter()
+        register_step()
+        startup_timings[step_name] = time.perf_counter() - time_step
+
+    startup_timings['register'] = time.perf_counter() - time_start
+    log = logging_util.getLogger('startup')
+    log.debug('Imported in {:.1f} ms, registered in {:.1f} ms ({})',
+        startup_timings['import'] * 1000, startup_timings['register'] * 1000,
+        ', '.join('{} {:.1f} ms'.format(step_name, t * 1000)
+            for step_name, t in startup_timings.items() if step_name not in ('import', 'register')))
 
 
 # reverse register() order
 def unregister():
+    # only imported (and registering handlers) on first export
+    export_objex_preflight = sys.modules.get('%s.export_objex_preflight' % __name__)
+    if export_objex_preflight:
+        export_objex_preflight.unregister()
+
     view3d_copybuffer_patch.unregister()
     node_setup_helpers.unregister()
     interface.unregister_interface()
@@ -575,7 +613,13 @@ def unregister():
 
     logging_util.unregisterLogging()
 
-    addon_updater_ops.unregister()
+    if hasattr(bpy.app, 'timers') and bpy.app.timers.is_registered(register_addon_updater_ops):
+        bpy.app.timers.unregister(register_addon_updater_ops)
+    global addon_updater_ops_registered
+    if addon_updater_ops_registered:
+        from . import addon_updater_ops
+        addon_updater_ops.unregister()
+        addon_updater_ops_registered = False
 
     # must not unregister OBJEX_AddonPreferences before unregisterLogging
     for cls in reversed(classes):
@@ -28,16 +28,18 @@ __version__ = "1.0.8"
 import errno
 import traceback
 import platform
-import ssl
-import urllib.request
-import urllib
 import os
 import json
-import zipfile
 import shutil
 import threading
 import fnmatch
+import hashlib
+import pathlib
+import time
+import zlib
 from datetime import datetime, timedelta
+# ssl, urllib.request and zipfile are only imported when needed,
+# to keep them out of Blender startup (see get_raw, stage_repository, unpack_staged_zip)
 
 # blender imports, used in limited cases
 import bpy
@@ -109,6 +111,9 @@ class Singleton_updater(object):
 		self._update_link = None
 		self._update_version = None
 		self._source_zip = None
+		self._source_zip_sha256 = None
+		# paths (relative to the addon root) of files identical in the staged zip, see unpack_staged_zip
+		self._unchanged_files = set()
 		self._check_thread = None
 		self._select_link = None
 		self.skip_tag = None
@@ -120,10 +125,17 @@ class Singleton_updater(object):
 										self._addon+"_updater")
 		self._addon_root = os.path.dirname(__file__)
 		self._json = {}
+		# the JSON state file is written from the check thread and the UI, see save_updater_json
+		self._json_lock = threading.RLock()
 		self._error = None
 		self._error_msg = None
 		self._prefiltered_tag_count = 0
 
+		# API responses (tag and branch lists) cached on disk, see get_api
+		# {url: {"etag": ETag header or None, "time": timestamp, "body": response}}
+		self._api_cache = None  # loaded on first use
+		self._api_cache_ttl = 3600  # seconds a cached response is used without any request
+
 		# UI code only, ie not used within this module but still useful
 		# properties to have
 
@@ -155,10 +167,20 @@ class Singleton_updater(object):
 		return self._engine.api_url
 	@api_url.setter
 	def api_url(self, value):
-		if self.check_is_url(value) == False:
+		# the local engine uses a directory path
+		if self._engine.name != "local" and self.check_is_url(value) == False:
 			raise ValueError("Not a valid URL: " + value)
 		self._engine.api_url = value
 
+	@property
+	def api_cache_ttl(self):
+		return self._api_cache_ttl
+	@api_cache_ttl.setter
+	def api_cache_ttl(self, value):
+		if type(value) not in (int, float) or value < 0:
+			raise ValueError("api_cache_ttl must be a non-negative number of seconds")
+		self._api_cache_ttl = value
+
 	@property
 	def async_checking(self):
 		return self._async_checking
@@ -236,6 +258,8 @@ class Singleton_updater(object):
 			self._engine = GitlabEngine()
 		elif value.lower()=="bitbucket":
 			self._engine = BitbucketEngine()
+		elif value.lower()=="local":
+			self._engine = LocalEngine()
 		else:
 			raise ValueError("Invalid engine selection")
 
@@ -570,12 +594,13 @@ class Singleton_updater(object):
 	def form_branch_url(self, branch):
 		return self._engine.form_branch_url(branch, self)
 
-	def get_tags(self):
+	def get_tags(self, max_age=None):
+		"""max_age is passed to get_api"""
 		request = self.form_tags_url()
 		if self._verbose: print("Getting tags from server")
 
-		# get all tags, internet call
-		all_tags = self._engine.parse_tags(self.get_api(request), self)
+		# get all tags, internet call (unless cached)
+		all_tags = self._engine.parse_tags(self.get_api(request, max_age), self)
 		if all_tags is not None:
 			self._prefiltered_tag_count = len(all_tags)
 		else:
@@ -636,9 +661,15 @@ class Singleton_updater(object):
 
 
 	# all API calls to base url
-	def get_raw(self, url):
+	# if cache_entry is given (see get_api), the request is conditional on its ETag
+	# and the entry is updated from the response
+	def get_raw(self, url, cache_entry=None):
 		# print("Raw request:", url)
+		import ssl
+		import urllib.request
 		request = urllib.request.Request(url)
+		if cache_entry and cache_entry["etag"] and cache_entry["body"] != None:
+			request.add_header('If-None-Match', cache_entry["etag"])
 		try:
 			context = ssl._create_unverified_context()
 		except:
@@ -663,6 +694,10 @@ class Singleton_updater(object):
 			else:
 				result = urllib.request.urlopen(request)
 		except urllib.error.HTTPError as e:
+			if e.code == 304 and cache_entry:
+				# not modified since cached
+				if self._verbose: print("Using cached response for", url)
+				return cache_entry["body"]
 			if str(e.code) == "403":
 				self._error = "HTTP error (access denied)"
 				self._error_msg = str(e.code) + " - server error response"
@@ -687,16 +722,33 @@ class Singleton_updater(object):
 			self._update_ready = None
 			return None
 		else:
-			result_string = result.read()
+			result_string = result.read().decode()
+			if cache_entry != None:
+				cache_entry["etag"] = result.headers.get("ETag")
+				cache_entry["body"] = result_string
 			result.close()
-			return result_string.decode()
+			return result_string
 
 
 	# result of all api calls, decoded into json format
-	def get_api(self, url):
+	# a response cached less than max_age seconds ago (default api_cache_ttl) is used without any request,
+	# an older one is revalidated with its ETag
+	def get_api(self, url, max_age=None):
+		if max_age == None:
+			max_age = self._api_cache_ttl
+		with self._json_lock:
+			cache = self.get_api_cache()
+			cache_entry = cache.setdefault(url, {"etag": None, "time": 0, "body": None})
 		# return the json version
 		get = None
-		get = self.get_raw(url)
+		if cache_entry["body"] != None and time.time() - cache_entry["time"] < max_age:
+			if self._verbose: print("Using response cached less than {}s ago for".format(max_age), url)
+			get = cache_entry["body"]
+		else:
+			get = self.get_raw(url, cache_entry)
+			if get != None:
+				cache_entry["time"] = time.time()
+				self.save_api_cache()
 		if get != None:
 			try:
 				return json.JSONDecoder().decode(get)
@@ -748,6 +800,8 @@ class Singleton_updater(object):
 
 		if self._verbose: print("Starting download update zip")
 		try:
+			import ssl
+			import urllib.request
 			request = urllib.request.Request(url)
 			context = ssl._create_unverified_context()
 
@@ -761,9 +815,26 @@ class Singleton_updater(object):
 			# Always set user agent
 			request.add_header('User-Agent', "Python/"+str(platform.python_version()))
 
-			self.urlretrieve(urllib.request.urlopen(request,context=context), self._source_zip)
-			# add additional checks on file size being non-zero
-			if self._verbose: print("Successfully downloaded update zip")
+			# the archive is hashed while it is downloaded
+			hasher = hashlib.sha256()
+			urlfile = urllib.request.urlopen(request,context=context)
+			try:
+				expected_size = urlfile.headers.get("Content-Length")
+				size = self.urlretrieve(urlfile, self._source_zip, hasher)
+			finally:
+				urlfile.close()
+			self._source_zip_sha256 = hasher.hexdigest()
+			if size == 0 or (expected_size and size != int(expected_size)):
+				self._error = "Error retrieving download, incomplete file"
+				self._error_msg = "Downloaded {} bytes, expected {}".format(size, expected_size)
+				return False
+			expected_sha256 = self.get_link_sha256(url)
+			if expected_sha256 and expected_sha256.lower() != self._source_zip_sha256:
+				self._error = "Error retrieving download, corrupted file"
+				self._error_msg = "SHA-256 {} does not match the expected {}".format(
+					self._source_zip_sha256, expected_sha256)
+				return False
+			if self._verbose: print("Successfully downloaded update zip, SHA-256", self._source_zip_sha256)
 			return True
 		except Exception as e:
 			self._error = "Error retrieving download, bad link?"
@@ -775,6 +846,14 @@ class Singleton_updater(object):
 			return False
 
 
+	def get_link_sha256(self, url):
+		"""The SHA-256 the engine listed for the tag with this download link, or None"""
+		for tag in self._tags:
+			if "sha256" in tag and (tag.get("zipball_url") == url or
+					(self._select_link and self.select_link(self, tag) == url)):
+				return tag["sha256"]
+		return None
+
 	def create_backup(self):
 		if self._verbose: print("Backing up current addon folder")
 		local = os.path.join(self._updater_path,"backup")
@@ -799,12 +878,15 @@ class Singleton_updater(object):
 				if self._verbose:print("Failed to remove existing temp folder, contininuing")
 				if self._print_traces: traceback.print_exc()
 		# make the full addon copy, which temporarily places outside the addon folder
+		# files are hard-linked rather than copied when possible: updating never writes into
+		# installed files but replaces them (see deepMergeDirectory), so the links keep the old contents
 		if self._backup_ignore_patterns != None:
 			shutil.copytree(
 				self._addon_root,tempdest,
-				ignore=shutil.ignore_patterns(*self._backup_ignore_patterns))
+				ignore=shutil.ignore_patterns(*self._backup_ignore_patterns),
+				copy_function=self.link_or_copy)
 		else:
-			shutil.copytree(self._addon_root,tempdest)
+			shutil.copytree(self._addon_root,tempdest,copy_function=self.link_or_copy)
 		shutil.move(tempdest,local)
 
 		# save the date for future ref
@@ -813,6 +895,14 @@ class Singleton_updater(object):
 				m=now.strftime("%B"),d=now.day,yr=now.year)
 		self.save_updater_json()
 
+	def link_or_copy(self, src, dst):
+		try:
+			os.link(src, dst)
+		except OSError:
+			# e.g. file system without hard links
+			shutil.copy2(src, dst)
+		return dst
+
 	def restore_backup(self):
 		if self._verbose: print("Restoring backup")
 
@@ -872,6 +962,7 @@ class Singleton_updater(object):
 
 		if self._verbose:
 			print("Begin extracting source from zip:", self._source_zip)
+		import zipfile
 		zfile = zipfile.ZipFile(self._source_zip, "r")
 
 		if not zfile:
@@ -885,13 +976,27 @@ class Singleton_updater(object):
 		# this avoids adding the first subfolder to the path length,
 		# which can be too long if the download has the SHA in the name
 		zsep = '/'  #os.sep  # might just always be / even on windows
-		for name in zfile.namelist():
+
+		# files identical to the installed ones (same size and CRC) are not extracted,
+		# unless doing a clean install which removes all installed files first
+		self._unchanged_files = set()
+		addon_prefix = None if clean else self.get_zip_addon_prefix(zfile, zsep)
+
+		for zinfo in zfile.infolist():
+			name = zinfo.filename
 			if zsep not in name:
 				continue
 			top_folder = name[:name.index(zsep)+1]
 			if name == top_folder + zsep:
 				continue  # skip top level folder
 			subpath = name[name.index(zsep)+1:]
+			if (addon_prefix != None and not name.endswith(zsep)
+					and subpath.startswith(addon_prefix)):
+				installed_path = subpath[len(addon_prefix):]
+				# __init__.py is always extracted, it is how the addon folder is found below
+				if installed_path != "__init__.py" and self.file_matches_crc(os.path.join(self._addon_root, installed_path), zinfo):
+					self._unchanged_files.add(os.path.normpath(installed_path))
+					continue
 			if name.endswith(zsep):
 				try:
 					os.mkdir(os.path.join(outdir, subpath))
@@ -904,14 +1009,16 @@ class Singleton_updater(object):
 						if self._print_traces: traceback.print_exc()
 						return -1
 			else:
-				with open(os.path.join(outdir, subpath), "wb") as outfile:
-					data = zfile.read(name)
-					outfile.write(data)
+				# parent folders of extracted files may not have been created, if all their other files are unchanged
+				os.makedirs(os.path.dirname(os.path.join(outdir, subpath)), exist_ok=True)
+				with zfile.open(zinfo) as infile, open(os.path.join(outdir, subpath), "wb") as outfile:
+					shutil.copyfileobj(infile, outfile)
 					if self._verbose:
 						print("Extract - create:", os.path.join(outdir, subpath))
+		zfile.close()
 
 		if self._verbose:
-			print("Extracted source")
+			print("Extracted source, {} unchanged files skipped".format(len(self._unchanged_files)))
 
 		unpath = os.path.join(self._updater_path, "source")
 		if not os.path.isdir(unpath):
@@ -958,6 +1065,42 @@ class Singleton_updater(object):
 		return 0
 
 
+	def get_zip_addon_prefix(self, zfile, zsep):
+		"""The path of the addon folder in the zip (without the top folder), as found in unpack_staged_zip
+
+		Returns None if it cannot be told before extracting
+		"""
+		subpaths = set()
+		for name in zfile.namelist():
+			if zsep in name:
+				subpaths.add(name[name.index(zsep)+1:])
+		if "__init__.py" in subpaths:
+			return ""
+		if self._subfolder_path:
+			prefix = self._subfolder_path.replace('\\', zsep).strip(zsep) + zsep
+			if prefix + "__init__.py" in subpaths:
+				return prefix
+			return None
+		top_folders = {subpath[:subpath.index(zsep)+1] for subpath in subpaths if zsep in subpath}
+		if len(top_folders) == 1:
+			prefix = top_folders.pop()
+			if prefix + "__init__.py" in subpaths:
+				return prefix
+		return None
+
+	def file_matches_crc(self, path, zinfo):
+		"""If the file at path has the size and CRC-32 of the zip member zinfo"""
+		try:
+			if os.path.getsize(path) != zinfo.file_size:
+				return False
+			crc = 0
+			with open(path, "rb") as f:
+				for data in iter(lambda: f.read(1024*64), b""):
+					crc = zlib.crc32(data, crc)
+		except OSError:
+			return False
+		return crc == zinfo.CRC
+
 	def deepMergeDirectory(self,base,merger,clean=False):
 		"""Merge folder 'merger' into folder 'base' without deleting existing"""
 		if not os.path.exists(base):
@@ -1009,6 +1152,9 @@ class Singleton_updater(object):
 			# prune ie skip updater folder
 			dirs[:] = [d for d in dirs if os.path.join(path,d) not in [self._updater_path]]
 			for file in files:
+				# unchanged files were not extracted, they are kept as installed
+				if os.path.normpath(os.path.relpath(os.path.join(path,file), base)) in self._unchanged_files:
+					continue
 				for ptrn in self.remove_pre_update_patterns:
 					if fnmatch.filter([file],ptrn):
 						try:
@@ -1094,6 +1240,7 @@ class Singleton_updater(object):
 	# -------------------------------------------------------------------------
 
 	def clear_state(self):
+		self._api_cache = None
 		self._update_ready = None
 		self._update_link = None
 		self._update_version = None
@@ -1101,18 +1248,24 @@ class Singleton_updater(object):
 		self._error = None
 		self._error_msg = None
 
-	# custom urlretrieve implementation
-	def urlretrieve(self, urlfile, filepath):
-		chunk = 1024*8
+	# custom urlretrieve implementation, returns the size written
+	# hasher (e.g. hashlib.sha256()) is updated with the data if given
+	def urlretrieve(self, urlfile, filepath, hasher=None):
+		chunk = 1024*64
+		size = 0
 		f = open(filepath, "wb")
 		while 1:
 			data = urlfile.read(chunk)
 			if not data:
 				#print("done.")
 				break
+			if hasher != None:
+				hasher.update(data)
 			f.write(data)
+			size += len(data)
 			#print("Read %s bytes"%len(data))
 		f.close()
+		return size
 
 
 	def version_tuple_from_text(self,text):
@@ -1218,8 +1371,8 @@ class Singleton_updater(object):
 
 			return (self._update_ready, self._update_version, self._update_link)
 
-		# primary internet call
-		self.get_tags()  # sets self._tags and self._tag_latest
+		# primary internet call, a check forced by the user ignores the cache TTL (but still uses ETags)
+		self.get_tags(max_age=0 if now else None)  # sets self._tags and self._tag_latest
 
 		self._json["last_check"] = str(datetime.now())
 		self.save_updater_json()
@@ -1459,8 +1612,17 @@ class Singleton_updater(object):
 			if self._print_traces: traceback.print_exc()
 		return json_path
 
-	def set_updater_json(self):
-		"""Load or initialize JSON dictionary data for updater state"""
+	def set_updater_json(self, reload=False):
+		"""Load or initialize JSON dictionary data for updater state
+
+		The file is only read once, unless reload is True
+		"""
+		with self._json_lock:
+			if self._json and not reload:
+				return
+			self.read_updater_json()
+
+	def read_updater_json(self):
 		if self._updater_path == None:
 			raise ValueError("updater_path is not defined")
 		elif os.path.isdir(self._updater_path) == False:
@@ -1501,15 +1663,47 @@ class Singleton_updater(object):
 			self._json["update_ready"] = False
 			self._json["version_text"] = {}
 
-		jpath = self.get_json_path()
-		outf = open(jpath,'w')
-		data_out = json.dumps(self._json, indent=4)
-		outf.write(data_out)
-		outf.close()
+		with self._json_lock:
+			data_out = json.dumps(self._json, indent=4)
+			self.write_file_atomic(self.get_json_path(), data_out)
 		if self._verbose:
 			print(self._addon+": Wrote out updater JSON settings to file, with the contents:")
 			print(self._json)
 
+	def write_file_atomic(self, path, data):
+		"""Write data to path, so that readers only see the previous or the new contents"""
+		temp_path = "{}.{}.tmp".format(path, threading.get_ident())
+		with open(temp_path, 'w') as outf:
+			outf.write(data)
+		os.replace(temp_path, path)
+
+	def get_api_cache_path(self):
+		return os.path.join(self._updater_path,
+			"{}_updater_api_cache.json".format(self._addon_package))
+
+	def get_api_cache(self):
+		"""Returns the cached API responses, loading them from disk if needed"""
+		with self._json_lock:
+			if self._api_cache == None:
+				self._api_cache = {}
+				try:
+					with open(self.get_api_cache_path()) as data_file:
+						self._api_cache = json.load(data_file)
+				except FileNotFoundError:
+					pass
+				except Exception as err:
+					# the cache is only an optimization, start over
+					print("Could not read updater API cache:", err)
+			return self._api_cache
+
+	def save_api_cache(self):
+		with self._json_lock:
+			if self._api_cache == None:
+				return
+			if os.path.isdir(self._updater_path) == False:
+				os.makedirs(self._updater_path)
+			self.write_file_atomic(self.get_api_cache_path(), json.dumps(self._api_cache))
+
 	def json_reset_postupdate(self):
 		self._json["just_updated"] = False
 		self._json["update_ready"] = False
@@ -1700,6 +1894,42 @@ class GitlabEngine(object):
 		return [{"name": tag["name"], "zipball_url": self.get_zip_url(tag["commit"]["id"], updater)} for tag in response]
 
 
+class LocalEngine(object):
+	"""Updates from a local directory (api_url), for testing without a server
+
+	The directory contains tags.json, a list of {"name": tag name, "zipball": zip file name} (newest first),
+	optionally with "sha256" to verify the download, the zip files, and <branch>.zip for each included branch
+	"""
+
+	def __init__(self):
+		self.api_url = None
+		self.token = None
+		self.name = "local"
+
+	def form_repo_url(self, updater):
+		return pathlib.Path(os.path.abspath(self.api_url)).as_uri()
+
+	def form_tags_url(self, updater):
+		return self.get_zip_url("tags.json", updater)
+
+	def form_branch_url(self, branch, updater):
+		return self.get_zip_url(branch + ".zip", updater)
+
+	def get_zip_url(self, name, updater):
+		return pathlib.Path(os.path.abspath(self.api_url), name).as_uri()
+
+	def parse_tags(self, response, updater):
+		if response == None:
+			return []
+		tags = []
+		for tag in response:
+			parsed_tag = {"name": tag["name"], "zipball_url": self.get_zip_url(tag["zipball"], updater)}
+			if "sha256" in tag:
+				parsed_tag["sha256"] = tag["sha256"]
+			tags.append(parsed_tag)
+		return tags
+
+
 # -----------------------------------------------------------------------------
 # The module-shared class instance,
 # should be what's imported to other files
@@ -203,11 +203,10 @@ class addon_updater_install_popup(bpy.types.Operator):
 				else:
 					print("Updater returned {}, error occurred".format(res))
 		elif updater.update_ready == None:
-			_ = updater.check_for_update(now=True)
-
-			# re-launch this dialog
-			atr = addon_updater_install_popup.bl_idname.split(".")
-			getattr(getattr(bpy.ops, atr[0]),atr[1])('INVOKE_DEFAULT')
+			# check in the background rather than blocking the UI on the network,
+			# the result is shown once the check finishes
+			updater.check_for_update_now(ui_refresh)
+			self.report({'INFO'}, "Checking for updates in the background")
 		else:
 			if updater.verbose:
 				print("Doing nothing, not ready for update")
@@ -298,10 +297,10 @@ class addon_updater_update_now(bpy.types.Operator):
 				atr = addon_updater_install_manually.bl_idname.split(".")
 				getattr(getattr(bpy.ops, atr[0]),atr[1])('INVOKE_DEFAULT')
 		elif updater.update_ready == None:
-			(update_ready, version, link) = updater.check_for_update(now=True)
-			# re-launch this dialog
-			atr = addon_updater_install_popup.bl_idname.split(".")
-			getattr(getattr(bpy.ops, atr[0]),atr[1])('INVOKE_DEFAULT')
+			# check in the background rather than blocking the UI on the network,
+			# the result is shown once the check finishes
+			updater.check_for_update_now(ui_refresh)
+			self.report({'INFO'}, "Checking for updates in the background")
 
 		elif updater.update_ready == False:
 			self.report({'INFO'}, "Nothing to update")
@@ -869,41 +868,8 @@ def showReloadPopup():
 # -----------------------------------------------------------------------------
 
 
-@make_annotations
-class AddonUpdaterPreferences():
-
-	auto_check_update = bpy.props.BoolProperty(
-		name="Auto-check for Update",
-		description="If enabled, auto-check for updates using an interval",
-		default=False,
-		)
-	updater_intrval_months = bpy.props.IntProperty(
-		name='Months',
-		description="Number of months between checking for updates",
-		default=0,
-		min=0
-		)
-	updater_intrval_days = bpy.props.IntProperty(
-		name='Days',
-		description="Number of days between checking for updates",
-		default=7,
-		min=0,
-		max=31
-		)
-	updater_intrval_hours = bpy.props.IntProperty(
-		name='Hours',
-		description="Number of hours between checking for updates",
-		default=0,
-		min=0,
-		max=23
-		)
-	updater_intrval_minutes = bpy.props.IntProperty(
-		name='Minutes',
-		description="Number of minutes between checking for updates",
-		default=0,
-		min=0,
-		max=59
-		)
+# AddonUpdaterPreferences is defined in addon_updater_prefs,
+# which can be imported without importing the updater
 
 
 def update_notice_box_ui(self, context):
@@ -1369,6 +1335,11 @@ def register(bl_info):
 	# used to check/compare versions
 	updater.current_version = bl_info["version"]
 
+	# Seconds during which the tags fetched by a background check are reused
+	# without any request, older responses are revalidated with their ETag.
+	# A check started from the "Check now" button ignores this.
+	updater.api_cache_ttl = 3600
+
 	# Optional, to hard-set update frequency, use this here - however,
 	# this demo has this set via UI properties.
 	# updater.set_check_interval(
@@ -451,3 +451,31 @@ if not hasattr(bpy.types, 'ShaderNodeOutput'): # 2.80+
     x, y = node_setup['Output']['location']
     node_setup['Output']['location'] = x + 300, y
     node_setup['Output']['links'] = {'Surface': ('Principled BSDF', 0)}
+
+# default values of ObjexWriter.options, also used as defaults of the export operator properties
+# (kept here so the add-on can register without importing export_objex)
+EXPORT_DEFAULT_OPTIONS = {
+    'TRIANGULATE': True,
+    'EXPORT_SMOOTH_GROUPS': False,
+    'EXPORT_SMOOTH_GROUPS_BITFLAGS': False,
+    'EXPORT_NORMALS': True,
+    'EXPORT_VERTEX_COLORS': True,
+    'EXPORT_UV': True,
+    'EXPORT_MTL': True,
+    'EXPORT_SKEL': True,
+    'EXPORT_ANIM': True,
+    'EXPORT_WEIGHTS': True,
+    'UNIQUE_WEIGHTS': False,
+    'APPLY_MODIFIERS': True,
+    'APPLY_MODIFIERS_RENDER': False,
+    'APPLY_UNUSED_ARMATURE_DEFORM':False,
+    'APPLY_MODIFIERS_AFTER_ARMATURE_DEFORM': False,
+    'KEEP_VERTEX_ORDER': False,
+    'EXPORT_PACKED_IMAGES': False,
+    'EXPORT_PACKED_IMAGES_DIR': '//objex_textures',
+    'DEDUPLICATE_INSTANCES': False,
+    'FIX_CLAMPING': False,
+    'TRACE_MEMORY': False,
+    'GLOBAL_MATRIX': None,
+    'PATH_MODE': 'AUTO'
+}
@@ -2,6 +2,9 @@ from . import blender_version_compatibility
 
 import bpy
 
+import sys
+import time
+
 from . import interface
 from . import logging_util
 
@@ -16,7 +19,7 @@ def material_from_0(material, data, log):
     use_texgen = data.get('use_texgen', 0) == 1
     scaleS = data.get('scaleS', 1)
     scaleT = data.get('scaleT', 1)
-    interface.exec_build_nodes_operator(material)
+    interface.build_material_nodes(material, update_groups=False)
     uvTransformMain = material.node_tree.nodes['OBJEX_TransformUV_Main']
     uvTransformMain.inputs['Texgen'].default_value = use_texgen
     uvTransformMain.inputs['Texgen Linear'].default_value = use_texgen
@@ -45,7 +48,7 @@ def material_from_2(material, data, log):
                 continue
             input_values[input_socket_name] = node.inputs[input_socket_name].default_value
         nodes.remove(node)
-    interface.exec_build_nodes_operator(material)
+    interface.build_material_nodes(material, update_groups=False)
     for name, input_values in socket_data.items():
         node = nodes[name]
         for input_socket_name, default_value in input_values.items():
@@ -54,7 +57,7 @@ def material_from_2(material, data, log):
 
 def nodes_from_5(material, data, log):
     # fix node names
-    interface.exec_build_nodes_operator(material,
+    interface.build_material_nodes(material, update_groups=False,
         init=False, reset=False, create=False,
         update_groups_of_existing=False,
         set_looks=False, set_basic_links=False
@@ -107,7 +110,7 @@ def nodes_from_5(material, data, log):
     # recreate cycle nodes
     for node_name, _ in links.items():
         nodes.remove(nodes[node_name])
-    interface.exec_build_nodes_operator(material,
+    interface.build_material_nodes(material, update_groups=False,
         init=False, reset=False, create=True,
         update_groups_of_existing=False,
         set_looks=False, set_basic_links=False
@@ -135,14 +138,14 @@ def nodes_from_5(material, data, log):
 # if socket inputs/outputs change something like material_from_2 would be more appropriate, this is only for purely group-internal changes
 def node_groups_internal_change_update_material_function(to_version):
     def update_material_function(material, data, log):
-        interface.exec_build_nodes_operator(material, create=False, set_looks=False, set_basic_links=False)
+        interface.build_material_nodes(material, update_groups=False, create=False, set_looks=False, set_basic_links=False)
         data.objex_version = to_version
     return update_material_function
 
 # same as node_groups_internal_change_update_material_function but create nodes
 def node_setup_simple_change_update_material_function(to_version):
     def update_material_function(material, data, log):
-        interface.exec_build_nodes_operator(material, create=True, set_looks=False, set_basic_links=False)
+        interface.build_material_nodes(material, update_groups=False, create=True, set_looks=False, set_basic_links=False)
         data.objex_version = to_version
     return update_material_function
 
@@ -201,6 +204,87 @@ def assert_material_at_current_version(material, errorClass):
             'can be found in the material tab.' % material.name)
     # v == addon_material_objex_version
 
+class MaterialUpdateResult():
+    """
+    Summary of an update_materials call
+    timings maps each version to the time (in seconds) spent updating materials from that version
+    """
+    def __init__(self):
+        self.updated = []
+        self.failed = []
+        self.up_to_date = 0
+        self.timings = dict()
+
+def plan_material_updates(materials):
+    """
+    Group materials by version, returns (materials_by_version, up_to_date_count)
+    materials already at addon_material_objex_version are only counted
+    """
+    materials_by_version = dict()
+    up_to_date_count = 0
+    for material in materials:
+        v = material.objex_bonus.objex_version
+        if v == addon_material_objex_version:
+            up_to_date_count += 1
+        else:
+            materials_by_version.setdefault(v, []).append(material)
+    return materials_by_version, up_to_date_count
+
+def update_materials(materials, log=None):
+    """
+    Update materials to addon_material_objex_version, one version at a time for all materials at once
+    Update functions are called directly (not through operators), node groups are updated once beforehand
+    Returns a MaterialUpdateResult
+    """
+    if not log:
+        log = logging_util.getLogger('data_updater')
+    result = MaterialUpdateResult()
+    materials_by_version, result.up_to_date = plan_material_updates(materials)
+    if not materials_by_version:
+        return result
+    interface.update_node_groups()
+    for v in sorted(v for v in materials_by_version if v > addon_material_objex_version):
+        for material in materials_by_version.pop(v):
+            log.warn('Skipped material {} which uses a newer version', material.name)
+            result.failed.append(material)
+    updated = []
+    updated_names = set()
+    while materials_by_version:
+        v = min(materials_by_version)
+        version_materials = materials_by_version.pop(v)
+        update_func = update_material_functions.get(v)
+        if not update_func:
+            for material in version_materials:
+                log.error('Skipping material {} which uses unknown version {}', material.name, v)
+                result.failed.append(material)
+            continue
+        log.debug('Updating {} materials from version {}', len(version_materials), v)
+        time_start = time.perf_counter()
+        for material in version_materials:
+            data = material.objex_bonus
+            update_func(material, data, log)
+            if material.name not in updated_names:
+                updated_names.add(material.name)
+                updated.append(material)
+            if data.objex_version <= v:
+                log.error('Update of material {} from version {} did not change its version', material.name, v)
+                result.failed.append(material)
+            elif data.objex_version < addon_material_objex_version:
+                # needs further updating
+                materials_by_version.setdefault(data.objex_version, []).append(material)
+        result.timings[v] = time.perf_counter() - time_start
+        log.debug('Updated {} materials from version {} in {:.3f} s', len(version_materials), v, result.timings[v])
+    failed_names = set(material.name for material in result.failed)
+    result.updated = [material for material in updated if material.name not in failed_names]
+    return result
+
+def objex_materials_to_update():
+    return [
+        m for m in bpy.data.materials
+        if m.objex_bonus.is_objex_material
+            and m.objex_bonus.objex_version != addon_material_objex_version
+    ]
+
 class OBJEX_OT_material_update(bpy.types.Operator):
 
     bl_idname = 'objex.material_update'
@@ -214,38 +298,56 @@ class OBJEX_OT_material_update(bpy.types.Operator):
         logging_util.setLogOperator(self, user_friendly_formatter=True)
         try:
             if self.update_all:
-                materials = (
-                    m for m in bpy.data.materials
-                    if m.objex_bonus.is_objex_material
-                        and m.objex_bonus.objex_version != addon_material_objex_version
-                )
+                materials = objex_materials_to_update()
             else:
                 materials = (context.material,)
-            interface.update_node_groups()
-            failures = 0
-            material_count = 0
-            for material in materials:
-                material_count += 1
-                data = material.objex_bonus
-                if data.objex_version > addon_material_objex_version:
-                    log.warn('Skipped material {} which uses a newer version', material.name)
-                    failures += 1
-                    continue
-                while data.objex_version < addon_material_objex_version:
-                    update_func = update_material_functions.get(data.objex_version)
-                    if not update_func:
-                        log.error('Skipping material {} which uses unknown version {}', material.name, data.objex_version)
-                        failures += 1
-                        break
-                    update_func(material, data, log)
-            if failures:
-                log.error('Failed to update {} of {} materials', failures, material_count)
+            result = update_materials(materials, log)
+            material_count = len(result.updated) + len(result.failed)
+            if result.failed:
+                log.error('Failed to update {} of {} materials', len(result.failed), material_count)
+            elif not material_count:
+                log.info('Nothing to update, {} materials already up to date', result.up_to_date)
             else:
                 log.info('Successfully updated {} materials', material_count)
             return {'FINISHED'}
         finally:
             logging_util.setLogOperator(None)
 
+def update_blend_files(filepaths, log=None):
+    """
+    Update the objex materials of .blend files, saving the files that had materials updated
+    Opens each file in turn (the current file is replaced), meant for background mode, for example with:
+    blender -b --python-expr "import io_export_objex2.data_updater as du; du.update_blend_files_main()" -- a.blend b.blend
+    Returns {filepath: MaterialUpdateResult}, the result is None for files which failed to open, update or save
+    (the error is logged and the remaining files are still updated)
+    """
+    if not log:
+        log = logging_util.getLogger('data_updater')
+    results = dict()
+    for filepath in filepaths:
+        results[filepath] = None
+        try:
+            bpy.ops.wm.open_mainfile(filepath=filepath, load_ui=False)
+            time_start = time.perf_counter()
+            result = update_materials(objex_materials_to_update(), log)
+            if result.updated:
+                bpy.ops.wm.save_mainfile()
+        except Exception:
+            log.exception('{}: failed to update the file', filepath)
+            continue
+        results[filepath] = result
+        log.info('{}: updated {} materials, failed {}, {} up to date ({:.3f} s)',
+            filepath, len(result.updated), len(result.failed), result.up_to_date,
+            time.perf_counter() - time_start)
+    return results
+
+def update_blend_files_main():
+    """Calls update_blend_files with the command line arguments after --"""
+    argv = sys.argv[sys.argv.index('--') + 1:] if '--' in sys.argv else []
+    results = update_blend_files(argv)
+    if any(result is None or result.failed for result in results.values()):
+        sys.exit(1)
+
 classes = (
     OBJEX_OT_material_update,
 )
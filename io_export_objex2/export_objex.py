@@ -20,59 +20,274 @@ from . import blender_version_compatibility
 
 import os
 import time
+import array
+
+import numpy
 
 import bpy
 import mathutils
 import bpy_extras.io_utils
 
-try:
-    from progress_report import ProgressReport, ProgressReportSubstep
-except ImportError:
-    from bpy_extras.wm_utils.progress_report import ProgressReport, ProgressReportSubstep
-
+from . import const_data as CST
 from . import export_objex_mtl
 from . import export_objex_anim
+from . import export_objex_preflight
+from . import progress_util
 from . import util
 from .logging_util import getLogger
 
 
-def mesh_triangulate(me):
+def mesh_triangulate(me, polygon_indices=None):
+    """Triangulates the polygons of me with the given indices (default all) using BMesh"""
     import bmesh
     bm = bmesh.new()
     bm.from_mesh(me)
-    bmesh.ops.triangulate(bm, faces=bm.faces)
+    if polygon_indices is None:
+        faces = bm.faces
+    else:
+        bm.faces.ensure_lookup_table()
+        faces = [bm.faces[i] for i in polygon_indices]
+    bmesh.ops.triangulate(bm, faces=faces)
     bm.to_mesh(me)
     bm.free()
 
-def roundVect3d(v, digits):
-    return round(v.x, digits), round(v.y, digits), round(v.z, digits)
+def mesh_loop_totals(me):
+    loop_totals = numpy.empty(len(me.polygons), dtype=numpy.int32)
+    me.polygons.foreach_get('loop_total', loop_totals)
+    return loop_totals
+
+def mesh_polygons_corners(me, polygon_indices):
+    """
+    Returns (loop_totals, positions) for the polygons of me with the given indices,
+    positions being the coordinates of their corners, polygon after polygon, as a (corner count, 3) array
+    """
+    loop_totals = mesh_loop_totals(me)[polygon_indices]
+    loop_starts = numpy.empty(len(me.polygons), dtype=numpy.int32)
+    me.polygons.foreach_get('loop_start', loop_starts)
+    loop_starts = loop_starts[polygon_indices]
+    loops_vertex_index = numpy.empty(len(me.loops), dtype=numpy.int32)
+    me.loops.foreach_get('vertex_index', loops_vertex_index)
+    co = numpy.empty(len(me.vertices) * 3, dtype=numpy.float32)
+    me.vertices.foreach_get('co', co)
+    corner_offsets = numpy.repeat(numpy.cumsum(loop_totals) - loop_totals, loop_totals)
+    corner_loops = numpy.repeat(loop_starts, loop_totals) + numpy.arange(len(corner_offsets)) - corner_offsets
+    return loop_totals, co.reshape(-1, 3)[loops_vertex_index[corner_loops]].astype(numpy.float64)
+
+def polygons_convex(me, polygon_indices):
+    """Returns a boolean array telling which of the polygons of me with the given indices are convex"""
+    loop_totals, positions = mesh_polygons_corners(me, polygon_indices)
+    polygon_offsets = numpy.cumsum(loop_totals) - loop_totals
+    corner_offsets = numpy.repeat(polygon_offsets, loop_totals)
+    corner_totals = numpy.repeat(loop_totals, loop_totals)
+    corners = numpy.arange(len(positions)) - corner_offsets
+    previous_corners = corner_offsets + (corners - 1) % corner_totals
+    next_corners = corner_offsets + (corners + 1) % corner_totals
+    edges_in = positions - positions[previous_corners]
+    edges_out = positions[next_corners] - positions
+    normals = numpy.empty(len(me.polygons) * 3, dtype=numpy.float32)
+    me.polygons.foreach_get('normal', normals)
+    normals = numpy.repeat(normals.reshape(-1, 3)[polygon_indices], loop_totals, axis=0)
+    # |in| |out| sin and cos of the angle each corner turns by, around the polygon normal
+    turns_sin = (numpy.cross(edges_in, edges_out) * normals).sum(axis=1)
+    turns_cos = (edges_in * edges_out).sum(axis=1)
+    # a corner turning the other way than the polygon normal is a reflex corner
+    # (relative to the edge lengths, to not depend on the mesh scale)
+    edges_lengths = numpy.sqrt((edges_in * edges_in).sum(axis=1) * (edges_out * edges_out).sum(axis=1))
+    reflex_corners = turns_sin < -1e-6 * edges_lengths
+    # corners of self-intersecting polygons (like a star) can all turn the same way,
+    # but then the polygon winds around more than once: the turn angles don't add up to a single turn
+    turns_total = numpy.add.reduceat(numpy.arctan2(turns_sin, turns_cos), polygon_offsets)
+    winds_once = numpy.abs(turns_total - 2 * numpy.pi) < 1e-3
+    return winds_once & ~numpy.logical_or.reduceat(reflex_corners, polygon_offsets)
+
+def mesh_triangulate_nonconvex(me):
+    """
+    Triangulates, using BMesh, the polygons of me which aren't triangles and aren't convex
+    The other polygons are left for mesh_fan_triangles to split when writing
+    Returns False if me only has triangles
+    """
+    loop_totals = mesh_loop_totals(me)
+    polygon_indices = numpy.flatnonzero(loop_totals != 3)
+    if not len(polygon_indices):
+        return False
+    convex = polygons_convex(me, polygon_indices)
+    if not convex.all():
+        mesh_triangulate(me, polygon_indices[~convex].tolist())
+    return True
+
+# corners of the triangles for a quad split along one of its diagonals
+quad_triangles_diagonal_02 = ((0, 1, 2), (0, 2, 3))
+quad_triangles_diagonal_13 = ((0, 1, 3), (1, 2, 3))
+
+def mesh_fan_triangles(me):
+    """
+    Returns {polygon index: [(corner, corner, corner), ...]} telling how to split
+    the polygons of me which aren't triangles (expected to be convex, see mesh_triangulate_nonconvex)
+    Quads are split along their shortest diagonal, other polygons are fan-triangulated from their first corner
+    """
+    loop_totals = mesh_loop_totals(me)
+    polygon_indices = numpy.flatnonzero(loop_totals != 3)
+    face_triangles = {}
+    quads = polygon_indices[loop_totals[polygon_indices] == 4]
+    if len(quads):
+        _, positions = mesh_polygons_corners(me, quads)
+        positions = positions.reshape(-1, 4, 3)
+        diagonal_02 = positions[:,2] - positions[:,0]
+        diagonal_13 = positions[:,3] - positions[:,1]
+        use_diagonal_13 = (diagonal_13 * diagonal_13).sum(axis=1) < (diagonal_02 * diagonal_02).sum(axis=1)
+        for polygon_index, quad_use_diagonal_13 in zip(quads.tolist(), use_diagonal_13.tolist()):
+            face_triangles[polygon_index] = quad_triangles_diagonal_13 if quad_use_diagonal_13 else quad_triangles_diagonal_02
+    ngons = polygon_indices[loop_totals[polygon_indices] > 4]
+    for polygon_index, loop_total in zip(ngons.tolist(), loop_totals[ngons].tolist()):
+        face_triangles[polygon_index] = [(0, corner, corner + 1) for corner in range(1, loop_total - 1)]
+    return face_triangles
+
+class VertexWeightTable():
+    """
+    Vertex groups assignments and weights of all vertices of a mesh, stored as flat arrays
+    The groups of vertex i are group_indices[offsets[i]:offsets[i+1]], with matching weights
+    """
+    def __init__(self, offsets, group_indices, weights):
+        self.offsets = offsets
+        self.group_indices = group_indices
+        self.weights = weights
+
+    @staticmethod
+    def from_vertices(vertices):
+        counts = array.array('i')
+        group_indices = array.array('i')
+        weights = array.array('f')
+        for v in vertices:
+            groups = v.groups
+            counts.append(len(groups))
+            group_indices.extend(g.group for g in groups)
+            weights.extend(g.weight for g in groups)
+        offsets = numpy.zeros(len(counts) + 1, dtype=numpy.int64)
+        numpy.cumsum(numpy.array(counts, dtype=numpy.int32), out=offsets[1:])
+        return VertexWeightTable(
+            offsets,
+            numpy.array(group_indices, dtype=numpy.int32),
+            numpy.array(weights, dtype=numpy.float32)
+        )
+
+    def vertex_count(self):
+        return len(self.offsets) - 1
+
+    def vertex_indices(self):
+        """the vertex index of each entry"""
+        return numpy.repeat(numpy.arange(self.vertex_count(), dtype=numpy.int32), numpy.diff(self.offsets))
+
+    def filtered(self, keep):
+        """keep is a boolean array with one value per entry"""
+        counts = numpy.bincount(self.vertex_indices()[keep], minlength=self.vertex_count())
+        offsets = numpy.zeros(len(counts) + 1, dtype=numpy.int64)
+        numpy.cumsum(counts, out=offsets[1:])
+        return VertexWeightTable(offsets, self.group_indices[keep], self.weights[keep])
+
+    def filtered_groups(self, group_mask):
+        """only keep groups with group_mask[group index] True"""
+        group_mask = numpy.asarray(group_mask, dtype=bool)
+        keep = self.group_indices < len(group_mask)
+        keep[keep] = group_mask[self.group_indices[keep]]
+        return self.filtered(keep)
+
+    def max_weight_groups(self):
+        """
+        For each vertex, the group index with the maximum weight, or -1 if the vertex has no groups
+        Ties are resolved like max() would, by using the first group
+        """
+        vertex_indices = self.vertex_indices()
+        max_groups = numpy.full(self.vertex_count(), -1, dtype=numpy.int32)
+        if not len(vertex_indices):
+            return max_groups
+        # np.lexsort is stable, sort by vertex index then by decreasing weight
+        order = numpy.lexsort((-self.weights, vertex_indices))
+        sorted_vertex_indices = vertex_indices[order]
+        segment_starts = numpy.ones(len(order), dtype=bool)
+        segment_starts[1:] = sorted_vertex_indices[1:] != sorted_vertex_indices[:-1]
+        max_groups[sorted_vertex_indices[segment_starts]] = self.group_indices[order[segment_starts]]
+        return max_groups
+
+def face_sort_order(mesh, smooth_groups, sort_by_material, uv_texture=None):
+    """
+    Returns polygon indices sorted by material, then face image (uv_texture, < 2.80), then smooth group
+    smooth_groups is as returned by mesh.calc_smooth_groups, or empty to sort by use_smooth
+    The sort is stable, so faces sharing the same key keep their original order
+    """
+    polygons = mesh.polygons
+    count = len(polygons)
+    use_smooth = numpy.empty(count, dtype=bool)
+    polygons.foreach_get('use_smooth', use_smooth)
+    if smooth_groups:
+        smooth_key = numpy.where(use_smooth, numpy.asarray(smooth_groups, dtype=numpy.int64), 0)
+    else:
+        smooth_key = use_smooth
+    # np.lexsort uses the last key as primary key
+    keys = [smooth_key]
+    if uv_texture is not None:
+        image_ids = {}
+        keys.append(numpy.fromiter(
+            (image_ids.setdefault(face_texture.image, len(image_ids)) for face_texture in uv_texture),
+            dtype=numpy.int32, count=count))
+    if sort_by_material or uv_texture is not None:
+        material_index = numpy.empty(count, dtype=numpy.int32)
+        polygons.foreach_get('material_index', material_index)
+        keys.append(material_index)
+    return numpy.lexsort(keys)
+
+class InstanceTemplate():
+    """
+    What is needed to write again the geometry of an object, with another transform
+    positions and loop_normals are in object (local) space
+    faces is a list of (directives, vertex indices, uv indices, loop indices, triangles) tuples, in writing order
+    (triangles is as in mesh_fan_triangles, or None)
+    """
+    def __init__(self):
+        self.positions = None
+        self.vertex_suffixes = None
+        self.uv_block = ''
+        self.uv_unique_count = 0
+        self.loop_normals = None
+        self.vc_block = ''
+        self.vc_unique_count = 0
+        self.loops_to_vertex_colors = None
+        self.faces = []
+
+def mesh_positions(me):
+    """Returns the vertex coordinates of me as a (vertex count, 3) array"""
+    co = numpy.empty(len(me.vertices) * 3, dtype=numpy.float32)
+    me.vertices.foreach_get('co', co)
+    return co.reshape(-1, 3).astype(numpy.float64)
+
+def mesh_loop_normals(me):
+    """Returns the (split) normals of the loops of me as a (loop count, 3) array"""
+    normals = numpy.empty(len(me.loops) * 3, dtype=numpy.float32)
+    me.loops.foreach_get('normal', normals)
+    return normals.reshape(-1, 3).astype(numpy.float64)
+
+def transform_positions(positions, matrix):
+    """Applies the 4x4 matrix (a numpy array) to a (count, 3) array of positions"""
+    return numpy.dot(positions, matrix[:3,:3].T) + matrix[:3,3]
+
+def transform_normals(normals, matrix):
+    """
+    Applies the 4x4 matrix (a numpy array) to a (count, 3) array of normals,
+    that is its 3x3 part inverted and transposed, and normalizes them
+    """
+    normals = numpy.dot(normals, numpy.linalg.inv(matrix[:3,:3]))
+    lengths = numpy.sqrt((normals * normals).sum(axis=1))
+    lengths[lengths == 0] = 1
+    return normals / lengths[:, numpy.newaxis]
+
+def reversed_winding(corners):
+    """Reverses the order of corners, keeping the first corner first (like Mesh.flip_normals)"""
+    return [corners[0]] + list(reversed(corners[1:]))
 
 def roundVect2d(v, digits):
     return round(v[0], digits), round(v[1], digits)
 
 class ObjexWriter():
-    default_options = {
-        'TRIANGULATE': True,
-        'EXPORT_SMOOTH_GROUPS': False,
-        'EXPORT_SMOOTH_GROUPS_BITFLAGS': False,
-        'EXPORT_NORMALS': True,
-        'EXPORT_VERTEX_COLORS': True,
-        'EXPORT_UV': True,
-        'EXPORT_MTL': True,
-        'EXPORT_SKEL': True,
-        'EXPORT_ANIM': True,
-        'EXPORT_WEIGHTS': True,
-        'UNIQUE_WEIGHTS': False,
-        'APPLY_MODIFIERS': True,
-        'APPLY_MODIFIERS_RENDER': False,
-        'APPLY_UNUSED_ARMATURE_DEFORM':False,
-        'APPLY_MODIFIERS_AFTER_ARMATURE_DEFORM': False,
-        'KEEP_VERTEX_ORDER': False,
-        'EXPORT_PACKED_IMAGES': False,
-        'EXPORT_PACKED_IMAGES_DIR': '//objex_textures',
-        'GLOBAL_MATRIX': None,
-        'PATH_MODE': 'AUTO'
-    }
+    default_options = CST.EXPORT_DEFAULT_OPTIONS
     
     def __init__(self, context):
         self.log = getLogger('ObjexWriter')
@@ -117,23 +332,24 @@ class ObjexWriter():
                 self.filepath_anim = os.path.splitext(self.filepath)[0] + ".anim"
                 fw('animlib %s\n' % repr(os.path.basename(self.filepath_anim))[1:-1])
     
-    def write_uvs(self, mesh, face_index_pairs):
+    def write_uvs(self, mesh, face_indices):
         fw = self.fw_objex
         
         uv_unique_count = 0
+        polygons = mesh.polygons
         loops = mesh.loops
         uv_layer = mesh.uv_layers.active.data[:]
         
         # in case removing some of these dont get defined.
         uv = f_index = uv_index = uv_key = uv_val = uv_ls = None
 
-        uv_face_mapping = [None] * len(face_index_pairs)
+        uv_face_mapping = [None] * len(polygons)
 
         uv_dict = {}
         uv_get = uv_dict.get
-        for f, f_index in face_index_pairs:
+        for f_index in face_indices:
             uv_ls = uv_face_mapping[f_index] = []
-            for uv_index, l_index in enumerate(f.loop_indices):
+            for uv_index, l_index in enumerate(polygons[f_index].loop_indices):
                 uv = uv_layer[l_index].uv
                 # include the vertex index in the key so we don't share UV's between vertices,
                 # allowed by the OBJ spec but can cause issues for other importers, see: T47010.
@@ -151,19 +367,23 @@ class ObjexWriter():
         
         return uv_face_mapping, uv_unique_count
     
-    def write_normals(self, mesh, face_index_pairs):
+    def write_normals(self, loop_normals, faces_loop_indices):
+        """
+        loop_normals is a (loop count, 3) array of the normals to write, per loop
+        faces_loop_indices iterates over the loop indices of each face, in writing order
+        """
         fw = self.fw_objex
         
         no_unique_count = 0
-        loops = mesh.loops
+        loop_normals = numpy.round(loop_normals, 4).tolist()
         
         no_key = no_val = None
         normals_to_idx = {}
         no_get = normals_to_idx.get
-        loops_to_normals = [0] * len(loops)
-        for f, f_index in face_index_pairs:
-            for l_idx in f.loop_indices:
-                no_key = roundVect3d(loops[l_idx].normal, 4)
+        loops_to_normals = [0] * len(loop_normals)
+        for loop_indices in faces_loop_indices:
+            for l_idx in loop_indices:
+                no_key = tuple(loop_normals[l_idx])
                 no_val = no_get(no_key)
                 if no_val is None:
                     no_val = normals_to_idx[no_key] = no_unique_count
@@ -172,21 +392,22 @@ class ObjexWriter():
                 loops_to_normals[l_idx] = no_val
         return loops_to_normals, no_unique_count
     
-    def write_vertex_colors(self, mesh, face_index_pairs):
+    def write_vertex_colors(self, mesh, face_indices):
         if not len(mesh.vertex_colors):
             return None, 0
         
         fw = self.fw_objex
         
         vc_unique_count = 0
+        polygons = mesh.polygons
         loops = mesh.loops
         loop_colors = mesh.vertex_colors.active.data[:] # 421todo allow choosing a layer
         
         vc_key = vc_val = None
         vertex_colors_to_idx = {}
         loops_to_vertex_colors = [0] * len(loops)
-        for f, f_index in face_index_pairs:
-            for l_idx in f.loop_indices:
+        for f_index in face_indices:
+            for l_idx in polygons[f_index].loop_indices:
                 color = loop_colors[l_idx].color
                 # 3 digits: 1/256 ~ 0.0039
                 if len(color) == 3:
@@ -202,368 +423,544 @@ class ObjexWriter():
                 loops_to_vertex_colors[l_idx] = vc_val
         return loops_to_vertex_colors, vc_unique_count
     
-    def write_object(self, progress, ob, ob_mat):
+    def get_modifiers_show(self, ob):
+        """
+        Returns a list of (modifier, show) tuples for the modifiers of ob which visibility
+        needs to be set to show for exporting (for example, disabling armature deform)
+        """
         log = self.log
+        rigged_to_armature = ob.find_armature()
+        modifiers_show = []
+        found_armature_deform = False
+        for modifier in ob.modifiers:
+            disable_modifier = False
+            if found_armature_deform and not self.options['APPLY_MODIFIERS_AFTER_ARMATURE_DEFORM']:
+                log.info('Skipped modifier {} which is down of the armature deform modifier', modifier.name)
+                disable_modifier = True
+            if modifier.type == 'ARMATURE' and rigged_to_armature and (
+                # don't apply armature deform (aka disable modifier) if armature is exported,
+                # or if the armature deform should be applied for armatures that aren't exported ("UNUSED")
+                rigged_to_armature in self.objects or not self.options['APPLY_UNUSED_ARMATURE_DEFORM']
+            ):
+                if modifier.object == rigged_to_armature:
+                    if found_armature_deform:
+                        log.warning('Found several armature deform modifiers on object {} using armature {}',
+                            ob.name, rigged_to_armature.name)
+                    found_armature_deform = True
+                    disable_modifier = True
+                else:
+                    log.warning('Object {} was found to be rigged to {} but it also has an armature deform modifier using {}',
+                        ob.name, rigged_to_armature.name, modifier.object.name if modifier.object else None)
+            if disable_modifier:
+                modifiers_show.append((modifier, False))
+            elif self.using_depsgraph:
+                modifiers_show.append((modifier, modifier.show_render if self.options['APPLY_MODIFIERS_RENDER'] else modifier.show_viewport))
+        return modifiers_show
+
+    def set_modifiers_show(self, modifiers_show):
+        """
+        Set the visibility of modifiers from a list of (modifier, show) tuples
+        Returns the user settings, to be passed to restore_modifiers_show
+        """
+        user_show_modifiers = []
+        for modifier, modifier_show in modifiers_show:
+            user_show_modifiers.append((modifier, modifier.show_viewport, modifier.show_render))
+            modifier.show_viewport = modifier_show
+            modifier.show_render = modifier_show
+        return user_show_modifiers
+
+    def restore_modifiers_show(self, user_show_modifiers):
+        for modifier, user_show_viewport, user_show_render in user_show_modifiers:
+            modifier.show_viewport = user_show_viewport
+            modifier.show_render = user_show_render
+
+    def get_instance_key(self, ob):
+        """
+        Returns a key identifying the geometry written for ob up to its transform, with DEDUPLICATE_INSTANCES,
+        that is its mesh data, its modifier stack and the object settings affecting exporting.
+        Returns None if ob isn't a mesh or if its geometry may depend on other objects.
+        """
+        if not self.options['DEDUPLICATE_INSTANCES'] or ob.type != 'MESH':
+            return None
+        modifiers_key = []
+        if self.options['APPLY_MODIFIERS']:
+            for modifier in ob.modifiers:
+                if not (modifier.show_render if self.options['APPLY_MODIFIERS_RENDER'] else modifier.show_viewport):
+                    continue
+                # geometry nodes inputs aren't rna properties
+                if modifier.type == 'NODES':
+                    return None
+                modifier_key = [modifier.type]
+                for prop in modifier.bl_rna.properties:
+                    if prop.identifier in ('rna_type', 'name', 'show_expanded'):
+                        continue
+                    value = getattr(modifier, prop.identifier)
+                    if prop.type == 'POINTER':
+                        # the result depends on the transform of the other object
+                        if isinstance(value, bpy.types.Object):
+                            return None
+                        # settings stored in another struct
+                        if value is not None and not isinstance(value, bpy.types.ID):
+                            return None
+                    elif prop.type == 'COLLECTION':
+                        if len(value):
+                            return None
+                        value = None
+                    elif prop.type == 'ENUM' and prop.is_enum_flag:
+                        value = frozenset(value)
+                    elif getattr(prop, 'array_length', 0):
+                        value = tuple(value)
+                    try:
+                        hash(value)
+                    except TypeError:
+                        return None
+                    modifier_key.append(value)
+                modifiers_key.append(tuple(modifier_key))
+        return (
+            ob.data,
+            tuple(modifiers_key),
+            ob.find_armature(),
+            tuple(ob.vertex_groups.keys()),
+            tuple(slot.material for slot in ob.material_slots),
+            ob.show_only_shape_key,
+            ob.active_shape_key_index,
+        )
+
+    def write_object_instance(self, ob, ob_mat, template):
+        """
+        Writes ob from the template recorded when writing another object with the same instance key
+        Positions and normals are transformed, everything else is written as it was
+        """
         fw = self.fw_objex
-        scene = self.context.scene
-        
-        with ProgressReportSubstep(progress, 6) as subprogress2:
 
-            if self.options['EXPORT_SKEL'] and ob.type == 'ARMATURE':
-                if self.options['EXPORT_ANIM']:
-                    objex_data = ob.data.objex_bonus
-                    if objex_data.export_all_actions:
-                        actions = bpy.data.actions
-                    else:
-                        if blender_version_compatibility.no_ID_PointerProperty:
-                            actions = [bpy.data.actions[item.action] for item in objex_data.export_actions if item.action]
-                        else:
-                            actions = [item.action for item in objex_data.export_actions if item.action]
-                else:
-                    actions = []
-                self.armatures.append((util.quote(ob.name), ob, ob_mat, actions))
+        rigged_to_armature = ob.find_armature()
+        rig_is_exported = self.options['EXPORT_SKEL'] and (rigged_to_armature in self.objects)
+
+        self.write_object_header(ob, rigged_to_armature, rig_is_exported)
+
+        transform = numpy.array(
+            blender_version_compatibility.matmul(self.options['GLOBAL_MATRIX'], ob_mat), dtype=numpy.float64)
+
+        if rigged_to_armature and rig_is_exported:
+            fw('useskel %s\n' % util.quote(rigged_to_armature.name))
+        positions = transform_positions(template.positions, transform).tolist()
+        if template.vertex_suffixes:
+            for co, vertex_suffix in zip(positions, template.vertex_suffixes):
+                fw('v %.6f %.6f %.6f%s\n' % (co[0], co[1], co[2], vertex_suffix))
+        else:
+            for co in positions:
+                fw('v %.6f %.6f %.6f\n' % tuple(co))
+        del positions
+
+        fw(template.uv_block)
+
+        if template.loop_normals is not None:
+            loops_to_normals, no_unique_count = self.write_normals(
+                transform_normals(template.loop_normals, transform),
+                (f_loops for face_directives, f_vertices, f_uvs, f_loops, f_triangles in template.faces))
+            has_normals = True
+        else:
+            no_unique_count = 0
+            has_normals = False
+
+        fw(template.vc_block)
+        loops_to_vertex_colors = template.loops_to_vertex_colors
+        has_vertex_colors = loops_to_vertex_colors is not None
+
+        # If negative scaling, reverse winding order
+        flip = numpy.linalg.det(transform[:3,:3]) < 0.0
+
+        for face_directives, f_vertices, f_uvs, f_loops, f_triangles in template.faces:
+            fw(face_directives)
+            for corners in (f_triangles or (range(len(f_loops)),)):
+                if flip:
+                    corners = reversed_winding(corners)
+                fw('f')
+                for vi in corners:
+                    f_v_data = []
+                    f_v_data.append(self.total_vertex + f_vertices[vi])
+                    if f_uvs is not None:
+                        f_v_data.append(self.total_uv + f_uvs[vi])
+                    if has_normals:
+                        f_v_data += [None] * (2 - len(f_v_data))
+                        f_v_data.append(self.total_normal + loops_to_normals[f_loops[vi]])
+                    if has_vertex_colors:
+                        f_v_data += [None] * (3 - len(f_v_data))
+                        f_v_data.append(self.total_vertex_color + loops_to_vertex_colors[f_loops[vi]])
+                    # v[/vt[/vn[/vc]]] coordinates/uv/normal/color
+                    fw(' %s' % '/'.join(['' if _i is None else ('%d' % _i) for _i in f_v_data]))
+                fw('\n')
 
-            rigged_to_armature = ob.find_armature()
+        self.total_vertex += len(template.positions)
+        self.total_uv += template.uv_unique_count
+        self.total_normal += no_unique_count
+        self.total_vertex_color += template.vc_unique_count
 
-            apply_modifiers = self.options['APPLY_MODIFIERS']
-            using_depsgraph = hasattr(self.context, 'evaluated_depsgraph_get') # True in 2.80+
-            # disable armature deform modifiers
-            user_show_armature_modifiers = []
-            if apply_modifiers:
-                found_armature_deform = False
-                for modifier in ob.modifiers:
-                    disable_modifier = False
-                    if found_armature_deform and not self.options['APPLY_MODIFIERS_AFTER_ARMATURE_DEFORM']:
-                        log.info('Skipped modifier {} which is down of the armature deform modifier', modifier.name)
-                        disable_modifier = True
-                    if modifier.type == 'ARMATURE' and rigged_to_armature and (
-                        # don't apply armature deform (aka disable modifier) if armature is exported,
-                        # or if the armature deform should be applied for armatures that aren't exported ("UNUSED")
-                        rigged_to_armature in self.objects or not self.options['APPLY_UNUSED_ARMATURE_DEFORM']
-                    ):
-                        if modifier.object == rigged_to_armature:
-                            if found_armature_deform:
-                                log.warning('Found several armature deform modifiers on object {} using armature {}',
-                                    ob.name, rigged_to_armature.name)
-                            found_armature_deform = True
-                            disable_modifier = True
-                        else:
-                            log.warning('Object {} was found to be rigged to {} but it also has an armature deform modifier using {}',
-                                ob.name, rigged_to_armature.name, modifier.object.name if modifier.object else None)
-                    modifier_show = None
-                    if disable_modifier:
-                        modifier_show = False
-                    elif using_depsgraph:
-                        modifier_show = modifier.show_render if self.options['APPLY_MODIFIERS_RENDER'] else modifier.show_viewport
-                    if modifier_show is not None:
-                        user_show_armature_modifiers.append((modifier, modifier.show_viewport, modifier.show_render))
-                        modifier.show_viewport = modifier_show
-                        modifier.show_render = modifier_show
-
-            if using_depsgraph: # 2.80+
-                depsgraph = self.context.evaluated_depsgraph_get()
-                ob_for_convert = ob.evaluated_get(depsgraph) if apply_modifiers else ob.original
-                del depsgraph
+    def write_object_header(self, ob, rigged_to_armature, rig_is_exported):
+        """
+        Writes the g directive and the per-object directives (priority, origin, attrib)
+        """
+        log = self.log
+        fw = self.fw_objex
+
+        util.detect_zztag(log, ob.name)
+        fw('g %s\n' % util.quote(ob.name))
+
+        if ob.type == 'MESH':
+            objex_data = ob.data.objex_bonus # ObjexMeshProperties
+            if objex_data.priority != 0:
+                fw('priority %d\n' % objex_data.priority)
+            if objex_data.write_origin == 'YES' or (
+                objex_data.write_origin == 'AUTO'
+                and objex_data.attrib_billboard != 'NONE'
+            ):
+                fw('origin %.6f %.6f %.6f\n'
+                    % tuple(blender_version_compatibility.matmul(self.options['GLOBAL_MATRIX'], ob.location)))
+            if objex_data.attrib_billboard != 'NONE':
+                fw('attrib %s\n' % objex_data.attrib_billboard)
+            for attrib in ('POSMTX', 'PROXY'):
+                if getattr(objex_data, 'attrib_%s' % attrib):
+                    fw('attrib %s\n' % attrib)
+            # export those attributes when the properties are shown in the ui, that is when the mesh is rigged
+            if rigged_to_armature:
+                for attrib in ('LIMBMTX', 'NOSPLIT', 'NOSKEL'):
+                    if getattr(objex_data, 'attrib_%s' % attrib):
+                        # otherwise skipped, warned about by export_objex_preflight.check_rig_attributes
+                        if rig_is_exported:
+                            fw('attrib %s\n' % attrib)
+
+    def write_object(self, ob, ob_mat):
+        log = self.log
+        fw = self.fw_objex
+        scene = self.context.scene
+
+        if self.options['EXPORT_SKEL'] and ob.type == 'ARMATURE':
+            if self.options['EXPORT_ANIM']:
+                objex_data = ob.data.objex_bonus
+                if objex_data.export_all_actions:
+                    actions = bpy.data.actions
+                else:
+                    if blender_version_compatibility.no_ID_PointerProperty:
+                        actions = [bpy.data.actions[item.action] for item in objex_data.export_actions if item.action]
+                    else:
+                        actions = [item.action for item in objex_data.export_actions if item.action]
             else:
-                ob_for_convert = None
-
-            try:
-                if not ob_for_convert: # < 2.80
-                    me = ob.to_mesh(scene, apply_modifiers, calc_tessface=False,
-                                    settings='RENDER' if self.options['APPLY_MODIFIERS_RENDER'] else 'PREVIEW')
-                else: # 2.80+
-                    # 421fixme should preserve_all_data_layers=True be used?
-                    me = ob_for_convert.to_mesh()
-            except RuntimeError:
+                actions = []
+            self.armatures.append(export_objex_anim.ArmatureEntry(ob, ob_mat, actions,
+                self.preflight.bones_orders.get(ob)))
+
+        rigged_to_armature = ob.find_armature()
+
+        apply_modifiers = self.options['APPLY_MODIFIERS']
+        if self.using_depsgraph: # 2.80+
+            # modifiers visibility was already set for all objects before evaluating self.depsgraph, see write
+            ob_for_convert = ob.evaluated_get(self.depsgraph) if apply_modifiers else ob.original
+            user_show_modifiers = []
+        else:
+            ob_for_convert = None
+            # disable armature deform modifiers
+            user_show_modifiers = self.set_modifiers_show(self.get_modifiers_show(ob)) if apply_modifiers else []
+
+        instance_key = template = None
+        try:
+            # the key is computed with modifiers set as they are for exporting
+            instance_key = self.get_instance_key(ob)
+            template = self.instance_templates.get(instance_key) if instance_key is not None else None
+            if template:
+                # already converted and written, see write_object_instance
                 me = None
-            finally:
-                # restore modifiers properties
-                for modifier, user_show_viewport, user_show_render in user_show_armature_modifiers:
-                    modifier.show_viewport = user_show_viewport
-                    modifier.show_render = user_show_render
-
-            if me is None:
-                return
-
-            # _must_ do this before applying transformation, else tessellation may differ
-            if self.options['TRIANGULATE']:
-                if not all(len(polygon.vertices) == 3 for polygon in me.polygons):
-                    notes = []
-                    if any(modifier.type == 'TRIANGULATE' for modifier in ob.modifiers):
-                        notes.append('mesh has a triangulate modifier')
-                        if apply_modifiers:
-                            notes.append('even after applying modifiers')
-                        else:
-                            notes.append('modifiers are not being applied (check export options)')
-                        if rigged_to_armature and not self.options['APPLY_MODIFIERS_AFTER_ARMATURE_DEFORM']:
-                            notes.append('mesh is rigged and only modifiers before armature deform are used\n'
-                                '(move the triangulate modifier up, or check export options)')
+            elif not ob_for_convert: # < 2.80
+                me = ob.to_mesh(scene, apply_modifiers, calc_tessface=False,
+                                settings='RENDER' if self.options['APPLY_MODIFIERS_RENDER'] else 'PREVIEW')
+            else: # 2.80+
+                # 421fixme should preserve_all_data_layers=True be used?
+                me = ob_for_convert.to_mesh()
+        except RuntimeError:
+            me = None
+        finally:
+            self.restore_modifiers_show(user_show_modifiers)
+
+        if template:
+            log.debug('Writing {} from the geometry already written for an identical object', ob.name)
+            self.write_object_instance(ob, ob_mat, template)
+            return
+
+        if me is None:
+            return
+
+        # only keep what is needed to write the geometry again if another object to write uses the same mesh
+        if instance_key is not None and self.mesh_users.get(ob.data, 0) > 1:
+            template = InstanceTemplate()
+
+        # _must_ do this before applying transformation, else tessellation may differ
+        # only non-convex polygons are triangulated here, others are split when writing (see mesh_fan_triangles)
+        has_non_triangles = False
+        if self.options['TRIANGULATE']:
+            has_non_triangles = mesh_triangulate_nonconvex(me)
+            if has_non_triangles and ob.name in self.preflight.not_triangulated:
+                log.debug('Triangulated {}, as warned about by preflight', ob.name)
+            elif has_non_triangles:
+                notes = []
+                if any(modifier.type == 'TRIANGULATE' for modifier in ob.modifiers):
+                    notes.append('mesh has a triangulate modifier')
+                    if apply_modifiers:
+                        notes.append('even after applying modifiers')
                     else:
-                        notes.append('mesh has no triangulate modifier')
-                    log.warning('Mesh {} is not triangulated and will be triangulated automatically (for exporting only).\n'
-                        'Preview accuracy (UVs, shading, vertex colors) is improved by using a triangulated mesh.'
-                        '{}', ob.name, ''.join('\nNote: %s' % note for note in notes))
-                    # _must_ do this first since it re-allocs arrays
-                    mesh_triangulate(me)
+                        notes.append('modifiers are not being applied (check export options)')
+                    if rigged_to_armature and not self.options['APPLY_MODIFIERS_AFTER_ARMATURE_DEFORM']:
+                        notes.append('mesh is rigged and only modifiers before armature deform are used\n'
+                            '(move the triangulate modifier up, or check export options)')
                 else:
-                    log.debug('Skipped triangulating {}, mesh only has triangles', ob.name)
-
-            me.transform(blender_version_compatibility.matmul(self.options['GLOBAL_MATRIX'], ob_mat))
-            # If negative scaling, we have to invert the normals...
-            if ob_mat.determinant() < 0.0:
-                me.flip_normals()
-
-            if self.options['EXPORT_UV']:
-                if hasattr(me, 'uv_textures'): # < 2.80
-                    has_uvs = len(me.uv_textures) > 0
-                    has_uv_textures = has_uvs
-                    if has_uv_textures:
-                        uv_texture = me.uv_textures.active.data[:]
-                else: # 2.80+
-                    has_uvs = len(me.uv_layers) > 0
-                    has_uv_textures = False
-            else:
-                has_uvs = False
-            
-            vertices = me.vertices[:]
-
-            # Make our own list so it can be sorted to reduce context switching
-            face_index_pairs = [(face, index) for index, face in enumerate(me.polygons)]
-            # faces = [ f for f in me.tessfaces ]
-
-            if not (len(face_index_pairs) + len(vertices)):  # Make sure there is something to write
-                # clean up
-                if not ob_for_convert: # < 2.80
-                    bpy.data.meshes.remove(me)
-                else: # 2.80+
-                    ob_for_convert.to_mesh_clear()
-                return  # dont bother with this mesh.
-
-            if self.options['EXPORT_NORMALS'] and face_index_pairs:
-                me.calc_normals_split()
-                # No need to call me.free_normals_split later, as this mesh is deleted anyway!
-
-            if self.options['EXPORT_SMOOTH_GROUPS'] and face_index_pairs:
-                smooth_groups, smooth_groups_tot = me.calc_smooth_groups(self.options['EXPORT_SMOOTH_GROUPS_BITFLAGS'])
-                if smooth_groups_tot <= 1:
-                    smooth_groups, smooth_groups_tot = (), 0
+                    notes.append('mesh has no triangulate modifier')
+                log.warning('Mesh {} is not triangulated and will be triangulated automatically (for exporting only).\n'
+                    'Preview accuracy (UVs, shading, vertex colors) is improved by using a triangulated mesh.'
+                    '{}', ob.name, ''.join('\nNote: %s' % note for note in notes))
             else:
-                smooth_groups, smooth_groups_tot = (), 0
+                log.debug('Skipped triangulating {}, mesh only has triangles', ob.name)
 
-            materials = me.materials[:]
-            use_materials = materials and self.options['EXPORT_MTL']
+        # the mesh itself is left untransformed, positions and normals are transformed when writing
+        transform = numpy.array(
+            blender_version_compatibility.matmul(self.options['GLOBAL_MATRIX'], ob_mat), dtype=numpy.float64)
+        # If negative scaling, reverse winding order when writing faces
+        flip = numpy.linalg.det(transform[:3,:3]) < 0.0
 
-            # Sort by Material, then images
-            # so we dont over context switch in the obj file.
-            if self.options['KEEP_VERTEX_ORDER']:
-                pass
-            else:
+        # {polygon index: [(corner, corner, corner), ...]} for polygons to be written as several triangles
+        face_triangles = mesh_fan_triangles(me) if has_non_triangles else {}
+
+        if self.options['EXPORT_UV']:
+            if hasattr(me, 'uv_textures'): # < 2.80
+                has_uvs = len(me.uv_textures) > 0
+                has_uv_textures = has_uvs
                 if has_uv_textures:
-                    if smooth_groups:
-                        sort_func = lambda a: (a[0].material_index,
-                                               hash(uv_texture[a[1]].image),
-                                               smooth_groups[a[1]] if a[0].use_smooth else False)
-                    else:
-                        sort_func = lambda a: (a[0].material_index,
-                                               hash(uv_texture[a[1]].image),
-                                               a[0].use_smooth)
-                elif len(materials) > 1:
-                    if smooth_groups:
-                        sort_func = lambda a: (a[0].material_index,
-                                               smooth_groups[a[1]] if a[0].use_smooth else False)
-                    else:
-                        sort_func = lambda a: (a[0].material_index,
-                                               a[0].use_smooth)
-                else:
-                    # no materials
-                    if smooth_groups:
-                        sort_func = lambda a: smooth_groups[a[1] if a[0].use_smooth else False]
-                    else:
-                        sort_func = lambda a: a[0].use_smooth
-
-                face_index_pairs.sort(key=sort_func)
-
-                del sort_func
-
-            util.detect_zztag(log, ob.name)
-            fw('g %s\n' % util.quote(ob.name))
-
-            # rig_is_exported is used to avoid referencing a skeleton or bones which aren't exported
-            rig_is_exported = self.options['EXPORT_SKEL'] and (rigged_to_armature in self.objects)
-
-            if ob.type == 'MESH':
-                objex_data = ob.data.objex_bonus # ObjexMeshProperties
-                if objex_data.priority != 0:
-                    fw('priority %d\n' % objex_data.priority)
-                if objex_data.write_origin == 'YES' or (
-                    objex_data.write_origin == 'AUTO'
-                    and objex_data.attrib_billboard != 'NONE'
-                ):
-                    fw('origin %.6f %.6f %.6f\n'
-                        % tuple(blender_version_compatibility.matmul(self.options['GLOBAL_MATRIX'], ob.location)))
-                if objex_data.attrib_billboard != 'NONE':
-                    fw('attrib %s\n' % objex_data.attrib_billboard)
-                for attrib in ('POSMTX', 'PROXY'):
-                    if getattr(objex_data, 'attrib_%s' % attrib):
-                        fw('attrib %s\n' % attrib)
-                # export those attributes when the properties are shown in the ui, that is when the mesh is rigged
-                if rigged_to_armature:
-                    for attrib in ('LIMBMTX', 'NOSPLIT', 'NOSKEL'):
-                        if getattr(objex_data, 'attrib_%s' % attrib):
-                            if rig_is_exported:
-                                fw('attrib %s\n' % attrib)
-                            else:
-                                log.warning('Mesh {} is rigged to armature {} and sets {},\n'
-                                    'but that armature is not being exported. Skipped exporting the attribute.\n'
-                                    '(you are likely exporting Selection Only, unchecked Used armatures, and did not select the armature)',
-                                    ob.name, rigged_to_armature.name, attrib)
-
-            subprogress2.step()
-
-            if self.options['EXPORT_WEIGHTS']:
-                # Retrieve the list of vertex groups
-                vertGroupNames = ob.vertex_groups.keys()
-                vertex_groups = None
-                if vertGroupNames:
-                    # Create a dictionary keyed by vertex id and listing, for each vertex, the name of the vertex groups it belongs to, and its associated weight
-                    vertex_groups = [[] for _i in range(len(vertices))]
-                    for v_idx, v_ls in enumerate(vertex_groups):
-                        v_ls[:] = [(vertGroupNames[g.group], util.quote(vertGroupNames[g.group]), g.weight) for g in vertices[v_idx].groups]
-                del vertGroupNames
-
-            # Vert
-            if rigged_to_armature and rig_is_exported:
-                fw('useskel %s\n' % util.quote(rigged_to_armature.name))
-            if self.options['EXPORT_WEIGHTS'] and vertex_groups and rigged_to_armature and rig_is_exported:
-                # only write vertex groups named after actual bones
-                bone_names = [bone.name for bone in rigged_to_armature.data.bones]
-                bone_vertex_groups = [
-                    [(group_name_q, weight) for group_name, group_name_q, weight in vertex_vertex_groups if group_name in bone_names]
-                    for vertex_vertex_groups in vertex_groups
-                ]
-                # only group of maximum weight, with weight 1
-                if self.options['UNIQUE_WEIGHTS']:
-                    for v in vertices:
-                        groups = bone_vertex_groups[v.index] # list of (group_name_q, group_weight) tuples for that vertex
-                        if groups:
-                            group_name_q, weight = max(groups, key=lambda _g: _g[1])
-                            fw('%s %s\n' % (
-                                'v %.6f %.6f %.6f' % v.co[:],
-                                'weight %s 1' % group_name_q
-                            ))
-                        else:
-                            fw('v %.6f %.6f %.6f\n' % v.co[:])
-                # all (non-zero) weights
-                else:
-                    for v in vertices:
-                        fw('%s%s\n' % (
-                            'v %.6f %.6f %.6f' % v.co[:],
-                            ','.join([' weight %s %.3f' % (group_name_q, weight) for group_name_q, weight in bone_vertex_groups[v.index] if weight != 0])
-                        ))
-            # no weights
-            else:
-                for v in vertices:
-                    fw('v %.6f %.6f %.6f\n' % v.co[:])
+                    uv_texture = me.uv_textures.active.data[:]
+            else: # 2.80+
+                has_uvs = len(me.uv_layers) > 0
+                has_uv_textures = False
+        else:
+            has_uvs = False
+            has_uv_textures = False
+        
+        vertex_count = len(me.vertices)
+        polygons = me.polygons
 
-            subprogress2.step()
+        # Indices of the faces in writing order, may be sorted to reduce context switching
+        # (indices rather than polygons, to not keep a Python object per face alive)
+        face_indices = range(len(polygons))
 
+        if not (len(face_indices) + vertex_count):  # Make sure there is something to write
+            # clean up
+            if not ob_for_convert: # < 2.80
+                bpy.data.meshes.remove(me)
+            else: # 2.80+
+                ob_for_convert.to_mesh_clear()
+            return  # dont bother with this mesh.
+
+        if self.options['EXPORT_NORMALS'] and face_indices:
+            me.calc_normals_split()
+            # No need to call me.free_normals_split later, as this mesh is deleted anyway!
+            loop_normals = mesh_loop_normals(me)
+        else:
+            loop_normals = None
+
+        if self.options['EXPORT_SMOOTH_GROUPS'] and face_indices:
+            smooth_groups, smooth_groups_tot = me.calc_smooth_groups(self.options['EXPORT_SMOOTH_GROUPS_BITFLAGS'])
+            if smooth_groups_tot <= 1:
+                smooth_groups, smooth_groups_tot = (), 0
+        else:
+            smooth_groups, smooth_groups_tot = (), 0
+
+        materials = me.materials[:]
+        use_materials = materials and self.options['EXPORT_MTL']
+
+        # Sort by Material, then images
+        # so we dont over context switch in the obj file.
+        if self.options['KEEP_VERTEX_ORDER']:
+            pass
+        else:
+            face_order = face_sort_order(me, smooth_groups, len(materials) > 1,
+                                         uv_texture if has_uv_textures else None)
+            face_indices = face_order.tolist()
+            del face_order
+
+        # rig_is_exported is used to avoid referencing a skeleton or bones which aren't exported
+        rig_is_exported = self.options['EXPORT_SKEL'] and (rigged_to_armature in self.objects)
+
+        self.write_object_header(ob, rigged_to_armature, rig_is_exported)
+
+        # Vert
+        if rigged_to_armature and rig_is_exported:
+            fw('useskel %s\n' % util.quote(rigged_to_armature.name))
+        # vertex_suffixes lists, for each vertex, what to write after its coordinates on the v line
+        if self.options['EXPORT_WEIGHTS'] and ob.vertex_groups and rigged_to_armature and rig_is_exported:
+            # only write vertex groups named after actual bones
+            bones = rigged_to_armature.data.bones
+            group_names_q = []
+            bone_group_mask = []
+            for group_name in ob.vertex_groups.keys():
+                group_names_q.append(util.quote(group_name))
+                bone_group_mask.append(group_name in bones)
+            bone_weight_table = VertexWeightTable.from_vertices(me.vertices).filtered_groups(bone_group_mask)
+            # only group of maximum weight, with weight 1
+            if self.options['UNIQUE_WEIGHTS']:
+                max_weight_groups = bone_weight_table.max_weight_groups().tolist()
+                del bone_weight_table
+                vertex_suffixes = [
+                    (' weight %s 1' % group_names_q[group_index]) if group_index >= 0 else ''
+                    for group_index in max_weight_groups
+                ]
+            # all (non-zero) weights
+            else:
+                bone_weight_table = bone_weight_table.filtered(bone_weight_table.weights != 0)
+                offsets = bone_weight_table.offsets.tolist()
+                group_indices = bone_weight_table.group_indices.tolist()
+                weights = bone_weight_table.weights.tolist()
+                del bone_weight_table
+                vertex_suffixes = [
+                    ','.join([' weight %s %.3f' % (group_names_q[group_indices[i]], weights[i])
+                                for i in range(offsets[v_idx], offsets[v_idx+1])])
+                    for v_idx in range(vertex_count)
+                ]
+                del offsets, group_indices, weights
+        # no weights
+        else:
+            vertex_suffixes = None
+
+        positions = mesh_positions(me)
+        if template:
+            template.positions = positions
+            template.vertex_suffixes = vertex_suffixes
+        positions = transform_positions(positions, transform).tolist()
+        if vertex_suffixes:
+            for co, vertex_suffix in zip(positions, vertex_suffixes):
+                fw('v %.6f %.6f %.6f%s\n' % (co[0], co[1], co[2], vertex_suffix))
+        else:
+            for co in positions:
+                fw('v %.6f %.6f %.6f\n' % tuple(co))
+        del positions, vertex_suffixes
+
+        # when recording a template, the vt and vc lines are kept as they are, being independent of the object transform
+        if template:
+            template_chunks = []
+            self.fw_objex = template_chunks.append
+
+        try:
             # UV
             if has_uvs:
-                uv_face_mapping, uv_unique_count = self.write_uvs(me, face_index_pairs)
+                uv_face_mapping, uv_unique_count = self.write_uvs(me, face_indices)
             else:
                 uv_unique_count = 0
-            
-            subprogress2.step()
+            if template:
+                template.uv_block = ''.join(template_chunks)
+                template.uv_unique_count = uv_unique_count
+                fw(template.uv_block)
+                del template_chunks[:]
 
             # NORMAL, Smooth/Non smoothed.
-            if self.options['EXPORT_NORMALS']:
-                loops_to_normals, no_unique_count = self.write_normals(me, face_index_pairs)
+            # (loop_normals is None if the mesh has no faces, only loose vertices/edges)
+            if self.options['EXPORT_NORMALS'] and loop_normals is not None:
+                loops_to_normals, no_unique_count = self.write_normals(
+                    transform_normals(loop_normals, transform),
+                    (polygons[f_index].loop_indices for f_index in face_indices))
                 has_normals = True
+                if template:
+                    # normals are transformed and written again for each instance
+                    fw(''.join(template_chunks))
+                    del template_chunks[:]
+                    template.loop_normals = loop_normals
             else:
                 no_unique_count = 0
                 has_normals = False
-            
+            del loop_normals
+
             if self.options['EXPORT_VERTEX_COLORS']:
-                loops_to_vertex_colors, vc_unique_count = self.write_vertex_colors(me, face_index_pairs)
+                loops_to_vertex_colors, vc_unique_count = self.write_vertex_colors(me, face_indices)
                 has_vertex_colors = loops_to_vertex_colors is not None
             else:
                 has_vertex_colors = False
                 vc_unique_count = 0
-
-            subprogress2.step()
-
-            # those context_* variables are used to keep track of the last g/usemtl/s directive written, according to options
-            # Set the default mat to no material and no image.
-            context_material = context_face_image = 0  # Can never be this, so we will label a new material the first chance we get. used for usemtl directives if EXPORT_MTL
-            context_smooth = None  # Will either be true or false,  set bad to force initialization switch. with EXPORT_SMOOTH_GROUPS, has effects on writing the s directive
-
-            for f, f_index in face_index_pairs:
-                f_smooth = f.use_smooth
-                if f_smooth and smooth_groups:
-                    f_smooth = smooth_groups[f_index]
-
-                face_material = materials[f.material_index] if use_materials else None
-                face_image = uv_texture[f_index].image if has_uv_textures else None
-
-                # we do not need to switch context when the face image changes if
-                # the (objex) material doesn't change, as the face image is completely ignored
-                # when using objex materials
-                if face_material and face_material.objex_bonus.is_objex_material:
-                    face_image = None
-
-                # if context hasn't changed, do nothing
-                if context_material == face_material and context_face_image == face_image:
-                    pass
+            if template:
+                template.vc_block = ''.join(template_chunks)
+                template.vc_unique_count = vc_unique_count
+                fw(template.vc_block)
+                del template_chunks
+        finally:
+            self.fw_objex = fw
+
+        # those context_* variables are used to keep track of the last g/usemtl/s directive written, according to options
+        # Set the default mat to no material and no image.
+        context_material = context_face_image = 0  # Can never be this, so we will label a new material the first chance we get. used for usemtl directives if EXPORT_MTL
+        context_smooth = None  # Will either be true or false,  set bad to force initialization switch. with EXPORT_SMOOTH_GROUPS, has effects on writing the s directive
+
+        for f_index in face_indices:
+            f = polygons[f_index]
+
+            # usemtl/clearmtl/s directives to write before the face
+            face_directives = []
+
+            f_smooth = f.use_smooth
+            if f_smooth and smooth_groups:
+                f_smooth = smooth_groups[f_index]
+
+            face_material = materials[f.material_index] if use_materials else None
+            face_image = uv_texture[f_index].image if has_uv_textures else None
+
+            # we do not need to switch context when the face image changes if
+            # the (objex) material doesn't change, as the face image is completely ignored
+            # when using objex materials
+            if face_material and face_material.objex_bonus.is_objex_material:
+                face_image = None
+
+            # if context hasn't changed, do nothing
+            if context_material == face_material and context_face_image == face_image:
+                pass
+            else:
+                # update context
+                context_material = face_material
+                context_face_image = face_image
+
+                # clear context
+                if face_material is None and face_image is None:
+                    if self.options['EXPORT_MTL']:
+                        face_directives.append('clearmtl\n')
+                # new context
                 else:
-                    # update context
-                    context_material = face_material
-                    context_face_image = face_image
-
-                    # clear context
-                    if face_material is None and face_image is None:
-                        if self.options['EXPORT_MTL']:
-                            fw('clearmtl\n')
-                    # new context
-                    else:
-                        # mtl_dict is {(material, image): (name, name_q, material, face_image)}
-                        data = self.mtl_dict.get((face_material, face_image))
-                        if data:
-                            name_q = data[1]
-                        else:
-                            # new (material, image) pair, find a new unique name for it
-                            name_base = face_material.name if face_material else 'None'
-                            if face_image:
-                                name_base = '%s %s' % (name_base, face_image.name)
-                            name = name_base
-                            i = 0
-                            while name in (_name for (_name, _name_q, _material, _face_image) in self.mtl_dict.values()):
-                                i += 1
-                                name = '%s %d' % (name_base, i)
-                            name_q = util.quote(name)
-                            # remember the pair
-                            self.mtl_dict[(face_material, face_image)] = name, name_q, face_material, face_image
-
-                        if self.options['EXPORT_MTL']:
-                            fw('usemtl %s\n' % name_q)
-
-                if f_smooth != context_smooth:
-                    if f_smooth:  # on now off
-                        if smooth_groups:
-                            f_smooth = smooth_groups[f_index]
-                            fw('s %d\n' % f_smooth)
-                        else:
-                            fw('s 1\n')
-                    else:  # was off now on
-                        fw('s off\n')
-                    context_smooth = f_smooth
-
-                f_v = [(vi, vertices[v_idx], l_idx)
-                       for vi, (v_idx, l_idx) in enumerate(zip(f.vertices, f.loop_indices))]
+                    # new (material, image) pairs get a new unique name
+                    material_entry = self.materials.add(face_material, face_image)
+                    if self.options['EXPORT_MTL']:
+                        face_directives.append('usemtl %s\n' % material_entry.name_q)
 
+            if f_smooth != context_smooth:
+                if f_smooth:  # on now off
+                    if smooth_groups:
+                        f_smooth = smooth_groups[f_index]
+                        face_directives.append('s %d\n' % f_smooth)
+                    else:
+                        face_directives.append('s 1\n')
+                else:  # was off now on
+                    face_directives.append('s off\n')
+                context_smooth = f_smooth
+
+            face_directives = ''.join(face_directives)
+            fw(face_directives)
+            if template:
+                template.faces.append((
+                    face_directives,
+                    tuple(f.vertices),
+                    tuple(uv_face_mapping[f_index]) if has_uvs else None,
+                    tuple(f.loop_indices),
+                    face_triangles.get(f_index),
+                ))
+
+            f_v = list(zip(f.vertices, f.loop_indices))
+
+            for corners in face_triangles.get(f_index, (range(len(f_v)),)):
+                if flip:
+                    corners = reversed_winding(corners)
                 fw('f')
-                for vi, v, li in f_v:
+                for vi in corners:
+                    v_idx, li = f_v[vi]
                     f_v_data = []
-                    f_v_data.append(self.total_vertex + v.index)
+                    f_v_data.append(self.total_vertex + v_idx)
                     if has_uvs:
                         f_v_data.append(self.total_uv + uv_face_mapping[f_index][vi])
                     if has_normals:
@@ -576,19 +973,32 @@ class ObjexWriter():
                     fw(' %s' % '/'.join(['' if _i is None else ('%d' % _i) for _i in f_v_data]))
                 fw('\n')
 
-            subprogress2.step()
-
-            # Make the indices global rather then per mesh
-            self.total_vertex += len(vertices)
-            self.total_uv += uv_unique_count
-            self.total_normal += no_unique_count
-            self.total_vertex_color += vc_unique_count
-            
-            # clean up
-            if not ob_for_convert: # < 2.80
-                bpy.data.meshes.remove(me)
-            else: # 2.80+
-                ob_for_convert.to_mesh_clear()
+        # release the per-face data before the mesh itself
+        del face_indices, face_triangles, smooth_groups
+        if has_uvs:
+            del uv_face_mapping
+        if has_normals:
+            del loops_to_normals
+        if has_uv_textures:
+            del uv_texture
+
+        # Make the indices global rather then per mesh
+        self.total_vertex += vertex_count
+        self.total_uv += uv_unique_count
+        self.total_normal += no_unique_count
+        self.total_vertex_color += vc_unique_count
+
+        if template:
+            template.loops_to_vertex_colors = loops_to_vertex_colors if has_vertex_colors else None
+            self.instance_templates[instance_key] = template
+        if has_vertex_colors:
+            del loops_to_vertex_colors
+        
+        # clean up
+        if not ob_for_convert: # < 2.80
+            bpy.data.meshes.remove(me)
+        else: # 2.80+
+            ob_for_convert.to_mesh_clear()
     
     def write(self, filepath):
         """
@@ -598,122 +1008,171 @@ class ObjexWriter():
         """
         log = self.log
         self.filepath = filepath
-        with ProgressReport(self.context.window_manager) as progress:
+        progress = progress_util.ExportProgress(self.context.window_manager)
+        # peak memory per stage and per object, only measured with the TRACE_MEMORY option
+        memory = progress_util.MemoryUsage(self.options['TRACE_MEMORY'])
+        memory.start()
+        try:
             scene = self.context.scene
 
             # Exit edit mode before exporting, so current object states are exported properly.
             if bpy.ops.object.mode_set.poll():
                 bpy.ops.object.mode_set(mode='OBJECT')
 
-            # EXPORT THE FILE.
-            progress.enter_substeps(1)
-            
-            with ProgressReportSubstep(progress, 3, "Objex Export path: %r" % filepath, "Objex Export Finished") as subprogress1:
-                with open(filepath, "w", encoding="utf8", newline="\n") as f:
-                    self.fw_objex = f.write
+            # check everything before opening any file, raises ObjexExportAbort
+            self.preflight = export_objex_preflight.preflight(scene, self.objects, self.options)
 
-                    # write leading comments, mtllib/animlib/skellib directives, and defines filepath_* to write .mtl/... to
-                    self.write_header()
-
-                    # Initialize totals, these are updated each object
-                    self.total_vertex = self.total_uv = self.total_normal = self.total_vertex_color = 1
-
-                    # A Dict of Materials
-                    # "materials" here refer to a material + face image pair, where either or both may be unset
-                    # (material, image): (name, name_q, material, face_image)
-                    # name_q = util.quote(name)
-                    self.mtl_dict = {}
-
-                    copy_set = set()
+            # EXPORT THE FILE.
+            log.info('Objex Export path: {!r}', filepath)
+            with memory.section('geometry'), open(filepath, "w", encoding="utf8", newline="\n") as f:
+                self.fw_objex = f.write
+
+                # write leading comments, mtllib/animlib/skellib directives, and defines filepath_* to write .mtl/... to
+                self.write_header()
+
+                # Initialize totals, these are updated each object
+                self.total_vertex = self.total_uv = self.total_normal = self.total_vertex_color = 1
+
+                # "materials" here refer to a material + face image pair, where either or both may be unset
+                self.materials = export_objex_mtl.MaterialRegistry()
+
+                copy_set = set()
+
+                self.armatures = []
+
+                self.using_depsgraph = hasattr(self.context, 'evaluated_depsgraph_get') # True in 2.80+
+                self.depsgraph = None
+
+                # {instance_key: InstanceTemplate}, see get_instance_key
+                self.instance_templates = {}
+
+                # 2.80+: list all instances from a single depsgraph evaluation
+                instances = {}
+                if self.using_depsgraph and any(ob_main.is_instancer for ob_main in self.objects):
+                    depsgraph = self.context.evaluated_depsgraph_get()
+                    for dup in depsgraph.object_instances:
+                        if dup.parent:
+                            instances.setdefault(dup.parent.original, []).append(
+                                (dup.instance_object.original, dup.matrix_world.copy()))
+                    del depsgraph
+
+                # Get all objects to write, as (ob_main, [(ob, ob_mat), ...]) tuples
+                objects_obs = []
+                for ob_main in self.objects:
+                    # 421todo I don't know what this dupli stuff is about
+                    # ("instancer" stuff in 2.80+)
+                    use_old_dupli = hasattr(ob_main, 'dupli_type') # True in < 2.80
+                    # ignore dupli children
+                    if (ob_main.parent
+                        and (ob_main.parent.dupli_type if use_old_dupli else ob_main.parent.instance_type)
+                                in {'VERTS', 'FACES'}
+                    ):
+                        log.info('Ignoring {}, dupli child...', ob_main.name)
+                        continue
+
+                    obs = [(ob_main, ob_main.matrix_world)]
+                    added_dupli_children = True
+                    if use_old_dupli and ob_main.dupli_type != 'NONE':
+                        # XXX
+                        log.info('creating dupli_list on {}', ob_main.name)
+                        ob_main.dupli_list_create(scene)
+
+                        obs += [(dob.object, dob.matrix) for dob in ob_main.dupli_list]
+                    elif not use_old_dupli and ob_main.is_instancer:
+                        obs += instances.get(ob_main, [])
+                    else:
+                        added_dupli_children = False
+                    if added_dupli_children:
+                        log.debug('{} has {:d} dupli children', ob_main.name, len(obs) - 1)
+                    objects_obs.append((ob_main, obs))
+                del instances
+
+                # {mesh: amount of objects to write using it}, see write_object
+                self.mesh_users = {}
+                if self.options['DEDUPLICATE_INSTANCES']:
+                    for ob_main, obs in objects_obs:
+                        for ob, ob_mat in obs:
+                            if ob.type == 'MESH':
+                                self.mesh_users[ob.data] = self.mesh_users.get(ob.data, 0) + 1
+
+                # 2.80+: set modifiers visibility for all objects, then evaluate the depsgraph only once
+                user_show_modifiers = []
+                try:
+                    if self.using_depsgraph and self.options['APPLY_MODIFIERS']:
+                        planned_obs = set()
+                        for ob_main, obs in objects_obs:
+                            for ob, ob_mat in obs:
+                                if ob not in planned_obs:
+                                    planned_obs.add(ob)
+                                    user_show_modifiers += self.set_modifiers_show(self.get_modifiers_show(ob))
+                        del planned_obs
+                        self.depsgraph = self.context.evaluated_depsgraph_get()
 
-                    self.armatures = []
-                    
                     # Get all meshes
-                    subprogress1.enter_substeps(len(self.objects))
-                    for ob_main in self.objects:
-                        # 421todo I don't know what this dupli stuff is about
-                        # ("instancer" stuff in 2.80+)
-                        use_old_dupli = hasattr(ob_main, 'dupli_type') # True in < 2.80
-                        # ignore dupli children
-                        if (ob_main.parent
-                            and (ob_main.parent.dupli_type if use_old_dupli else ob_main.parent.instance_type)
-                                    in {'VERTS', 'FACES'}
-                        ):
-                            subprogress1.step("Ignoring %s, dupli child..." % ob_main.name)
-                            continue
-
-                        obs = [(ob_main, ob_main.matrix_world)]
-                        added_dupli_children = True
-                        if use_old_dupli and ob_main.dupli_type != 'NONE':
-                            # XXX
-                            log.info('creating dupli_list on {}', ob_main.name)
-                            ob_main.dupli_list_create(scene)
-
-                            obs += [(dob.object, dob.matrix) for dob in ob_main.dupli_list]
-                        elif not use_old_dupli and ob_main.is_instancer:
-                            # evaluated_depsgraph_get may be called in-between this line executing,
-                            # ie in write_object when evaluating mesh data, so call it again every time here
-                            depsgraph = self.context.evaluated_depsgraph_get()
-                            obs += [(dup.instance_object.original, dup.matrix_world.copy())
-                                    for dup in depsgraph.object_instances
-                                    if dup.parent and dup.parent.original == ob_main]
-                            del depsgraph
-                        else:
-                            added_dupli_children = False
-                        if added_dupli_children:
-                            log.debug('{} has {:d} dupli children', ob_main.name, len(obs) - 1)
-
-                        subprogress1.enter_substeps(len(obs))
+                    # progress is measured in vertices + loops to write
+                    progress.begin(sum(progress_util.estimate_object_work(ob)
+                                       for ob_main, obs in objects_obs for ob, ob_mat in obs))
+                    for ob_main, obs in objects_obs:
                         for ob, ob_mat in obs:
-                            self.write_object(subprogress1, ob, ob_mat)
-
-                        if use_old_dupli and ob_main.dupli_type != 'NONE':
+                            with memory.section(ob.name):
+                                self.write_object(ob, ob_mat)
+                            progress.step(progress_util.estimate_object_work(ob))
+                        log.debug("Finished writing geometry of '{}'.", ob_main.name)
+                finally:
+                    self.depsgraph = None
+                    self.instance_templates = {}
+                    self.mesh_users = {}
+                    self.restore_modifiers_show(user_show_modifiers)
+                    for ob_main, obs in objects_obs:
+                        if hasattr(ob_main, 'dupli_type') and ob_main.dupli_type != 'NONE': # < 2.80
                             ob_main.dupli_list_clear()
-                        elif not use_old_dupli:
-                            pass # no clean-up needed
-
-                        subprogress1.leave_substeps("Finished writing geometry of '%s'." % ob_main.name)
-                    subprogress1.leave_substeps()
-
-                del self.fw_objex
-                
-                subprogress1.step("Finished exporting geometry, now exporting materials")
-
-                # Now we have all our materials, save them
-                if self.options['EXPORT_MTL']:
-                    def append_header_mtl(fw_mtl):
-                        fw_mtl(self.export_id_line)
-                    export_objex_mtl.write_mtl(scene, self.filepath_mtl, append_header_mtl, self.options, copy_set, self.mtl_dict)
-                
-                subprogress1.step("Finished exporting materials, now exporting skeletons/animations")
-
-                # save gathered skeletons and animations
-                if self.options['EXPORT_SKEL']:
-                    log.info('now exporting skeletons')
-                    skelfile = None
-                    animfile = None
-                    try:
-                        skelfile = open(self.filepath_skel, "w", encoding="utf8", newline="\n")
-                        skelfile_write = skelfile.write
-                        skelfile_write(self.export_id_line)
-                        if self.options['EXPORT_ANIM']:
-                            log.info(' ... and animations')
-                            animfile = open(self.filepath_anim, "w", encoding="utf8", newline="\n")
-                            animfile_write = animfile.write
-                            animfile_write(self.export_id_line)
-                        else:
-                            animfile_write = None
+
+            del self.fw_objex
+            
+            log.info('Finished exporting geometry, now exporting materials')
+
+            # Now we have all our materials, save them
+            if self.options['EXPORT_MTL']:
+                def append_header_mtl(fw_mtl):
+                    fw_mtl(self.export_id_line)
+                with memory.section('materials'):
+                    export_objex_mtl.write_mtl(scene, self.filepath_mtl, append_header_mtl, self.options, copy_set, self.materials)
+            # the material references are not needed anymore
+            del self.materials
+            
+            log.info('Finished exporting materials, now exporting skeletons/animations')
+
+            # save gathered skeletons and animations
+            if self.options['EXPORT_SKEL']:
+                log.info('now exporting skeletons')
+                skelfile = None
+                animfile = None
+                try:
+                    skelfile = open(self.filepath_skel, "w", encoding="utf8", newline="\n")
+                    skelfile_write = skelfile.write
+                    skelfile_write(self.export_id_line)
+                    if self.options['EXPORT_ANIM']:
+                        log.info(' ... and animations')
+                        animfile = open(self.filepath_anim, "w", encoding="utf8", newline="\n")
+                        animfile_write = animfile.write
+                        animfile_write(self.export_id_line)
+                    else:
+                        animfile_write = None
+                    with memory.section('skeletons'):
                         export_objex_anim.write_armatures(skelfile_write, animfile_write, scene, self.options['GLOBAL_MATRIX'], self.armatures)
-                    finally:
-                        if skelfile:
-                            skelfile.close()
-                        if animfile:
-                            animfile.close()
-                
-                # copy all collected files.
-                bpy_extras.io_utils.path_reference_copy(copy_set)
+                finally:
+                    if skelfile:
+                        skelfile.close()
+                    if animfile:
+                        animfile.close()
+            
+            # copy all collected files.
+            bpy_extras.io_utils.path_reference_copy(copy_set)
 
-            progress.leave_substeps()
+            log.info('Objex Export Finished')
+        finally:
+            progress.end()
+            memory.stop()
 
 
 def save(context,
@@ -735,6 +1194,9 @@ def save(context,
          apply_unused_armature_deform=None,
          apply_modifiers_after_armature_deform=None,
          keep_vertex_order=None,
+         deduplicate_instances=None,
+         fix_clamping=None,
+         trace_memory=None,
          use_vertex_groups=None,
          export_packed_images=None,
          export_packed_images_dir=None,
@@ -763,6 +1225,9 @@ def save(context,
         'APPLY_UNUSED_ARMATURE_DEFORM':apply_unused_armature_deform,
         'APPLY_MODIFIERS_AFTER_ARMATURE_DEFORM':apply_modifiers_after_armature_deform,
         'KEEP_VERTEX_ORDER':keep_vertex_order,
+        'DEDUPLICATE_INSTANCES':deduplicate_instances,
+        'FIX_CLAMPING':fix_clamping,
+        'TRACE_MEMORY':trace_memory,
         'EXPORT_PACKED_IMAGES':export_packed_images,
         'EXPORT_PACKED_IMAGES_DIR':export_packed_images_dir,
         'GLOBAL_MATRIX':global_matrix,
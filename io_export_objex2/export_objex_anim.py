@@ -6,6 +6,19 @@ import mathutils
 from . import util
 from .logging_util import getLogger
 
+class ArmatureEntry():
+    """
+    An armature object to write the skeleton and animations of, see ObjexWriter.write_object
+    bones_order is the result of order_bones if already computed (see export_objex_preflight)
+    """
+    __slots__ = ('name_q', 'object', 'object_transform', 'actions', 'bones_order')
+
+    def __init__(self, armature, object_transform, actions, bones_order=None):
+        self.name_q = util.quote(armature.name)
+        self.object = armature
+        self.object_transform = object_transform
+        self.actions = actions
+        self.bones_order = bones_order
 
 def write_skeleton(file_write_skel, global_matrix, object_transform, armature, armature_name_q, bones_ordered):
     log = getLogger('anim')
@@ -101,19 +114,22 @@ def write_armatures(file_write_skel, file_write_anim, scene, global_matrix, arma
     
     # 421todo force 20 fps somewhere?
     scene_fps = scene.render.fps / scene.render.fps_base
-    if scene_fps != 20 and any(armature_actions for _0, _1, _2, armature_actions in armatures):
+    if scene_fps != 20 and any(entry.actions for entry in armatures):
         log.warning('animations are being viewed at {:.1f} fps (change this in render settings), but will be used at 20 fps', scene_fps)
 
-    # armatures is built in ObjexWriter#write_object in export_objex.py (look for self.armatures)
-    for armature_name_q, armature, object_transform, armature_actions in armatures:
+    # armatures is a list of ArmatureEntry built in ObjexWriter#write_object in export_objex.py (look for self.armatures)
+    for entry in armatures:
+        armature_name_q, armature, object_transform, armature_actions = entry.name_q, entry.object, entry.object_transform, entry.actions
         if armature.animation_data:
             user_armature_action = armature.animation_data.action
         
-        root_bone, bones_ordered = order_bones(armature)
-        
-        if not bones_ordered:
-            # 421todo abort?
-            log.error('armature {} has no bones', armature.name)
+        if entry.bones_order:
+            root_bone, bones_ordered = entry.bones_order
+        else:
+            root_bone, bones_ordered = order_bones(armature)
+            if not bones_ordered:
+                # 421todo abort?
+                log.error('armature {} has no bones', armature.name)
         
         if file_write_skel:
             write_skeleton(file_write_skel, global_matrix, object_transform, armature, armature_name_q, bones_ordered)
@@ -33,6 +33,85 @@ from . import data_updater
 from . import util
 from .logging_util import getLogger
 
+class MaterialEntry():
+    """A material + face image pair, where either or both may be None, written as one .mtl material"""
+    __slots__ = ('name', 'name_q', 'material', 'face_image')
+
+    def __init__(self, name, material, face_image):
+        self.name = name
+        self.name_q = util.quote(name)
+        self.material = material
+        self.face_image = face_image
+
+class MaterialRegistry():
+    """
+    The MaterialEntry objects to write, indexed by (material, face image) and by name
+    Filled by ObjexWriter.write_object and read by write_mtl, iterating yields entries in insertion order
+    """
+    __slots__ = ('by_pair', 'by_name')
+
+    def __init__(self):
+        self.by_pair = {}
+        self.by_name = {}
+
+    def __len__(self):
+        return len(self.by_pair)
+
+    def __iter__(self):
+        return iter(self.by_pair.values())
+
+    def get(self, material, face_image):
+        return self.by_pair.get((material, face_image))
+
+    def add(self, material, face_image):
+        """Returns the entry for (material, face_image), creating it with a new unique name if needed"""
+        entry = self.by_pair.get((material, face_image))
+        if entry:
+            return entry
+        name_base = material.name if material else 'None'
+        if face_image:
+            name_base = '%s %s' % (name_base, face_image.name)
+        name = name_base
+        i = 0
+        while name in self.by_name:
+            i += 1
+            name = '%s %d' % (name_base, i)
+        entry = self.by_pair[(material, face_image)] = self.by_name[name] = MaterialEntry(name, material, face_image)
+        return entry
+
+class TextureEntry():
+    """An image declared with newtex"""
+    __slots__ = ('name', 'name_q', 'image')
+
+    def __init__(self, name, image):
+        self.name = name
+        self.name_q = util.quote(name)
+        self.image = image
+
+class TextureRegistry():
+    """The TextureEntry objects declared in a .mtl file, indexed by image and by name"""
+    __slots__ = ('by_image', 'by_name')
+
+    def __init__(self):
+        self.by_image = {}
+        self.by_name = {}
+
+    def __len__(self):
+        return len(self.by_image)
+
+    def get(self, image):
+        return self.by_image.get(image)
+
+    def add(self, image):
+        """Creates the entry for image, with a unique name based on the image name"""
+        name = image.name
+        i = 0
+        while name in self.by_name:
+            i += 1
+            name = '%s_%d' % (image.name, i)
+        entry = self.by_image[image] = self.by_name[name] = TextureEntry(name, image)
+        return entry
+
 class ObjexMaterialNodeTreeExplorer():
     def __init__(self, material):
         self.log = getLogger('ObjexMaterialNodeTreeExplorer')
@@ -359,7 +438,10 @@ class ObjexMaterialNodeTreeExplorer():
             return {'type':'normals'}
 
 # fixme this is going to end up finding uv/vcolor layers from node (or default to active I guess), if several layers, may write the wrong layer in .objex ... should call write_mtl and get uvs/vcolor data this way before writing the .objex?
-def write_mtl(scene, filepath, append_header, options, copy_set, mtl_dict):
+def write_mtl(scene, filepath, append_header, options, copy_set, materials):
+    """
+    materials is a MaterialRegistry
+    """
     log = getLogger('export_objex_mtl')
 
     source_dir = os.path.dirname(bpy.data.filepath)
@@ -374,16 +456,15 @@ def write_mtl(scene, filepath, append_header, options, copy_set, mtl_dict):
         fw = f.write
 
         fw('# Blender MTL File: %r\n' % (os.path.basename(bpy.data.filepath) or "None"))
-        fw('# Material Count: %i\n' % len(mtl_dict))
+        fw('# Material Count: %i\n' % len(materials))
 
         # used for writing exportid
         append_header(fw)
 
-        # maps an image to (texture_name, texture_name_q),
         # to avoid duplicate newtex declarations
         # does not prevent duplicate file paths because different images
         # (with same file path) may have different properties set
-        declared_textures = {}
+        declared_textures = TextureRegistry()
 
         def getImagePath(image, filename=None):
             image_filepath = image.filepath
@@ -402,23 +483,15 @@ def write_mtl(scene, filepath, append_header, options, copy_set, mtl_dict):
                                                       path_mode, '', copy_set, image.library)
 
         def writeTexture(image):
-            data = declared_textures.get(image)
-            if data:
-                texture_name, texture_name_q = data
-                log.trace('Skipped writing texture {} {}', texture_name, image)
+            texture = declared_textures.get(image)
+            if texture:
+                log.trace('Skipped writing texture {} {}', texture.name, image)
             else:
-                texture_name = image.name
-                # make sure texture_name is not already used
-                i = 0
-                while texture_name in (_texture_name for _texture_name, _texture_name_q in declared_textures.values()):
-                    i += 1
-                    texture_name = '%s_%d' % (name, i)
-                if i != 0:
-                    log.debug('Texture name {} was already used, using {} instead', name, texture_name)
-                texture_name_q = util.quote(texture_name)
-                declared_textures[image] = (texture_name, texture_name_q)
-                fw('newtex %s\n' % texture_name_q)
-                filepath = getImagePath(image, texture_name)
+                texture = declared_textures.add(image)
+                if texture.name != image.name:
+                    log.debug('Texture name {} was already used, using {} instead', image.name, texture.name)
+                fw('newtex %s\n' % texture.name_q)
+                filepath = getImagePath(image, texture.name)
                 fw('map %s\n' % filepath)
                 # texture objex data
                 tod = image.objex_bonus
@@ -447,12 +520,12 @@ def write_mtl(scene, filepath, append_header, options, copy_set, mtl_dict):
                         texture_bank = tod.texture_bank
                     texturebank_filepath = getImagePath(texture_bank)
                     fw('texturebank %s\n' % texturebank_filepath)
-            # texture_name_q is input name if new texture, or
             # the name used for writing the image path (quoted)
-            return texture_name_q
+            return texture.name_q
 
         # mind the continue used in this loop to skip writing most stuff for empty materials
-        for name, name_q, material, face_img in mtl_dict.values():
+        for entry in materials:
+            name, name_q, material, face_img = entry.name, entry.name_q, entry.material, entry.face_image
             log.trace('Writing name={!r} name_q={!r} material={!r} face_img={!r}', name, name_q, material, face_img)
             util.detect_zztag(log, name)
             objex_data = material.objex_bonus if material else None
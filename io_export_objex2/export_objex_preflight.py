@@ -0,0 +1,300 @@
+# ##### BEGIN GPL LICENSE BLOCK #####
+#
+#  This program is free software; you can redistribute it and/or
+#  modify it under the terms of the GNU General Public License
+#  as published by the Free Software Foundation; either version 2
+#  of the License, or (at your option) any later version.
+#
+#  This program is distributed in the hope that it will be useful,
+#  but WITHOUT ANY WARRANTY; without even the implied warranty of
+#  MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+#  GNU General Public License for more details.
+#
+#  You should have received a copy of the GNU General Public License
+#  along with this program; if not, write to the Free Software Foundation,
+#  Inc., 51 Franklin Street, Fifth Floor, Boston, MA 02110-1301, USA.
+#
+# ##### END GPL LICENSE BLOCK #####
+
+"""
+Checks run on everything to be exported before any file is opened (see preflight),
+so that exports abort before writing the geometry rather than after.
+Results of the slower checks (materials, meshs) are cached, and reused as long as the datablocks
+they depend on were not updated (counted from depsgraph updates, 2.80+ only).
+"""
+
+import contextlib
+import logging
+import time
+
+import numpy
+
+import bpy
+from bpy.app.handlers import persistent
+
+from . import data_updater
+from . import export_objex_anim
+from . import export_objex_mtl
+from . import interface
+from . import logging_util
+from . import util
+from .logging_util import getLogger
+
+# datablock pointer : amount of depsgraph updates of the (original) datablock since update counting was enabled
+update_counts = {}
+# (check name, datablock pointer) : CachedCheck
+check_cache = {}
+
+@persistent
+def count_updates(scene, depsgraph=None):
+    if depsgraph is None: # 2.80 only passes the scene
+        depsgraph = bpy.context.evaluated_depsgraph_get()
+    for update in depsgraph.updates:
+        key = update.id.original.as_pointer()
+        update_counts[key] = update_counts.get(key, 0) + 1
+
+@persistent
+def clear_cache(*args):
+    # pointers of datablocks change (and may be reused) on file load and undo/redo
+    update_counts.clear()
+    check_cache.clear()
+
+def can_cache():
+    # < 2.80 has no information about which datablocks were updated
+    return hasattr(bpy.app.handlers, 'depsgraph_update_post')
+
+def enable_update_counting():
+    handlers = bpy.app.handlers
+    if count_updates not in handlers.depsgraph_update_post:
+        handlers.depsgraph_update_post.append(count_updates)
+        for handler_list in (handlers.load_post, handlers.undo_post, handlers.redo_post):
+            handler_list.append(clear_cache)
+
+def unregister():
+    handlers = bpy.app.handlers
+    if can_cache():
+        for handler_list, handler in (
+            (handlers.depsgraph_update_post, count_updates),
+            (handlers.load_post, clear_cache),
+            (handlers.undo_post, clear_cache),
+            (handlers.redo_post, clear_cache),
+        ):
+            if handler in handler_list:
+                handler_list.remove(handler)
+    clear_cache()
+
+class RecordsCapture(logging.Handler):
+    """Keeps the warnings and errors logged during a check, to log them again when reusing its result"""
+    def __init__(self):
+        super().__init__(logging.WARNING)
+        self.records = []
+
+    def emit(self, record):
+        # format now, the arguments may not be valid later
+        record.msg = record.getMessage()
+        record.args = None
+        self.records.append(record)
+
+@contextlib.contextmanager
+def capture_records():
+    capture = RecordsCapture()
+    logging_util.root_logger.addHandler(capture)
+    try:
+        yield capture.records
+    finally:
+        logging_util.root_logger.removeHandler(capture)
+
+class CachedCheck():
+    __slots__ = ('state', 'value', 'abort', 'records')
+
+class PreflightResult():
+    """
+    What was checked by preflight, for the export to not check (or warn about) it again
+    bones_orders maps armature objects to the result of export_objex_anim.order_bones
+    """
+    def __init__(self):
+        self.not_triangulated = set()
+        self.bones_orders = {}
+        self.cache_hits = 0
+        self.cache_misses = 0
+
+    def cached_check(self, name, datablock, dependencies, extra_key, check):
+        """
+        Returns check(), or its value from a previous call if none of the dependencies (datablocks) were updated since
+        and extra_key is the same. Warnings and errors logged by check() are logged again
+        when reusing its value, and util.ObjexExportAbort raised again.
+        check() must return plain Python values, not bpy data (which may be freed or changed by the time it is reused)
+        """
+        key = (name, datablock.as_pointer())
+        state = (
+            tuple((dependency.as_pointer(), update_counts.get(dependency.as_pointer(), 0)) for dependency in dependencies),
+            extra_key
+        )
+        cached = check_cache.get(key)
+        if cached and cached.state == state:
+            self.cache_hits += 1
+            for record in cached.records:
+                logging_util.root_logger.handle(record)
+        else:
+            self.cache_misses += 1
+            cached = CachedCheck()
+            cached.state = state
+            cached.value = cached.abort = None
+            with capture_records() as records:
+                try:
+                    cached.value = check()
+                except util.ObjexExportAbort as abort:
+                    cached.abort = abort.reason
+            cached.records = records
+            if can_cache():
+                check_cache[key] = cached
+        if cached.abort:
+            raise util.ObjexExportAbort(cached.abort)
+        return cached.value
+
+def check_scene(scene, log):
+    view_transform = scene.view_settings.view_transform
+    if bpy.app.version < (2, 80, 0):
+        view_transform_ok = 'Default'
+    else:
+        view_transform_ok = 'Standard'
+    if view_transform != view_transform_ok:
+        log.warning('Scene uses view_transform={!r} which changes how colors are '
+                    'displayed in the viewport, reducing the preview accuracy.\n'
+                    'This can be changed under Color Management in {} properties.\n'
+                    'Recommended value: {}',
+                    view_transform, 'Scene' if bpy.app.version < (2, 80, 0) else 'Render',
+                    view_transform_ok)
+
+    display_device = scene.display_settings.display_device
+    # 421fixme 'Rec709' is also available in 2.79, idk what it is but it's mentioned in
+    # the tooltip for the Linear value of the Color Space property of image texture nodes
+    display_device_ok = 'None'
+    if scene.objex_bonus.colorspace_strategy != 'QUIET' and display_device != display_device_ok:
+        log.warning('Scene uses display_device={!r} which changes how colors are '
+                    'displayed in the viewport, reducing the preview accuracy.\n'
+                    'This can be changed under Color Management in {} properties.\n'
+                    'Note that this should also be kept consistent with the '
+                    'Color Space property of image texture nodes '
+                    '(display_device="None", Color Space="Linear").\n'
+                    '{}'
+                    'Recommended value: {}',
+                    display_device,
+                    'Scene' if bpy.app.version < (2, 80, 0) else 'Render',
+                    'In Blender 2.7x, "Color Space" can be found in the Image Editor.\n'
+                        if bpy.app.version < (2, 80, 0) else '',
+                    display_device_ok)
+
+def check_mesh(ob, triangulate, log):
+    """
+    Returns (used_slots, not_triangulated) for the (unevaluated) mesh of ob
+    used_slots are the indices of the material slots used by faces
+    not_triangulated is True if the mesh has non-triangle faces and no triangulate modifier
+    """
+    polygons = ob.data.polygons
+    material_indices = numpy.empty(len(polygons), dtype=numpy.int32)
+    polygons.foreach_get('material_index', material_indices)
+    used_slots = numpy.unique(material_indices).tolist()
+    not_triangulated = False
+    if triangulate and not any(modifier.type == 'TRIANGULATE' for modifier in ob.modifiers):
+        loop_totals = numpy.empty(len(polygons), dtype=numpy.int32)
+        polygons.foreach_get('loop_total', loop_totals)
+        if (loop_totals > 3).any():
+            not_triangulated = True
+            log.warning('Mesh {} is not triangulated and will be triangulated automatically (for exporting only).\n'
+                'Preview accuracy (UVs, shading, vertex colors) is improved by using a triangulated mesh.\n'
+                'Note: mesh has no triangulate modifier', ob.name)
+    return used_slots, not_triangulated
+
+def check_material(material):
+    """
+    Raises util.ObjexExportAbort if writing the material would abort
+    The explorer built here is not kept, write_mtl builds it again when writing the material
+    (the explorer data references bpy data which may change without the material being updated)
+    """
+    objex_data = material.objex_bonus
+    if not objex_data.is_objex_material:
+        return
+    data_updater.assert_material_at_current_version(material, util.ObjexExportAbort)
+    if objex_data.empty or material.name.startswith('empty.'):
+        return
+    if not material.use_nodes:
+        raise util.ObjexExportAbort('Material {0!r} {0.name} is_objex_material but not use_nodes (was "Use Nodes" unchecked after adding objex nodes to it?)'.format(material))
+    explorer = export_objex_mtl.ObjexMaterialNodeTreeExplorer(material)
+    explorer.build()
+    for texel in ('texel0', 'texel1'):
+        texelData = explorer.data.get(texel)
+        if texelData and not texelData['image']:
+            raise util.ObjexExportAbort('Material %s uses texel data %r without a texture/image '
+                '(make sure texel0 and texel1 have a texture/image set if they are used in the combiner)'
+                % (material.name, texelData))
+
+def check_rig_attributes(ob, rigged_to_armature, rig_is_exported, log):
+    # those attributes are only exported when the mesh is rigged, see ObjexWriter.write_object_header
+    objex_data = ob.data.objex_bonus
+    for attrib in ('LIMBMTX', 'NOSPLIT', 'NOSKEL'):
+        if getattr(objex_data, 'attrib_%s' % attrib) and not rig_is_exported:
+            log.warning('Mesh {} is rigged to armature {} and sets {},\n'
+                'but that armature is not being exported. Skipped exporting the attribute.\n'
+                '(you are likely exporting Selection Only, unchecked Used armatures, and did not select the armature)',
+                ob.name, rigged_to_armature.name, attrib)
+
+def preflight(scene, objects, options):
+    """
+    Check the scene, meshs, materials, images and armatures to be exported before writing anything
+    Raises util.ObjexExportAbort on the first error that would abort the export, returns a PreflightResult
+    Objects instanced by objects (dupli) are not checked here, but still are when writing them.
+    """
+    log = getLogger('preflight')
+    time_start = time.perf_counter()
+    if can_cache():
+        enable_update_counting()
+    result = PreflightResult()
+
+    check_scene(scene, log)
+
+    # materials in order of first use
+    materials = []
+    for ob in objects:
+        if ob.type == 'MESH':
+            used_slots, not_triangulated = result.cached_check(
+                'mesh', ob, (ob.data,),
+                (options['TRIANGULATE'], tuple(modifier.type for modifier in ob.modifiers)),
+                lambda: check_mesh(ob, options['TRIANGULATE'], log))
+            if not_triangulated:
+                result.not_triangulated.add(ob.name)
+            if options['EXPORT_MTL']:
+                material_slots = ob.material_slots
+                for slot_index in used_slots:
+                    if slot_index < len(material_slots):
+                        material = material_slots[slot_index].material
+                        if material and material not in materials:
+                            materials.append(material)
+            rigged_to_armature = ob.find_armature()
+            if rigged_to_armature:
+                rig_is_exported = options['EXPORT_SKEL'] and rigged_to_armature in objects
+                check_rig_attributes(ob, rigged_to_armature, rig_is_exported, log)
+        elif ob.type == 'ARMATURE' and options['EXPORT_SKEL']:
+            root_bone, bones_ordered = export_objex_anim.order_bones(ob)
+            if not bones_ordered:
+                # 421todo abort?
+                log.error('armature {} has no bones', ob.name)
+            result.bones_orders[ob] = (root_bone, bones_ordered)
+
+    # properties kept in sync with Blender ones are only synced when needed, see interface.MsgbusWatchers
+    interface.sync_objex_materials(materials)
+    if options['FIX_CLAMPING']:
+        changed_materials = interface.set_pixels_along_uv_from_image_dimensions(materials)
+        log.debug('Set Pixels along U/V from image dimensions in {} materials', changed_materials)
+
+    # image color spaces are warned about by write_mtl, when writing the materials using them
+    for material in materials:
+        result.cached_check(
+            'material', material,
+            (material, material.node_tree) if material.node_tree else (material,),
+            None, lambda: check_material(material))
+
+    log.debug('Checked {} objects and {} materials in {:.1f} ms ({} cached results reused, {} checks run)',
+        len(objects), len(materials), (time.perf_counter() - time_start) * 1000,
+        result.cache_hits, result.cache_misses)
+    return result
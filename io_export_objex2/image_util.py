@@ -0,0 +1,97 @@
+import io
+import os
+import struct
+
+import bpy
+
+from .logging_util import getLogger
+
+"""
+Image dimensions read from the image file headers (PNG, TGA, JPEG),
+to not load the pixels of images from disk only to know their size (as reading image.size does)
+"""
+
+# absolute file path : (st_mtime, st_size, (width, height))
+image_file_sizes = {}
+
+TGA_EXTENSIONS = ('.tga', '.icb', '.vda', '.vst')
+
+def read_png_size(f, head):
+    # signature, then the IHDR chunk (length, type, width, height)
+    if head[12:16] != b'IHDR':
+        return None
+    return struct.unpack('>II', head[16:24])
+
+def read_tga_size(f, head):
+    # no signature, check the color map type and image type fields are valid
+    if len(head) < 18 or head[1] not in (0, 1) or head[2] not in (1, 2, 3, 9, 10, 11):
+        return None
+    return struct.unpack('<HH', head[12:16])
+
+def read_jpeg_size(f, head):
+    # look for a start of frame segment, which contains the dimensions
+    f.seek(2)
+    while True:
+        byte = f.read(1)
+        while byte and byte != b'\xff':
+            byte = f.read(1)
+        while byte == b'\xff': # fill bytes
+            byte = f.read(1)
+        if not byte:
+            return None
+        marker = byte[0]
+        if marker in (0x01, 0xD8) or 0xD0 <= marker <= 0xD7:
+            continue # no length
+        if marker == 0xD9: # end of image
+            return None
+        length_bytes = f.read(2)
+        if len(length_bytes) < 2:
+            return None
+        length, = struct.unpack('>H', length_bytes)
+        if 0xC0 <= marker <= 0xCF and marker not in (0xC4, 0xC8, 0xCC):
+            frame = f.read(5)
+            if len(frame) < 5:
+                return None
+            height, width = struct.unpack('>xHH', frame)
+            return width, height
+        f.seek(length - 2, io.SEEK_CUR)
+
+def read_image_file_size(f, filename):
+    """Returns (width, height) from the header of the image file opened as f (binary), or None if unknown/unsupported"""
+    head = f.read(24)
+    if head.startswith(b'\x89PNG\r\n\x1a\n'):
+        return read_png_size(f, head)
+    if head.startswith(b'\xff\xd8'):
+        return read_jpeg_size(f, head)
+    if os.path.splitext(filename)[1].lower() in TGA_EXTENSIONS:
+        return read_tga_size(f, head)
+    return None
+
+def image_size(image):
+    """
+    Returns (width, height) of image, from the header of its file if the image isn't loaded yet,
+    falls back to image.size (which loads the image) for other formats and sources
+    """
+    log = getLogger('image_util')
+    if image.has_data or image.source != 'FILE':
+        return tuple(image.size)
+    size = None
+    try:
+        if image.packed_file:
+            size = read_image_file_size(io.BytesIO(image.packed_file.data), image.filepath)
+        else:
+            filepath = bpy.path.abspath(image.filepath, library=image.library)
+            stat = os.stat(filepath)
+            cached = image_file_sizes.get(filepath)
+            if cached and cached[0] == stat.st_mtime and cached[1] == stat.st_size:
+                return cached[2]
+            with open(filepath, 'rb') as f:
+                size = read_image_file_size(f, filepath)
+            if size:
+                image_file_sizes[filepath] = (stat.st_mtime, stat.st_size, size)
+    except (OSError, struct.error):
+        log.debug('Could not read the header of image {}', image.name, exc_info=True)
+    if not size:
+        log.debug('Unknown image file header for {}, loading the image to get its size', image.name)
+        return tuple(image.size)
+    return size
@@ -3,12 +3,15 @@ from . import blender_version_compatibility
 import bpy
 import mathutils
 import re
+import logging
 from math import pi
 
 from . import const_data as CST
 from . import data_updater
+from . import logging_util
 from .logging_util import getLogger
 from . import util
+from . import image_util
 from . import rigging_helpers
 
 """
@@ -141,6 +144,12 @@ class OBJEX_PT_folding(bpy.types.Panel):
         row.operator('objex.autofold_fold_unfold', text='Fold').action = 'FOLD'
         row.operator('objex.autofold_fold_unfold', text='Unfold').action = 'UNFOLD'
         row.operator('objex.autofold_fold_unfold', text='Switch').action = 'SWITCH'
+        if len(context.selected_objects) > 1:
+            row = self.layout.row()
+            for text, action in (('Fold selected', 'FOLD'), ('Unfold selected', 'UNFOLD')):
+                op = row.operator('objex.autofold_fold_unfold', text=text)
+                op.action = action
+                op.selected_armatures = True
         # 421todo better saved poses management (delete)
         self.layout.label(text='Default saved pose to use for folding:')
         # 'OBJEX_SavedPose' does not refer to any addon-defined class. see documentation of template_list
@@ -148,6 +157,43 @@ class OBJEX_PT_folding(bpy.types.Panel):
         self.layout.operator('objex.autofold_delete_pose', text='Delete pose')
 
 
+class OBJEX_PT_rig_health(bpy.types.Panel):
+    bl_space_type = 'VIEW_3D'
+    bl_region_type = 'UI'
+    bl_category = 'Objex'
+    bl_label = 'Rig Health'
+    bl_options = {'DEFAULT_CLOSED'}
+
+    @classmethod
+    def poll(self, context):
+        return context.scene.objex_bonus.is_objex_scene
+
+    def draw(self, context):
+        self.layout.operator('objex.rig_health_report', text='Check all rigged meshes')
+        report = rigging_helpers.last_rig_health_report
+        if report is None:
+            return
+        if not report:
+            self.layout.label(text='No rigged mesh')
+        for armature_name, meshes in sorted(report.items()):
+            box = self.layout.box()
+            box.label(text=armature_name, icon='ARMATURE_DATA')
+            for mesh_health in meshes:
+                problems = rigging_helpers.rig_health_problem_count(mesh_health)
+                box.label(text=mesh_health['object'], icon=('ERROR' if problems else 'CHECKMARK' if bpy.app.version >= (2, 80, 0) else 'FILE_TICK'))
+                col = box.column(align=True)
+                for key, text in (
+                    ('unassigned_vertices', 'Unassigned'),
+                    ('multiassigned_vertices', 'Multiassigned'),
+                    ('zero_weight_vertices', 'Zero weight'),
+                    ('non_deform_bone_vertices', 'Non-deform bone'),
+                    ('non_bone_group_vertices', 'In non-bone groups'),
+                ):
+                    if mesh_health[key]:
+                        col.label(text='%s: %d / %d vertices' % (text, mesh_health[key], mesh_health['vertices']))
+                if mesh_health['non_bone_groups']:
+                    col.label(text='Non-bone groups: %s' % ', '.join(mesh_health['non_bone_groups']))
+
 # armature
 
 # do not use the self argument, as the function is used by at least 2 properties
@@ -815,19 +861,310 @@ def draw_build_nodes_operator(
     op.set_looks = set_looks
     op.set_basic_links = set_basic_links
 
-# same intent as draw_build_nodes_operator
-def exec_build_nodes_operator(
-    material,
+class MaterialNodesIndex():
+    """
+    Index of the existing nodes of a node tree, built once to find the nodes described in CST.node_setup
+    Nodes with a name from the node setup are indexed by name, other nodes by bl_idname
+    """
+    def __init__(self, nodes, nodes_data):
+        self.by_name = dict()
+        self.by_type = dict()
+        for n in nodes:
+            if n.name in nodes_data:
+                self.by_name[n.name] = n
+            else:
+                self.by_type.setdefault(n.bl_idname, []).append(n)
+
+    def find(self, node_name, node_type, node_type_group):
+        """Find a node with same name, or same type (and group), which is then no longer a candidate for other names"""
+        node = self.by_name.get(node_name)
+        if node:
+            return node
+        candidates = self.by_type.get(node_type)
+        if not candidates:
+            return None
+        for n in candidates:
+            if (not node_type_group
+                or (n.node_tree
+                    and n.node_tree.name == node_type_group
+            )):
+                if node: # found several nodes
+                    # prefer nodes named like targeted (eg '{node_name}.001')
+                    if node_name in n.name:
+                        node = n
+                    # else, keep previous match
+                else: # first match
+                    node = n
+        if node:
+            candidates.remove(node)
+        return node
+
+def build_material_nodes(
+    material, context=None,
     init=False, reset=False,
     create=True, update_groups_of_existing=True,
-    set_looks=True, set_basic_links=True
+    set_looks=True, set_basic_links=True,
+    update_groups=True
 ):
-    bpy.ops.objex.material_build_nodes(
-        target_material_name=material.name,
-        init=init, reset=reset,
-        create=create, update_groups_of_existing=update_groups_of_existing,
-        set_looks=set_looks, set_basic_links=set_basic_links
-    )
+    """
+    Initialize/update the nodes of material for use on Objex export, see OBJEX_OT_material_build_nodes for the options
+    update_groups=False skips update_node_groups(), which must then have been called before (see build_materials_nodes)
+    """
+    log = getLogger('interface')
+
+    if context is None:
+        context = bpy.context
+    scene = context.scene
+
+    # let the user choose, as use_transparency is used when
+    # exporting to distinguish opaque and translucent geometry
+    #material.use_transparency = True # < 2.80
+    material.use_nodes = True
+    if update_groups:
+        update_node_groups()
+    node_tree = material.node_tree
+    nodes = node_tree.nodes
+
+    if reset:
+        nodes.clear()
+
+    # nodes are described in const_data.py
+    nodes_data = CST.node_setup
+    EMPTY_DICT = dict()
+    EMPTY_LIST = list()
+
+    if not reset:
+        nodes_index = MaterialNodesIndex(nodes, nodes_data)
+    # node_name : node, for nodes described in nodes_data
+    setup_nodes = dict()
+
+    # 1st pass: find/create nodes, set properties, looks
+    for node_name, node_data in nodes_data.items():
+        node_type = node_data.get('type')
+        node_type_group = node_data.get('group')
+        if not node_type and node_type_group:
+            node_type = 'ShaderNodeGroup'
+        node_inputs = node_data.get('inputs', EMPTY_DICT)
+        node_force_inputs_attributes = node_data.get('force-inputs-attributes', EMPTY_DICT)
+        node_outputs = node_data.get('outputs', EMPTY_DICT)
+        node_outputs_combiner_flags = node_data.get('outputs-combiner-flags', EMPTY_DICT)
+        node_properties_dict = node_data.get('properties-dict', EMPTY_DICT)
+        node_label = node_data.get('label')
+        node_location = node_data.get('location')
+        node_width = node_data.get('width')
+        node_hidden_inputs = node_data.get('hide-inputs', EMPTY_LIST)
+        node = None
+        # skip "find node" code even though with the nodes reset there
+        # would be nothing to find anyway
+        if not reset:
+            node = nodes_index.find(node_name, node_type, node_type_group)
+        if not node and not create:
+            log.info('Skipped creating missing node {}', node_name)
+            continue # skip further actions on missing node
+        created_node = False
+        if not node:
+            created_node = True
+            node = nodes.new(node_type)
+            if node_type_group:
+                node.node_tree = bpy.data.node_groups[node_type_group]
+            for input_socket_key, default_value in node_inputs.items():
+                node.inputs[input_socket_key].default_value = default_value
+            for output_socket_key, default_value in node_outputs.items():
+                node.outputs[output_socket_key].default_value = default_value
+            for output_socket_key, flags in node_outputs_combiner_flags.items():
+                color_flag, alpha_flag = flags
+                socket = node.outputs[output_socket_key]
+                if OBJEX_NodeSocket_CombinerOutput: # < 2.80 (421FIXME_UPDATE)
+                    socket.flagColorCycle = color_flag if color_flag else ''
+                    socket.flagAlphaCycle = alpha_flag if alpha_flag else ''
+                else: # 2.80+
+                    # 421FIXME_UPDATE not sure how bad/hacky this is
+                    node['flagColorCycle %s' % socket.identifier] = color_flag if color_flag else ''
+                    node['flagAlphaCycle %s' % socket.identifier] = alpha_flag if alpha_flag else ''
+            for k, v in node_properties_dict.items():
+                node[k] = v
+        elif node_type_group and update_groups_of_existing:
+            node.node_tree = bpy.data.node_groups[node_type_group]
+        for input_socket_key, socket_attributes in node_force_inputs_attributes.items():
+            socket = node.inputs[input_socket_key]
+            for k, v in socket_attributes.items():
+                try:
+                    setattr(socket, k, v)
+                except ValueError:
+                    log.warn('{} setattr({!r}, {!r}, {!r}) ValueError '
+                            '(this can be ignored if happening while updating a material)',
+                            node_name, socket, k, v)
+        node.name = node_name # todo set unconditionally? won't set the name if already taken. rename others first? (set exact name needed for 2nd pass with links)
+        setup_nodes[node_name] = node
+        if set_looks or created_node:
+            if node_label:
+                node.label = node_label
+            if node_location:
+                node.location = node_location
+            if node_width:
+                node.width = node_width
+            for hidden_input_socket_key in node_hidden_inputs:
+                node.inputs[hidden_input_socket_key].hide = True
+
+    if init:
+        # remove useless nodes
+        # tuple() avoids modifying and iterating over nodes at the same time
+        for n in tuple(n for n in nodes if n.name not in nodes_data):
+            nodes.remove(n)
+
+    # 2nd pass: parenting (frames), links
+    # assumes every node described in nodes_data was created and/or named as expected in the 1st pass (unless create is False)
+    for node_name, node_data in nodes_data.items():
+        node = setup_nodes.get(node_name)
+        if not node:
+            continue # skip missing nodes (only if not create, as all nodes should exist otherwise)
+        node_links = node_data.get('links', EMPTY_DICT)
+        node_children = node_data.get('children', EMPTY_LIST)
+        # warning: not checking if node_links/node_children don't refer to a non-existing node (when create is False)
+        if set_basic_links:
+            # todo clear links? shouldnt be needed because inputs can only have one link (but maybe old links get moved to unintended sockets like for math nodes?)
+            for to_input_socket_key, from_output in node_links.items():
+                from_node_name, from_output_socket_key = from_output
+                node_tree.links.new(
+                    setup_nodes[from_node_name].outputs[from_output_socket_key],
+                    node.inputs[to_input_socket_key]
+                )
+        if set_looks:
+            for child_node_name in node_children:
+                setup_nodes[child_node_name].parent = node
+
+    if set_basic_links:
+        # 421todo hardcoding this for now instead of putting it into const_data.py,
+        # because it's not exactly a "basic" links
+        # but we can't just wait for the user to configure it as it appears as an error when unlinked
+        # so, for now default to opaque white shade = lighting shading
+        # shade
+        # vertex colors (do not use by default as it would make shade (0,0,0,0))
+        #node_tree.links.new(geometry.outputs['Vertex Color'], shade.inputs[0])
+        #node_tree.links.new(geometry.outputs['Vertex Alpha'], shade.inputs[1])
+        # 421todo implement lighting calculations
+        # for now, use opaque white shade
+        for i in (0,1):
+            # do not overwrite any previous link (eg keep vertex colors links)
+            if not nodes['OBJEX_Shade'].inputs[i].is_linked:
+                node_tree.links.new(nodes['OBJEX_Color1'].outputs[0], nodes['OBJEX_Shade'].inputs[i])
+
+    if init:
+        # infer texel0 texture from face textures
+        try:
+            obj = mesh = None
+            context_object_is_mesh = (
+                hasattr(context, 'object')
+                and context.object
+                and context.object.type == 'MESH'
+            )
+            if (context_object_is_mesh
+                    and not hasattr(context.object.data, 'uv_textures')
+            ):
+                pass # no face textures (Blender 2.80+)
+            elif (context_object_is_mesh
+                    and context.object.data.uv_textures.active
+            ):
+                obj = context.object
+                mesh = obj.data
+                log.debug('Searching face textures in object {} / mesh {}', obj.name, mesh.name)
+                uv_textures_data = mesh.uv_textures.active.data
+                was_edit_mode = False
+                if not uv_textures_data: # uv_textures_data is empty in edit mode
+                    # assume edit mode, go to object mode
+                    log.debug('-> OBJECT mode')
+                    was_edit_mode = True
+                    bpy.ops.object.mode_set(mode='OBJECT')
+                    uv_textures_data = mesh.uv_textures.active.data
+                # find slots using our material
+                material_slot_indices = tuple( # use tuple() for speed
+                    slot_index for slot_index in range(len(obj.material_slots))
+                        if obj.material_slots[slot_index].material == material
+                )
+                # find face images used by faces using our material
+                face_images = set(
+                    uv_textures_data[face.index].image for face in mesh.polygons
+                        if face.material_index in material_slot_indices
+                            and uv_textures_data[face.index].image
+                )
+                # uv_textures_data no longer needed
+                if was_edit_mode:
+                    del uv_textures_data # avoid (dangling pointer?) issues
+                    bpy.ops.object.mode_set(mode='EDIT')
+                # use face image in texture for texel0, if any
+                if face_images:
+                    if len(face_images) > 1:
+                        log.info('Found several face images {}', ', '.join(face_image.name for face_image in face_images))
+                    face_image = next(iter(face_images))
+                    face_image_texture = bpy.data.textures.new(face_image.name, 'IMAGE')
+                    face_image_texture.image = face_image
+                    texel0texture = nodes['OBJEX_Texel0Texture']
+                    texel0texture.texture = face_image_texture
+                else:
+                    log.debug('Found no face image')
+            else:
+                log.info('Could not find a suitable object (MESH type with uvs) in context to search face textures in')
+        except:
+            log.warn('Something went wrong while searching a face texture to use for texel0')
+            log.exception('material = {!r} obj = {!r} mesh = {!r}', material, obj, mesh)
+        # cycle 0: (TEXEL0 - 0) * PRIM  + 0
+        cc0 = nodes['OBJEX_ColorCycle0']
+        ac0 = nodes['OBJEX_AlphaCycle0']
+        if OBJEX_NodeSocket_CombinerInput: # < 2.80
+            # the 2.80+ code would work in both versions assuming the node names are correct,
+            # but setting input_flags_ is more lenient and more readable when possible
+            cc0.inputs['A'].input_flags_C_A = 'G_CCMUX_TEXEL0'
+            cc0.inputs['C'].input_flags_C_C = 'G_CCMUX_PRIMITIVE'
+            ac0.inputs['A'].input_flags_A_A = 'G_ACMUX_TEXEL0'
+            ac0.inputs['C'].input_flags_A_C = 'G_ACMUX_PRIMITIVE'
+        else: # 2.80+
+            node_tree.links.new(nodes['OBJEX_Texel0'].outputs[0], cc0.inputs['A'])
+            node_tree.links.new(nodes['OBJEX_PrimColor'].outputs[0], cc0.inputs['C'])
+            node_tree.links.new(nodes['OBJEX_Texel0'].outputs[1], ac0.inputs['A'])
+            node_tree.links.new(nodes['OBJEX_PrimColor'].outputs[1], ac0.inputs['C'])
+        # cycle 1: (RESULT - 0) * SHADE + 0
+        cc1 = nodes['OBJEX_ColorCycle1']
+        ac1 = nodes['OBJEX_AlphaCycle1']
+        node_tree.links.new(cc0.outputs[0], cc1.inputs['A'])
+        node_tree.links.new(ac0.outputs[0], ac1.inputs['A'])
+        if OBJEX_NodeSocket_CombinerInput: # < 2.80
+            cc1.inputs['C'].input_flags_C_C = 'G_CCMUX_SHADE'
+            ac1.inputs['C'].input_flags_A_C = 'G_ACMUX_SHADE'
+        else: # 2.80+
+            node_tree.links.new(nodes['OBJEX_Shade'].outputs[0], cc1.inputs['C'])
+            node_tree.links.new(nodes['OBJEX_Shade'].outputs[1], ac1.inputs['C'])
+        # combiners output
+        if hasattr(bpy.types, 'ShaderNodeOutput'): # < 2.80
+            output = nodes['Output']
+            node_tree.links.new(cc1.outputs[0], output.inputs[0])
+            node_tree.links.new(ac1.outputs[0], output.inputs[1])
+        else: # 2.80+
+            principledBSDF = nodes['Principled BSDF']
+            node_tree.links.new(cc1.outputs[0], principledBSDF.inputs['Base Color'])
+            node_tree.links.new(ac1.outputs[0], principledBSDF.inputs['Alpha'])
+
+    if not scene.objex_bonus.is_objex_scene:
+        scene.objex_bonus.is_objex_scene = True
+        addon_preferences = util.get_addon_preferences()
+        if addon_preferences:
+            colorspace_strategy = addon_preferences.colorspace_default_strategy
+            if colorspace_strategy == 'AUTO':
+                colorspace_strategy = 'WARN'
+            scene.objex_bonus.colorspace_strategy = colorspace_strategy
+        else:
+            log.info('No addon preferences, assuming background mode, scene color space strategy stays at default {}',
+                scene.objex_bonus.colorspace_strategy)
+    if not material.objex_bonus.is_objex_material:
+        material.objex_bonus.is_objex_material = True
+        watch_objex_material(material)
+    # 421fixme why is objex_version set here? data_updater says it's up to the update functions to do it
+    material.objex_bonus.objex_version = data_updater.addon_material_objex_version
+
+def build_materials_nodes(materials, context=None, **options):
+    """Same as build_material_nodes for several materials, updating node groups only once"""
+    update_node_groups()
+    for material in materials:
+        build_material_nodes(material, context, update_groups=False, **options)
 
 class OBJEX_OT_material_build_nodes(bpy.types.Operator):
 
@@ -838,7 +1175,8 @@ class OBJEX_OT_material_build_nodes(bpy.types.Operator):
     # if set, use the material with this name instead of the context one
     target_material_name = bpy.props.StringProperty()
 
-    # defaults for following bool properties are handled by draw_build_nodes_operator and exec_build_nodes_operator
+    # defaults for following bool properties are handled by draw_build_nodes_operator
+    # (build_material_nodes should be used instead of calling the operator from scripts)
 
     # indicates the material is becoming an objex material for the first time
     # soft resets by removing nodes that serve no purpose (meant to remove default nodes),
@@ -857,327 +1195,130 @@ class OBJEX_OT_material_build_nodes(bpy.types.Operator):
     set_basic_links = bpy.props.BoolProperty()
 
     def execute(self, context):
-        log = getLogger('OBJEX_OT_material_build_nodes')
-
-        scene = context.scene
-
         if self.target_material_name:
             material = bpy.data.materials[self.target_material_name]
         else:
             material = context.material
-
-        # let the user choose, as use_transparency is used when
-        # exporting to distinguish opaque and translucent geometry
-        #material.use_transparency = True # < 2.80
-        material.use_nodes = True
-        update_node_groups()
-        node_tree = material.node_tree
-        nodes = node_tree.nodes
-
-        if self.reset:
-            nodes.clear()
-
-        # nodes are described in const_data.py
-        nodes_data = CST.node_setup
-        EMPTY_DICT = dict()
-        EMPTY_LIST = list()
-
-        # 1st pass: find/create nodes, set properties, looks
-        for node_name, node_data in nodes_data.items():
-            node_type = node_data.get('type')
-            node_type_group = node_data.get('group')
-            if not node_type and node_type_group:
-                node_type = 'ShaderNodeGroup'
-            node_inputs = node_data.get('inputs', EMPTY_DICT)
-            node_force_inputs_attributes = node_data.get('force-inputs-attributes', EMPTY_DICT)
-            node_outputs = node_data.get('outputs', EMPTY_DICT)
-            node_outputs_combiner_flags = node_data.get('outputs-combiner-flags', EMPTY_DICT)
-            node_properties_dict = node_data.get('properties-dict', EMPTY_DICT)
-            node_label = node_data.get('label')
-            node_location = node_data.get('location')
-            node_width = node_data.get('width')
-            node_hidden_inputs = node_data.get('hide-inputs', EMPTY_LIST)
-            node = None
-            # skip "find node" code even though with the nodes reset there
-            # would be nothing to find anyway
-            if not self.reset:
-                # find a node with same name, or same type
-                node = nodes.get(node_name)
-                if not node:
-                    for n in nodes:
-                        if (n.bl_idname == node_type
-                            and (not node_type_group
-                                or (n.node_tree
-                                    and n.node_tree.name == node_type_group
-                        ))):
-                            # ignore nodes which have a known name (and purpose)
-                            if n.name in nodes_data:
-                                continue
-                            if node: # found several nodes
-                                # prefer nodes named like targeted (eg '{node_name}.001')
-                                if node_name in n.name:
-                                    node = n
-                                # else, keep previous match
-                            else: # first match
-                                node = n
-            if not node and not self.create:
-                log.info('Skipped creating missing node {}', node_name)
-                continue # skip further actions on missing node
-            created_node = False
-            if not node:
-                created_node = True
-                node = nodes.new(node_type)
-                if node_type_group:
-                    node.node_tree = bpy.data.node_groups[node_type_group]
-                for input_socket_key, default_value in node_inputs.items():
-                    node.inputs[input_socket_key].default_value = default_value
-                for output_socket_key, default_value in node_outputs.items():
-                    node.outputs[output_socket_key].default_value = default_value
-                for output_socket_key, flags in node_outputs_combiner_flags.items():
-                    color_flag, alpha_flag = flags
-                    socket = node.outputs[output_socket_key]
-                    if OBJEX_NodeSocket_CombinerOutput: # < 2.80 (421FIXME_UPDATE)
-                        socket.flagColorCycle = color_flag if color_flag else ''
-                        socket.flagAlphaCycle = alpha_flag if alpha_flag else ''
-                    else: # 2.80+
-                        # 421FIXME_UPDATE not sure how bad/hacky this is
-                        node['flagColorCycle %s' % socket.identifier] = color_flag if color_flag else ''
-                        node['flagAlphaCycle %s' % socket.identifier] = alpha_flag if alpha_flag else ''
-                for k, v in node_properties_dict.items():
-                    node[k] = v
-            elif node_type_group and self.update_groups_of_existing:
-                node.node_tree = bpy.data.node_groups[node_type_group]
-            for input_socket_key, socket_attributes in node_force_inputs_attributes.items():
-                socket = node.inputs[input_socket_key]
-                for k, v in socket_attributes.items():
-                    try:
-                        setattr(socket, k, v)
-                    except ValueError:
-                        log.warn('{} setattr({!r}, {!r}, {!r}) ValueError '
-                                '(this can be ignored if happening while updating a material)',
-                                node_name, socket, k, v)
-            node.name = node_name # todo set unconditionally? won't set the name if already taken. rename others first? (set exact name needed for 2nd pass with links)
-            if self.set_looks or created_node:
-                if node_label:
-                    node.label = node_label
-                if node_location:
-                    node.location = node_location
-                if node_width:
-                    node.width = node_width
-                for hidden_input_socket_key in node_hidden_inputs:
-                    node.inputs[hidden_input_socket_key].hide = True
-
-        if self.init:
-            # remove useless nodes
-            # tuple() avoids modifying and iterating over nodes at the same time
-            for n in tuple(n for n in nodes if n.name not in nodes_data):
-                nodes.remove(n)
-
-        # 2nd pass: parenting (frames), links
-        # assumes every node described in nodes_data was created and/or named as expected in the 1st pass (unless self.create is False)
-        for node_name, node_data in nodes_data.items():
-            if not self.create and node_name not in nodes:
-                continue # skip missing nodes (only if not self.create, as all nodes should exist otherwise)
-            node = nodes[node_name]
-            node_links = node_data.get('links', EMPTY_DICT)
-            node_children = node_data.get('children', EMPTY_LIST)
-            # warning: not checking if node_links/node_children don't refer to a non-existing node (when self.create is False)
-            if self.set_basic_links:
-                # todo clear links? shouldnt be needed because inputs can only have one link (but maybe old links get moved to unintended sockets like for math nodes?)
-                for to_input_socket_key, from_output in node_links.items():
-                    from_node_name, from_output_socket_key = from_output
-                    node_tree.links.new(
-                        nodes[from_node_name].outputs[from_output_socket_key],
-                        node.inputs[to_input_socket_key]
-                    )
-            if self.set_looks:
-                for child_node_name in node_children:
-                    nodes[child_node_name].parent = node
-
-        if self.set_basic_links:
-            # 421todo hardcoding this for now instead of putting it into const_data.py,
-            # because it's not exactly a "basic" links
-            # but we can't just wait for the user to configure it as it appears as an error when unlinked
-            # so, for now default to opaque white shade = lighting shading
-            # shade
-            # vertex colors (do not use by default as it would make shade (0,0,0,0))
-            #node_tree.links.new(geometry.outputs['Vertex Color'], shade.inputs[0])
-            #node_tree.links.new(geometry.outputs['Vertex Alpha'], shade.inputs[1])
-            # 421todo implement lighting calculations
-            # for now, use opaque white shade
-            for i in (0,1):
-                # do not overwrite any previous link (eg keep vertex colors links)
-                if not nodes['OBJEX_Shade'].inputs[i].is_linked:
-                    node_tree.links.new(nodes['OBJEX_Color1'].outputs[0], nodes['OBJEX_Shade'].inputs[i])
-
-        if self.init:
-            # infer texel0 texture from face textures
-            try:
-                obj = mesh = None
-                context_object_is_mesh = (
-                    hasattr(context, 'object')
-                    and context.object
-                    and context.object.type == 'MESH'
-                )
-                if (context_object_is_mesh
-                        and not hasattr(context.object.data, 'uv_textures')
-                ):
-                    pass # no face textures (Blender 2.80+)
-                elif (context_object_is_mesh
-                        and context.object.data.uv_textures.active
-                ):
-                    obj = context.object
-                    mesh = obj.data
-                    log.debug('Searching face textures in object {} / mesh {}', obj.name, mesh.name)
-                    uv_textures_data = mesh.uv_textures.active.data
-                    was_edit_mode = False
-                    if not uv_textures_data: # uv_textures_data is empty in edit mode
-                        # assume edit mode, go to object mode
-                        log.debug('-> OBJECT mode')
-                        was_edit_mode = True
-                        bpy.ops.object.mode_set(mode='OBJECT')
-                        uv_textures_data = mesh.uv_textures.active.data
-                    # find slots using our material
-                    material_slot_indices = tuple( # use tuple() for speed
-                        slot_index for slot_index in range(len(obj.material_slots))
-                            if obj.material_slots[slot_index].material == material
-                    )
-                    # find face images used by faces using our material
-                    face_images = set(
-                        uv_textures_data[face.index].image for face in mesh.polygons
-                            if face.material_index in material_slot_indices
-                                and uv_textures_data[face.index].image
-                    )
-                    # uv_textures_data no longer needed
-                    if was_edit_mode:
-                        del uv_textures_data # avoid (dangling pointer?) issues
-                        bpy.ops.object.mode_set(mode='EDIT')
-                    # use face image in texture for texel0, if any
-                    if face_images:
-                        if len(face_images) > 1:
-                            log.info('Found several face images {}', ', '.join(face_image.name for face_image in face_images))
-                        face_image = next(iter(face_images))
-                        face_image_texture = bpy.data.textures.new(face_image.name, 'IMAGE')
-                        face_image_texture.image = face_image
-                        texel0texture = nodes['OBJEX_Texel0Texture']
-                        texel0texture.texture = face_image_texture
-                    else:
-                        log.debug('Found no face image')
-                else:
-                    log.info('Could not find a suitable object (MESH type with uvs) in context to search face textures in')
-            except:
-                self.report({'WARNING'}, 'Something went wrong while searching a face texture to use for texel0')
-                log.exception('material = {!r} obj = {!r} mesh = {!r}', material, obj, mesh)
-            # cycle 0: (TEXEL0 - 0) * PRIM  + 0
-            cc0 = nodes['OBJEX_ColorCycle0']
-            ac0 = nodes['OBJEX_AlphaCycle0']
-            if OBJEX_NodeSocket_CombinerInput: # < 2.80
-                # the 2.80+ code would work in both versions assuming the node names are correct,
-                # but setting input_flags_ is more lenient and more readable when possible
-                cc0.inputs['A'].input_flags_C_A = 'G_CCMUX_TEXEL0'
-                cc0.inputs['C'].input_flags_C_C = 'G_CCMUX_PRIMITIVE'
-                ac0.inputs['A'].input_flags_A_A = 'G_ACMUX_TEXEL0'
-                ac0.inputs['C'].input_flags_A_C = 'G_ACMUX_PRIMITIVE'
-            else: # 2.80+
-                node_tree.links.new(nodes['OBJEX_Texel0'].outputs[0], cc0.inputs['A'])
-                node_tree.links.new(nodes['OBJEX_PrimColor'].outputs[0], cc0.inputs['C'])
-                node_tree.links.new(nodes['OBJEX_Texel0'].outputs[1], ac0.inputs['A'])
-                node_tree.links.new(nodes['OBJEX_PrimColor'].outputs[1], ac0.inputs['C'])
-            # cycle 1: (RESULT - 0) * SHADE + 0
-            cc1 = nodes['OBJEX_ColorCycle1']
-            ac1 = nodes['OBJEX_AlphaCycle1']
-            node_tree.links.new(cc0.outputs[0], cc1.inputs['A'])
-            node_tree.links.new(ac0.outputs[0], ac1.inputs['A'])
-            if OBJEX_NodeSocket_CombinerInput: # < 2.80
-                cc1.inputs['C'].input_flags_C_C = 'G_CCMUX_SHADE'
-                ac1.inputs['C'].input_flags_A_C = 'G_ACMUX_SHADE'
-            else: # 2.80+
-                node_tree.links.new(nodes['OBJEX_Shade'].outputs[0], cc1.inputs['C'])
-                node_tree.links.new(nodes['OBJEX_Shade'].outputs[1], ac1.inputs['C'])
-            # combiners output
-            if hasattr(bpy.types, 'ShaderNodeOutput'): # < 2.80
-                output = nodes['Output']
-                node_tree.links.new(cc1.outputs[0], output.inputs[0])
-                node_tree.links.new(ac1.outputs[0], output.inputs[1])
-            else: # 2.80+
-                principledBSDF = nodes['Principled BSDF']
-                node_tree.links.new(cc1.outputs[0], principledBSDF.inputs['Base Color'])
-                node_tree.links.new(ac1.outputs[0], principledBSDF.inputs['Alpha'])
-
-        if not scene.objex_bonus.is_objex_scene:
-            scene.objex_bonus.is_objex_scene = True
-            addon_preferences = util.get_addon_preferences()
-            if addon_preferences:
-                colorspace_strategy = addon_preferences.colorspace_default_strategy
-                if colorspace_strategy == 'AUTO':
-                    colorspace_strategy = 'WARN'
-                scene.objex_bonus.colorspace_strategy = colorspace_strategy
-            else:
-                log.info('No addon preferences, assuming background mode, scene color space strategy stays at default {}',
-                    scene.objex_bonus.colorspace_strategy)
-        if not material.objex_bonus.is_objex_material:
-            material.objex_bonus.is_objex_material = True
-            watch_objex_material(material)
-        # 421fixme why is objex_version set here? data_updater says it's up to the update functions to do it
-        material.objex_bonus.objex_version = data_updater.addon_material_objex_version
-
+        logging_util.setLogOperator(self, level=logging.WARNING, user_friendly_formatter=True)
+        try:
+            build_material_nodes(material, context,
+                init=self.init, reset=self.reset,
+                create=self.create, update_groups_of_existing=self.update_groups_of_existing,
+                set_looks=self.set_looks, set_basic_links=self.set_basic_links
+            )
+        finally:
+            logging_util.setLogOperator(None)
         return {'FINISHED'}
 
 # properties and non-node UI
 
+class MsgbusWatchers():
+    """
+    msgbus subscriptions of the add-on, all owned by the registry
+    Subscriptions are made once, and at the type level (for all materials at once) instead of per material,
+    so a notification doesn't tell which material changed: the last seen values are kept to find out.
+    """
+    def __init__(self):
+        self.owner = object()
+        self.subscribed = set()
+        # material.as_pointer() : use_backface_culling last seen, for objex materials
+        self.backface_culling_seen = dict()
+        # material.as_pointer() of objex materials which need their backface culling properties synced, see sync_objex_materials
+        # (pointers rather than names, for renaming a material to not lose track of it)
+        self.backface_culling_unsynced = set()
+
+    def subscribe(self, key, notify, args=()):
+        if key in self.subscribed:
+            return
+        bpy.msgbus.subscribe_rna(
+            key=key,
+            owner=self.owner,
+            args=args,
+            notify=notify,
+            # 421fixme I don't know what PERSISTENT would do
+            #options={'PERSISTENT'}
+        )
+        self.subscribed.add(key)
+
+    def clear(self):
+        """Unsubscribe and forget about materials (of the previously loaded file)"""
+        if hasattr(bpy, 'msgbus'):
+            bpy.msgbus.clear_by_owner(self.owner)
+        self.subscribed.clear()
+        self.backface_culling_seen.clear()
+        self.backface_culling_unsynced.clear()
+
+    def watch_material(self, material):
+        if blender_version_compatibility.has_per_material_backface_culling:
+            self.subscribe((bpy.types.Material, 'use_backface_culling'), blender_use_backface_culling_update)
+            self.backface_culling_seen[material.as_pointer()] = material.use_backface_culling
+            if material.objex_bonus.backface_culling != material.use_backface_culling:
+                self.backface_culling_unsynced.add(material.as_pointer())
+
+msgbus_watchers = MsgbusWatchers()
+
 def init_watch_objex_materials():
     log = getLogger('interface')
-    log.debug('Looking for objex materials to watch')
-    watched = []
-    ignored = []
+    msgbus_watchers.clear()
+    watched = 0
     for material in bpy.data.materials:
         if material.objex_bonus.is_objex_material:
-            watch_objex_material(material)
-            watched.append(material)
-        else:
-            ignored.append(material)
-    log.debug('Watching: {}, ignored: {}', ', '.join(mat.name for mat in watched), ', '.join(mat.name for mat in ignored))
+            msgbus_watchers.watch_material(material)
+            watched += 1
+    log.debug('Watching {} objex materials out of {} materials ({} with backface culling to sync)',
+        watched, len(bpy.data.materials), len(msgbus_watchers.backface_culling_unsynced))
 
 def watch_objex_material(material):
-    if blender_version_compatibility.has_per_material_backface_culling:
-        watch_objex_material_backface_culling(material)
+    msgbus_watchers.watch_material(material)
 
-def watch_objex_material_backface_culling(material):
+def sync_objex_materials(materials):
+    """
+    Sync the properties of materials which differed when they started being watched,
+    which is done lazily (at export time) instead of when loading a file
+    (or when the Blender or objex backface culling property of the material changes)
+    """
+    unsynced = msgbus_watchers.backface_culling_unsynced
+    if not unsynced:
+        return
     log = getLogger('interface')
-    log.trace('Watching use_backface_culling of material {} sync_backface_culling = {!r}',
-        material.name, bpy.context.scene.objex_bonus.sync_backface_culling)
-    bpy.msgbus.subscribe_rna(
-        key=material.path_resolve('use_backface_culling', False),
-        owner=msgbus_owner,
-        args=(material,),
-        notify=blender_use_backface_culling_update,
-        # 421fixme I don't know what PERSISTENT would do
-        # renaming material or object using it doesnt prevent notifications when it isn't set
-        #options={'PERSISTENT'}
-    )
-    if (material.objex_bonus.backface_culling != material.use_backface_culling
-        and bpy.context.scene.objex_bonus.sync_backface_culling
-    ):
-        if 'OBJEX_TO_BLENDER' in bpy.context.scene.objex_bonus.sync_backface_culling:
-            log.trace('{} notifying objex backface_culling', material.name)
-            # trigger objex_backface_culling_update
-            material.objex_bonus.backface_culling = material.objex_bonus.backface_culling
-        else: # sync_backface_culling == {'BLENDER_TO_OBJEX'}
-            log.trace('{} notifying Blender use_backface_culling', material.name)
-            # trigger blender_use_backface_culling_update
-            material.use_backface_culling = material.use_backface_culling
-
-def blender_use_backface_culling_update(material):
+    sync_backface_culling = bpy.context.scene.objex_bonus.sync_backface_culling
+    for material in materials:
+        key = material.as_pointer()
+        if key not in unsynced:
+            continue
+        unsynced.discard(key)
+        if (material.objex_bonus.is_objex_material
+            and material.objex_bonus.backface_culling != material.use_backface_culling
+            and sync_backface_culling
+        ):
+            if 'OBJEX_TO_BLENDER' in sync_backface_culling:
+                log.trace('{} syncing Blender use_backface_culling from objex backface_culling', material.name)
+                material.use_backface_culling = material.objex_bonus.backface_culling
+                msgbus_watchers.backface_culling_seen[material.as_pointer()] = material.use_backface_culling
+            else: # sync_backface_culling == {'BLENDER_TO_OBJEX'}
+                log.trace('{} syncing objex backface_culling from Blender use_backface_culling', material.name)
+                material.objex_bonus.backface_culling = material.use_backface_culling
+
+def blender_use_backface_culling_update():
     log = getLogger('interface')
-    log.trace('sync_backface_culling = {!r}', bpy.context.scene.objex_bonus.sync_backface_culling)
-    if (material.objex_bonus.backface_culling != material.use_backface_culling
-        and 'BLENDER_TO_OBJEX' in bpy.context.scene.objex_bonus.sync_backface_culling
-    ):
-        log.trace('{} Blender use_backface_culling = {}', material.name, material.use_backface_culling)
-        if material.objex_bonus.is_objex_material:
-            material.objex_bonus.backface_culling = material.use_backface_culling
-        else:
-            log.trace('But material is not an objex material, ignoring it.')
+    sync_backface_culling = bpy.context.scene.objex_bonus.sync_backface_culling
+    log.trace('sync_backface_culling = {!r}', sync_backface_culling)
+    seen = msgbus_watchers.backface_culling_seen
+    for material in bpy.data.materials:
+        if not material.objex_bonus.is_objex_material:
+            continue
+        key = material.as_pointer()
+        use_backface_culling = material.use_backface_culling
+        previous = seen.get(key)
+        if previous == use_backface_culling:
+            continue # not the material that changed
+        seen[key] = use_backface_culling
+        if (material.objex_bonus.backface_culling != use_backface_culling
+            and 'BLENDER_TO_OBJEX' in sync_backface_culling
+        ):
+            log.trace('{} Blender use_backface_culling = {}', material.name, use_backface_culling)
+            material.objex_bonus.backface_culling = use_backface_culling
+            msgbus_watchers.backface_culling_unsynced.discard(key)
 
 def objex_backface_culling_update(self, context):
     if not blender_version_compatibility.has_per_material_backface_culling:
@@ -1191,6 +1332,8 @@ def objex_backface_culling_update(self, context):
         log.trace('{} objex backface_culling = {}', material.name, material.objex_bonus.backface_culling)
         if material.objex_bonus.is_objex_material:
             material.use_backface_culling = material.objex_bonus.backface_culling
+            msgbus_watchers.backface_culling_seen[material.as_pointer()] = material.use_backface_culling
+            msgbus_watchers.backface_culling_unsynced.discard(material.as_pointer())
         else:
             log.trace('But material is not an objex material, ignoring it.')
 
@@ -1360,6 +1503,48 @@ class OBJEX_PT_material(bpy.types.Panel):
             self.layout.label(text='G_FOG off does not disable fog', icon='ERROR')
         self.layout.prop(data, 'geometrymode_G_ZBUFFER')
 
+def set_pixels_along_uv_from_image_dimensions(materials):
+    """
+    Set Pixels along U/V socket values of the UV pipe nodes of objex materials to the dimensions of their image
+    Image dimensions are read from the image files headers (see image_util), and sockets only written if their value changes
+    Returns the amount of materials that changed
+    """
+    changed_materials = 0
+    for material in materials:
+        if not material.objex_bonus.is_objex_material or not material.node_tree:
+            continue
+        changed = False
+        for node in material.node_tree.nodes:
+            if node.type != 'GROUP':
+                continue
+            if not node.node_tree or node.node_tree.name != 'OBJEX_UV_pipe':
+                continue
+            links = node.outputs['UV'].links
+            if not links:
+                continue
+            textureNode = links[0].to_node
+            if textureNode.bl_idname == 'ShaderNodeTexture': # < 2.80
+                if not textureNode.texture:
+                    continue
+                image = textureNode.texture.image
+            else: # 2.80+ assume ShaderNodeTexImage
+                image = textureNode.image
+            if not image:
+                continue
+            width, height = image_util.image_size(image)
+            # putting *2 here is simpler than modifying the uv pipe and math nodes again
+            # it halves the clamp start offset which becomes eg along U: 1/(width*2) instead of 1/width
+            # it makes the offset half a pixel instead of a full pixel (in uv space)
+            # so it starts clamping in the "middle" of a pixel instead of the side
+            for socket_name, pixels in (('Pixels along U', width * 2), ('Pixels along V', height * 2)):
+                socket = node.inputs[socket_name]
+                if socket.default_value != pixels:
+                    socket.default_value = pixels
+                    changed = True
+        if changed:
+            changed_materials += 1
+    return changed_materials
+
 class OBJEX_OT_set_pixels_along_uv_from_image_dimensions(bpy.types.Operator):
 
     bl_idname = 'objex.set_pixels_along_uv_from_image_dimensions'
@@ -1367,29 +1552,8 @@ class OBJEX_OT_set_pixels_along_uv_from_image_dimensions(bpy.types.Operator):
     bl_options = {'REGISTER', 'UNDO'}
 
     def execute(self, context):
-        for material in bpy.data.materials:
-            if not material.objex_bonus.is_objex_material:
-                continue
-            for node in material.node_tree.nodes:
-                if node.type != 'GROUP':
-                    continue
-                if node.node_tree.name != 'OBJEX_UV_pipe':
-                    continue
-                textureNode = node.outputs['UV'].links[0].to_node
-                if textureNode.bl_idname == 'ShaderNodeTexture': # < 2.80
-                    if not textureNode.texture:
-                        continue
-                    image = textureNode.texture.image
-                else: # 2.80+ assume ShaderNodeTexImage
-                    if not textureNode.image:
-                        continue
-                    image = textureNode.image
-                # putting *2 here is simpler than modifying the uv pipe and math nodes again
-                # it halves the clamp start offset which becomes eg along U: 1/(width*2) instead of 1/width
-                # it makes the offset half a pixel instead of a full pixel (in uv space)
-                # so it starts clamping in the "middle" of a pixel instead of the side
-                node.inputs['Pixels along U'].default_value = image.size[0] * 2
-                node.inputs['Pixels along V'].default_value = image.size[1] * 2
+        changed_materials = set_pixels_along_uv_from_image_dimensions(bpy.data.materials)
+        self.report({'INFO'}, 'Updated {} materials'.format(changed_materials))
         return {'FINISHED'}
 
 classes = (
@@ -1397,6 +1561,7 @@ classes = (
 
     OBJEX_PT_mesh,
     OBJEX_PT_folding,
+    OBJEX_PT_rig_health,
 
     OBJEX_UL_actions,
     OBJEX_PT_armature,
@@ -1414,8 +1579,6 @@ classes = (
     OBJEX_PT_material,
 )
 
-msgbus_owner = object()
-
 # handler arguments seem undocumented and vary between 2.7x and 2.8x anyway
 def handler_scene_or_depsgraph_update_post_once(*args):
     if bpy.app.version < (2, 80, 0):
@@ -1429,6 +1592,11 @@ def handler_scene_or_depsgraph_update_post_once(*args):
 def handler_load_post(*args):
     init_watch_objex_materials()
 
+@bpy.app.handlers.persistent
+def handler_undo_redo_post(*args):
+    # materials are watched by pointer, which change on undo/redo
+    init_watch_objex_materials()
+
 def register_interface():
     log = getLogger('interface')
     for clazz in classes:
@@ -1474,6 +1642,8 @@ def register_interface():
         update_handlers = bpy.app.handlers.depsgraph_update_post
     update_handlers.append(handler_scene_or_depsgraph_update_post_once)
     bpy.app.handlers.load_post.append(handler_load_post)
+    bpy.app.handlers.undo_post.append(handler_undo_redo_post)
+    bpy.app.handlers.redo_post.append(handler_undo_redo_post)
 
 def unregister_interface():
     log = getLogger('interface')
@@ -1491,8 +1661,10 @@ def unregister_interface():
     except ValueError: # already removed
         log.exception('load_post does not have handler handler_load_post, '
             'but that handler should be persistent and kept enabled')
-    if hasattr(bpy, 'msgbus'):
-        bpy.msgbus.clear_by_owner(msgbus_owner)
+    for handler_list in (bpy.app.handlers.undo_post, bpy.app.handlers.redo_post):
+        if handler_undo_redo_post in handler_list:
+            handler_list.remove(handler_undo_redo_post)
+    msgbus_watchers.clear()
 
     for clazz in reversed(classes):
         if clazz is None:
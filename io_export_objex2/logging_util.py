@@ -1,6 +1,9 @@
 import bpy
 
 import logging
+import logging.handlers
+import queue
+import sys
 
 from . import util
 
@@ -32,92 +35,243 @@ class AddonLoggingPreferences:
     def draw(self, context):
         self.layout.prop(self, 'logging_level')
 
-def getLogger(name):
-    global root_logger
-    log = root_logger.getChild(name)
-    def trace(message, *args, **kws):
-        if log.isEnabledFor(logging_trace_level):
-            log._log(logging_trace_level, message, args, **kws)
-    log.trace = trace
-    def Logger_makeRecordWrapper(name, level, fn, lno, msg, args, exc_info, func=None, extra=None, sinfo=None):
+class ObjexLogRecord(logging.LogRecord):
+    """Formats messages with str.format (new style formatting) instead of %"""
+    def getMessage(self):
+        msg = str(self.msg)
+        args = self.args
+        if args:
+            if not isinstance(args, tuple):
+                args = (args,)
+            msg = msg.format(*args)
+        return msg
+
+class ObjexLogger(logging.Logger):
+    """
+    Loggers returned by getLogger, children of root_logger
+    Messages use new style formatting, and are only formatted if a handler needs the record
+    Use the isTraceEnabled/isDebugEnabled guards to avoid computing expensive arguments in loops
+    """
+    def trace(self, message, *args, **kws):
+        if self.isEnabledFor(logging_trace_level):
+            if sys.version_info >= (3, 8):
+                # report the caller of trace in records, not trace itself
+                kws.setdefault('stacklevel', 2)
+            self._log(logging_trace_level, message, args, **kws)
+
+    def isTraceEnabled(self):
+        return self.isEnabledFor(logging_trace_level)
+
+    def isDebugEnabled(self):
+        return self.isEnabledFor(logging.DEBUG)
+
+    def isEnabledFor(self, level):
+        # not cached like logging.Logger.isEnabledFor, as these loggers aren't known to the logging manager
+        return level >= self.getEffectiveLevel()
+
+    def makeRecord(self, name, level, fn, lno, msg, args, exc_info, func=None, extra=None, sinfo=None):
         name = name[len(__package__)+1:]
-        self = log
-        record = logging.Logger.makeRecord(self, name, level, fn, lno, msg, args, exc_info, func, sinfo)
-        def LogRecord_getMessageNewStyleFormatting():
-            self = record
-            msg = str(self.msg)
-            args = self.args
-            if args:
-                if not isinstance(args, tuple):
-                    args = (args,)
-                msg = msg.format(*args)
-            return msg
-        record.getMessage = LogRecord_getMessageNewStyleFormatting
+        record = ObjexLogRecord(name, level, fn, lno, msg, args, exc_info, func, sinfo)
+        if extra is not None:
+            for key in extra:
+                if key in ('message', 'asctime') or key in record.__dict__:
+                    raise KeyError('Attempt to overwrite {!r} in LogRecord'.format(key))
+                record.__dict__[key] = extra[key]
         return record
-    log.makeRecord = Logger_makeRecordWrapper
+
+# {name: ObjexLogger}
+loggers = {}
+
+def getLogger(name):
+    log = loggers.get(name)
+    if log is None:
+        log = ObjexLogger('%s.%s' % (root_logger.name, name))
+        log.parent = root_logger
+        loggers[name] = log
     return log
 
+def updateRootLoggerLevel():
+    """
+    Set the level of root_logger to the lowest level of its handlers,
+    so that loggers know what levels are disabled without creating records
+    """
+    levels = [handler.level for handler in root_logger.handlers]
+    root_logger.setLevel(max(1, min(levels)) if levels else logging.WARNING)
+
 def registerLogging(root_logger_name):
-    global root_logger, root_logger_formatter, root_logger_stream_handler, root_logger_file_handler, root_logger_operator_report_handler
+    global root_logger, root_logger_formatter, root_logger_stream_handler, root_logger_file_handler, root_logger_file_listener, root_logger_operator_report_handler
     root_logger = logging.getLogger('%s.%s' % (__package__, root_logger_name))
+    loggers.clear()
     root_logger_stream_handler = logging.StreamHandler()
     root_logger_file_handler = None
+    root_logger_file_listener = None
     root_logger_operator_report_handler = None
     root_logger_formatter = logging.Formatter('{levelname:s}:{name:s}.{funcName:s}: {message:s}', style='{')
     root_logger_stream_handler.setFormatter(root_logger_formatter)
     root_logger.addHandler(root_logger_stream_handler)
-    root_logger.setLevel(1) # actual level filtering is left to handlers
+    # actual level filtering is left to handlers, see updateRootLoggerLevel
     resetLoggingSettings()
     getLogger('logging_util').debug('Logging OK')
 
 def setConsoleLevel(level):
     global root_logger_stream_handler
     root_logger_stream_handler.setLevel(level)
+    updateRootLoggerLevel()
 
 def setConsoleLevelDefault(level):
     global default_level_console
     default_level_console = level
     setConsoleLevel(level)
 
-def setLogFile(path):
-    global root_logger, root_logger_formatter, root_logger_file_handler
+class BatchedRotatingFileHandler(logging.handlers.RotatingFileHandler):
+    """
+    Only flushes every flush_records records, instead of after every record
+    (LogFileQueueListener also flushes when no more records are waiting)
+    """
+    def __init__(self, filename, mode='a', maxBytes=0, backupCount=0, flush_records=256):
+        super().__init__(filename, mode=mode, maxBytes=maxBytes, backupCount=backupCount, encoding='utf-8')
+        self.flush_records = flush_records
+        self.unflushed_records = 0
+
+    def emit(self, record):
+        try:
+            if self.shouldRollover(record):
+                self.doRollover()
+            if self.stream is None:
+                self.stream = self._open()
+            self.stream.write(self.format(record) + self.terminator)
+            self.unflushed_records += 1
+            if self.unflushed_records >= self.flush_records:
+                self.flush()
+        except Exception:
+            self.handleError(record)
+
+    def flush(self):
+        self.unflushed_records = 0
+        super().flush()
+
+class LogFileQueueListener(logging.handlers.QueueListener):
+    """Writes queued records from a background thread, flushing whenever the queue gets empty"""
+    def dequeue(self, block):
+        if block and self.queue.empty():
+            for handler in self.handlers:
+                handler.flush()
+        return self.queue.get(block)
+
+def setLogFile(path, max_bytes=0, backup_count=3):
+    """
+    Log everything to the file at path (or stop logging to a file if path is None)
+    Records are written to the file from a background thread, the file is closed
+    once all records are written when calling setLogFile again (resetLoggingSettings)
+    If max_bytes isn't 0, the file is appended to and rotated when it gets bigger than max_bytes
+    """
+    global root_logger, root_logger_formatter, root_logger_file_handler, root_logger_file_listener
     if root_logger_file_handler:
         root_logger.removeHandler(root_logger_file_handler)
         root_logger_file_handler = None
+        # write remaining records, and stop the thread
+        root_logger_file_listener.stop()
+        for handler in root_logger_file_listener.handlers:
+            handler.close()
+        root_logger_file_listener = None
     if path:
-        root_logger_file_handler = logging.FileHandler(path, mode='w')
-        root_logger_file_handler.setFormatter(root_logger_formatter)
+        file_handler = BatchedRotatingFileHandler(path, mode='a' if max_bytes else 'w',
+                                                  maxBytes=max_bytes, backupCount=backup_count)
+        file_handler.setFormatter(root_logger_formatter)
+        log_queue = queue.Queue()
+        # the QueueHandler formats messages in the logging thread (str.format arguments may be Blender data),
+        # root_logger_formatter is then used by file_handler in the listener thread
+        root_logger_file_handler = logging.handlers.QueueHandler(log_queue)
+        root_logger_file_listener = LogFileQueueListener(log_queue, file_handler)
+        root_logger_file_listener.start()
         root_logger.addHandler(root_logger_file_handler)
         root_logger_file_handler.setLevel(1)
+    updateRootLoggerLevel()
 
 class OperatorReportLogHandler(logging.Handler):
-    def __init__(self, operator):
+    """
+    Reports records to the operator (operator.report)
+    Records are grouped in categories by logger and message template (before formatting):
+    identical messages are only reported once, and at most max_reports_per_category
+    different messages are reported per category.
+    The messages that weren't reported are summarized by report_summary, with
+    their count and up to max_summary_examples examples per category.
+    """
+    def __init__(self, operator, max_reports_per_category=5, max_summary_examples=3):
         super().__init__()
         self.operator = operator
+        self.max_reports_per_category = max_reports_per_category
+        self.max_summary_examples = max_summary_examples
+        # {(logger name, message template): OperatorReportCategory}
+        self.categories = {}
 
     def flush(self):
         pass
 
+    def get_report_type(self, levelno):
+        for levelType,  minLevel in (
+            ('ERROR',   logging.WARNING),
+            ('WARNING', logging.INFO),
+            ('INFO',    logging.DEBUG)
+        ):
+            if levelno > minLevel:
+                return levelType
+        return 'DEBUG'
+
     def emit(self, record):
         try:
-            type = 'DEBUG'
-            for levelType,  minLevel in (
-                ('ERROR',   logging.WARNING),
-                ('WARNING', logging.INFO),
-                ('INFO',    logging.DEBUG)
-            ):
-                if record.levelno > minLevel:
-                    type = levelType
-                    break
+            key = (record.name, str(record.msg))
+            category = self.categories.get(key)
+            if category is None:
+                category = self.categories[key] = OperatorReportCategory(record.name)
             msg = self.format(record)
-            self.operator.report({type}, msg)
+            if msg in category.messages:
+                category.duplicates += 1
+                return
+            category.messages.add(msg)
+            category.levelno = max(category.levelno, record.levelno)
+            if len(category.messages) <= self.max_reports_per_category:
+                self.operator.report({self.get_report_type(record.levelno)}, msg)
+            else:
+                category.skipped += 1
+                if len(category.skipped_examples) < self.max_summary_examples:
+                    category.skipped_examples.append(record.getMessage())
         except Exception:
             self.handleError(record)
 
+    def report_summary(self):
+        for category in self.categories.values():
+            if not (category.skipped or category.duplicates):
+                continue
+            lines = []
+            if category.skipped:
+                lines.append('{:d} more messages like these from {} were not reported, for example:'.format(
+                    category.skipped, category.logger_name))
+                lines.extend('- %s' % example.split('\n')[0] for example in category.skipped_examples)
+            if category.duplicates:
+                lines.append('{:d} repeated messages from {} were not reported'.format(
+                    category.duplicates, category.logger_name))
+            self.operator.report({self.get_report_type(category.levelno)}, '\n'.join(lines))
+        self.categories.clear()
+
+class OperatorReportCategory():
+    def __init__(self, logger_name):
+        self.logger_name = logger_name
+        self.levelno = logging.NOTSET
+        self.messages = set()
+        self.duplicates = 0
+        self.skipped = 0
+        self.skipped_examples = []
+
 def setLogOperator(operator, level=logging.INFO, user_friendly_formatter=False):
+    """
+    Report logs to the operator, until setLogOperator is called again (for example with None)
+    which reports a summary of the logs that weren't reported (see OperatorReportLogHandler)
+    """
     global root_logger, root_logger_formatter, root_logger_operator_report_handler
     if root_logger_operator_report_handler:
         root_logger.removeHandler(root_logger_operator_report_handler)
+        root_logger_operator_report_handler.report_summary()
         root_logger_operator_report_handler = None
     if operator:
         root_logger_operator_report_handler = OperatorReportLogHandler(operator)
@@ -128,6 +282,7 @@ def setLogOperator(operator, level=logging.INFO, user_friendly_formatter=False):
             root_logger_operator_report_handler.setFormatter(root_logger_formatter)
         root_logger_operator_report_handler.setLevel(level)
         root_logger.addHandler(root_logger_operator_report_handler)
+    updateRootLoggerLevel()
 
 def resetLoggingSettings():
     global default_level_console
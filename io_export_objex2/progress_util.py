@@ -0,0 +1,136 @@
+import bpy
+
+import contextlib
+import time
+import tracemalloc
+
+from .logging_util import getLogger
+
+def estimate_object_work(ob):
+    """How much work writing ob is expected to be, in vertices + loops of its (unevaluated) mesh data"""
+    if ob.type == 'MESH':
+        return 1 + len(ob.data.vertices) + len(ob.data.loops)
+    return 1
+
+class ExportProgress():
+    """
+    Progress of an export, measured in work units (see estimate_object_work)
+    Updates (the window manager progress indicator and a log line with an ETA)
+    are throttled to at most one every min_interval seconds.
+    Does nothing in background mode.
+    """
+    def __init__(self, window_manager, min_interval=0.5):
+        self.log = getLogger('ExportProgress')
+        self.window_manager = window_manager
+        self.enabled = not bpy.app.background and window_manager is not None
+        self.min_interval = min_interval
+        self.total = 0
+        self.done = 0
+        self.time_start = self.time_last_update = None
+
+    def begin(self, total):
+        self.total = max(total, 1)
+        self.done = 0
+        self.time_start = self.time_last_update = time.perf_counter()
+        if self.enabled:
+            self.window_manager.progress_begin(0, 1000)
+
+    def step(self, work):
+        """Advance by work units, and update the progress display if it wasn't updated recently"""
+        self.done += work
+        if not self.enabled:
+            return
+        now = time.perf_counter()
+        if now - self.time_last_update < self.min_interval:
+            return
+        self.time_last_update = now
+        fraction = min(self.done / self.total, 1)
+        self.window_manager.progress_update(int(fraction * 1000))
+        self.log.info('Progress: {:6.2f}% ETA {}', fraction * 100, self.format_eta(now))
+
+    def eta(self, now=None):
+        """Estimated time left in seconds, or None if nothing was done yet"""
+        if not self.done:
+            return None
+        if now is None:
+            now = time.perf_counter()
+        elapsed = now - self.time_start
+        return max(elapsed * (self.total - self.done) / self.done, 0)
+
+    def format_eta(self, now=None):
+        eta = self.eta(now)
+        if eta is None:
+            return '?'
+        return '%d:%02d' % divmod(int(eta), 60)
+
+    def end(self):
+        if self.time_start is None:
+            return
+        self.log.info('Done in {:.3f} s', time.perf_counter() - self.time_start)
+        self.time_start = None
+        if self.enabled:
+            self.window_manager.progress_end()
+
+def format_size(size):
+    for unit in ('B', 'KiB', 'MiB'):
+        if abs(size) < 1024:
+            return '%.1f %s' % (size, unit)
+        size /= 1024
+    return '%.1f GiB' % size
+
+class MemoryUsage():
+    """
+    Peak Python memory (as traced by tracemalloc) of export stages and objects
+    Sections may be nested (objects in a stage), the peak of a section includes the peaks of its sub-sections.
+    Tracing slows down the export a lot, so it is only done if enabled (see the TRACE_MEMORY export option).
+    """
+    def __init__(self, enabled=False):
+        self.log = getLogger('MemoryUsage')
+        self.enabled = enabled
+        self.started_tracing = False
+        # [name, traced memory when entering, peak so far], for the current section and its parents
+        self.sections = []
+        # [(peak, name)] of the sections at depth 1 (objects)
+        self.peaks = []
+
+    def start(self):
+        if self.enabled and not tracemalloc.is_tracing():
+            tracemalloc.start()
+            self.started_tracing = True
+
+    def stop(self):
+        if not self.started_tracing:
+            return
+        if self.peaks:
+            self.peaks.sort(reverse=True)
+            self.log.info('Highest memory peaks:\n{}', '\n'.join(
+                '{} {}'.format(format_size(peak), name) for peak, name in self.peaks[:10]))
+        tracemalloc.stop()
+        self.started_tracing = False
+        self.peaks = []
+
+    def _reset_peak(self):
+        """Propagates the peak reached so far to all open sections, then resets it"""
+        current, peak = tracemalloc.get_traced_memory()
+        for section in self.sections:
+            section[2] = max(section[2], peak)
+        if hasattr(tracemalloc, 'reset_peak'): # Python 3.9+ (Blender 2.93+)
+            tracemalloc.reset_peak()
+        return current
+
+    @contextlib.contextmanager
+    def section(self, name):
+        if not tracemalloc.is_tracing():
+            yield
+            return
+        current = self._reset_peak()
+        self.sections.append([name, current, current])
+        try:
+            yield
+        finally:
+            current = self._reset_peak()
+            name, current_before, peak = self.sections.pop()
+            self.log.debug('Memory {}: peak {} ({} above start), retained {}', name,
+                format_size(peak), format_size(peak - current_before), format_size(current - current_before))
+            if len(self.sections) == 1:
+                self.peaks.append((peak - current_before, name))
@@ -22,6 +22,9 @@ class SavedPose(bpy.types.PropertyGroup):
             default='UNFOLDEDpose_foldedRest'
         )
     bones = bpy.props.CollectionProperty(type=SavedPoseBone)
+    # see rigging_helpers.armature_fingerprints, empty for poses saved before they were stored
+    names_fingerprint = bpy.props.StringProperty()
+    hierarchy_fingerprint = bpy.props.StringProperty()
 
 class ObjexSceneProperties(bpy.types.PropertyGroup):
     is_objex_scene = bpy.props.BoolProperty()
@@ -48,7 +51,9 @@ class ObjexSceneProperties(bpy.types.PropertyGroup):
                 'material when its objex backface culling property changes.',1 << 1),
         ],
         name='Sync Backface Culling',
-        description='How to sync the two backface culling properties, the one in vanilla Blender and the objex one',
+        description='How to sync the two backface culling properties, the one in vanilla Blender and the objex one.\n'
+                    'Materials loaded with the two properties differing are only synced when exported (with materials) '
+                    'or when one of the two properties is changed',
         options={'ENUM_FLAG'},
         default={'BLENDER_TO_OBJEX','OBJEX_TO_BLENDER'},
     )
@@ -3,12 +3,33 @@ from . import blender_version_compatibility
 import bpy
 import mathutils
 
+import hashlib
+
 from math import pi
 
 from . import logging_util
 
 # find/show unassigned/multiassigned vertices
 
+def count_bone_groups(object, armature):
+    """
+    Returns (n_bone_groups, ignored_vertex_groups)
+    n_bone_groups is an array of how many vertex groups named after a bone of armature each vertex of object is in
+    ignored_vertex_groups lists the indices of the other vertex groups vertices are in
+    """
+    # the exporter (and numpy) are only imported when needed, see __init__.py
+    import numpy
+    from .export_objex import VertexWeightTable
+    bones = armature.data.bones
+    bone_group_mask = numpy.array([group.name in bones for group in object.vertex_groups], dtype=bool)
+    weight_table = VertexWeightTable.from_vertices(object.data.vertices)
+    n_bone_groups = numpy.diff(weight_table.filtered_groups(bone_group_mask).offsets)
+    ignored_vertex_groups = [
+        group for group in numpy.unique(weight_table.group_indices).tolist()
+        if group < len(bone_group_mask) and not bone_group_mask[group]
+    ]
+    return n_bone_groups, ignored_vertex_groups
+
 class OBJEX_OT_mesh_find_vertices():
 
     bl_options = {'REGISTER','UNDO'}
@@ -33,30 +54,17 @@ class OBJEX_OT_mesh_find_vertices():
         was_editmode = mesh.is_editmode
         if was_editmode:
             bpy.ops.object.mode_set(mode='OBJECT')
-        found = False
-        self.ignored_vertex_groups = set()
-        def test(v):
-            n_bone_groups = 0
-            for g in v.groups:
-                if object.vertex_groups[g.group].name in armature.data.bones:
-                    n_bone_groups += 1
-                else:
-                    self.ignored_vertex_groups.add(g.group)
-            return self.test(n_bone_groups)
-        # search for any matching vertex
-        for v in mesh.vertices:
-            if test(v):
-                found = True
-                break
+        n_bone_groups, self.ignored_vertex_groups = count_bone_groups(object, armature)
+        # test is applied to all vertices at once
+        found_vertices = self.test(n_bone_groups)
+        found = bool(found_vertices.any())
         # only select vertices if some were found
         if found and select_found:
             bpy.ops.object.mode_set(mode='EDIT')
             bpy.ops.mesh.select_mode(type='VERT')
             bpy.ops.mesh.select_all(action='DESELECT')
             bpy.ops.object.mode_set(mode='OBJECT')
-            for v in mesh.vertices:
-                if test(v):
-                    v.select = True
+            mesh.vertices.foreach_set('select', found_vertices)
         if was_editmode or (found and select_found):
             bpy.ops.object.mode_set(mode='EDIT')
         if found:
@@ -129,96 +137,318 @@ class OBJEX_OT_mesh_list_vertex_groups(bpy.types.Operator):
         return {'FINISHED'}
 
 
+# rig health report: statistics about the vertex groups of all rigged meshes
+
+def mesh_rig_health(object, armature):
+    """
+    Returns a dict of statistics about how the vertices of the mesh object are assigned to bones of armature
+    A bone group is a vertex group named after a bone, other groups are ignored by the exporter.
+    zero_weight_vertices are in bone groups, but only with a weight of 0
+    """
+    import numpy
+    from .export_objex import VertexWeightTable
+    mesh = object.data
+    if object.mode == 'EDIT' and hasattr(object, 'update_from_editmode'): # 2.80+
+        # read current edit mode data without leaving edit mode
+        object.update_from_editmode()
+    bones = armature.data.bones
+    vertex_groups = object.vertex_groups
+    group_is_bone = numpy.array([group.name in bones for group in vertex_groups], dtype=bool)
+    group_is_deform = numpy.array([group.name in bones and bones[group.name].use_deform for group in vertex_groups], dtype=bool)
+    weight_table = VertexWeightTable.from_vertices(mesh.vertices)
+    vertex_count = weight_table.vertex_count()
+    vertex_indices = weight_table.vertex_indices()
+    group_indices = weight_table.group_indices
+    # per vertex group membership
+    valid = group_indices < len(vertex_groups)
+    is_bone = numpy.zeros(len(group_indices), dtype=bool)
+    is_bone[valid] = group_is_bone[group_indices[valid]]
+    is_deform = numpy.zeros(len(group_indices), dtype=bool)
+    is_deform[valid] = group_is_deform[group_indices[valid]]
+    # per vertex
+    n_bone_groups = numpy.bincount(vertex_indices[is_bone], minlength=vertex_count)
+    n_weighted_bone_groups = numpy.bincount(vertex_indices[is_bone & (weight_table.weights != 0)], minlength=vertex_count)
+    non_bone_groups = numpy.unique(group_indices[valid & ~is_bone]).tolist()
+    return {
+        'object': object.name,
+        'armature': armature.name,
+        'vertices': vertex_count,
+        'unassigned_vertices': int(numpy.count_nonzero(n_bone_groups == 0)),
+        'multiassigned_vertices': int(numpy.count_nonzero(n_bone_groups > 1)),
+        'zero_weight_vertices': int(numpy.count_nonzero((n_bone_groups > 0) & (n_weighted_bone_groups == 0))),
+        'non_bone_group_vertices': len(numpy.unique(vertex_indices[~is_bone])),
+        'non_deform_bone_vertices': len(numpy.unique(vertex_indices[is_bone & ~is_deform])),
+        'non_bone_groups': [vertex_groups[group].name for group in non_bone_groups],
+    }
+
+def rig_health_report(objects):
+    """Returns {armature name: [mesh_rig_health(...), ...]} for all meshes in objects rigged to an armature"""
+    report = {}
+    for object in objects:
+        if object.type != 'MESH':
+            continue
+        armature = object.find_armature()
+        if armature:
+            report.setdefault(armature.name, []).append(mesh_rig_health(object, armature))
+    for meshes in report.values():
+        meshes.sort(key=lambda mesh_health: mesh_health['object'])
+    return report
+
+def rig_health_problem_count(mesh_health):
+    return (mesh_health['unassigned_vertices'] + mesh_health['multiassigned_vertices']
+            + mesh_health['zero_weight_vertices'] + mesh_health['non_deform_bone_vertices'])
+
+# last report made by OBJEX_OT_rig_health_report, displayed by interface.OBJEX_PT_rig_health
+last_rig_health_report = None
+
+class OBJEX_OT_rig_health_report(bpy.types.Operator):
+
+    bl_idname = 'objex.rig_health_report'
+    bl_label = 'Check vertex groups of all rigged meshes'
+
+    filepath = bpy.props.StringProperty(
+            name='Report file',
+            description='If set, also write the report to this file (as JSON)',
+            subtype='FILE_PATH',
+            default=''
+        )
+
+    def execute(self, context):
+        global last_rig_health_report
+        report = rig_health_report(context.scene.objects)
+        last_rig_health_report = report
+        if self.filepath:
+            import json
+            filepath = bpy.path.abspath(self.filepath)
+            with open(filepath, 'w', encoding='utf8', newline='\n') as f:
+                json.dump({'blend': bpy.data.filepath, 'armatures': report}, f, indent=4, sort_keys=True)
+        meshes = [mesh_health for meshes in report.values() for mesh_health in meshes]
+        problem_meshes = [mesh_health['object'] for mesh_health in meshes if rig_health_problem_count(mesh_health)]
+        if problem_meshes:
+            self.report({'WARNING'}, 'Found vertex group issues in %d of %d rigged meshes: %s' % (
+                len(problem_meshes), len(meshes), ', '.join(problem_meshes)))
+        else:
+            self.report({'INFO'}, 'No vertex group issues in %d rigged meshes' % len(meshes))
+        return {'FINISHED'}
+
+
 # folding/unfolding
 
-def var_armature_rest(obj):
-    """Compute variance of x,y,z coordinates in world space of bones center in rest position"""
-    arma = obj.data.copy()
-    arma.transform(obj.matrix_world)
-    sum = mathutils.Vector()
-    for b in arma.bones:
-        sum += ((b.head_local + b.tail_local) / 2)
-    mean = sum / len(arma.bones)
-    var = mathutils.Vector()
-    for b in arma.bones:
-        delta = ((b.head_local + b.tail_local) / 2) - mean
-        var += mathutils.Vector(d*d for d in delta)
-    var /= len(arma.bones)
-    bpy.data.armatures.remove(arma)
-    return var
+def bones_vectors(bones, attribute):
+    """Returns an array of shape (len(bones), 3) of the attribute vector of each bone, read with foreach_get"""
+    import numpy
+    vectors = numpy.empty(len(bones) * 3, dtype=numpy.float32)
+    bones.foreach_get(attribute, vectors)
+    return vectors.reshape(-1, 3).astype(numpy.float64)
+
+def armature_rest_points(obj):
+    """Returns (head_local, tail_local) arrays of the bones of the armature object obj, in armature space"""
+    bones = obj.data.bones
+    return bones_vectors(bones, 'head_local'), bones_vectors(bones, 'tail_local')
+
+def to_world_space(obj, points):
+    """Transform an array of points of shape (n, 3) by obj.matrix_world"""
+    import numpy
+    matrix = numpy.array(obj.matrix_world, dtype=numpy.float64)
+    return points.dot(matrix[:3,:3].T) + matrix[:3,3]
+
+def points_variance(points):
+    return mathutils.Vector(points.var(axis=0).tolist())
+
+def var_armature_rest(obj, rest_points=None):
+    """
+    Compute variance of x,y,z coordinates in world space of bones center in rest position
+    rest_points may be the result of armature_rest_points(obj), to avoid reading the bones again
+    """
+    heads, tails = rest_points if rest_points else armature_rest_points(obj)
+    return points_variance(to_world_space(obj, (heads + tails) / 2))
 
 def var_armature_pose(obj):
     """Compute variance of x,y,z coordinates in world space of bones center in pose position"""
-    sum = mathutils.Vector()
-    for b in obj.pose.bones:
-        sum += blender_version_compatibility.matmul(obj.matrix_world, b.center)
-    mean = sum / len(obj.pose.bones)
-    var = mathutils.Vector()
-    for b in obj.pose.bones:
-        delta = blender_version_compatibility.matmul(obj.matrix_world, b.center) - mean
-        var += mathutils.Vector(d*d for d in delta)
-    var /= len(obj.pose.bones)
-    return var
-
-def is_folded_guess(armature):
+    return points_variance(to_world_space(obj, bones_vectors(obj.pose.bones, 'center')))
+
+def is_folded_guess(armature, rest_points=None):
     """
     Returns True if all bones in rest position have head_local.x >= 0,
     which seems to be a common factor of folded skeletons
+    rest_points may be the result of armature_rest_points(armature), to avoid reading the bones again
     """
-    xMin = min(bone.head_local.x for bone in armature.data.bones)
+    heads, tails = rest_points if rest_points else armature_rest_points(armature)
+    xMin = heads[:,0].min()
     logging_util.getLogger('rigging_helpers').debug('xMin = {}', xMin)
     return xMin > -1e-5 # allow a small error
 
-def checkSaveCompatibitility(armature, saved_pose):
+def bones_fingerprints(names_parents):
     """
-    Returns true if the pose defined by saved_pose can be restored to armature
+    Returns (names_fingerprint, hierarchy_fingerprint) from an iterable of (bone name, parent bone name or '')
+    names_fingerprint only depends on the set of names, hierarchy_fingerprint also on the parents
     """
-    # 421todo store and check hierarchy too?
-    # check if armature and saved_pose have bones with the same names
-    return (
-        set(bone.name for bone in armature.pose.bones)
-            == set(bone.bone_name for bone in saved_pose.bones)
+    names_parents = sorted(names_parents)
+    names_hash = hashlib.sha1()
+    hierarchy_hash = hashlib.sha1()
+    for name, parent_name in names_parents:
+        names_hash.update(name.encode('utf-8') + b'\0')
+        hierarchy_hash.update(name.encode('utf-8') + b'\0' + parent_name.encode('utf-8') + b'\n')
+    return names_hash.hexdigest(), hierarchy_hash.hexdigest()
+
+def armature_fingerprints(armature):
+    """Returns (names_fingerprint, hierarchy_fingerprint) of the bones of armature, see bones_fingerprints"""
+    return bones_fingerprints(
+        (bone.name, bone.parent.name if bone.parent else '')
+        for bone in armature.data.bones)
+
+class SavedPoseEntry():
+    """
+    Bone names of a SavedPose, see get_saved_pose_entry
+    bone_names is in the order of saved_pose.bones (and of the arrays returned by saved_pose_arrays)
+    names_fingerprint and hierarchy_fingerprint are as stored on the saved pose when it was saved,
+    empty for poses saved before they were stored
+    """
+    __slots__ = (
+        'bone_names', 'name_to_index',
+        'names_fingerprint', 'hierarchy_fingerprint',
     )
 
-def restoreSavedPose(armature, saved_bones, invert=False):
+def saved_pose_arrays(saved_pose):
+    """Returns (locations, rotation_quaternions) of saved_pose.bones, read with foreach_get"""
+    import numpy
+    n = len(saved_pose.bones)
+    locations = numpy.empty(n * 3, dtype=numpy.float32)
+    rotation_quaternions = numpy.empty(n * 4, dtype=numpy.float32)
+    saved_pose.bones.foreach_get('location', locations)
+    saved_pose.bones.foreach_get('rotation_quaternion', rotation_quaternions)
+    return locations.reshape(-1, 3), rotation_quaternions.reshape(-1, 4)
+
+# saved_pose.as_pointer() : SavedPoseEntry
+saved_pose_entries = dict()
+
+def get_saved_pose_entry(saved_pose):
     """
-    Set the armature's pose from the provided saved bones
-    names of armature pose bones should match the names of saved bones (this doesn't check)
+    Returns the (cached) SavedPoseEntry of saved_pose
+    The cached entry is checked against the bone count and the fingerprints stored on saved_pose
+    (the cache is cleared when pointers may be reused, see clear_saved_pose_entries)
+    Poses saved without fingerprints are not cached, the bone count alone doesn't tell if their entry is still valid
+    """
+    key = saved_pose.as_pointer()
+    names_fingerprint = saved_pose.names_fingerprint
+    entry = saved_pose_entries.get(key)
+    if (entry is not None and names_fingerprint
+        and entry.names_fingerprint == names_fingerprint
+        and entry.hierarchy_fingerprint == saved_pose.hierarchy_fingerprint
+        and len(entry.bone_names) == len(saved_pose.bones)
+    ):
+        return entry
+    entry = SavedPoseEntry()
+    entry.bone_names = [saved_bone.bone_name for saved_bone in saved_pose.bones]
+    entry.name_to_index = {name: i for i, name in enumerate(entry.bone_names)}
+    entry.names_fingerprint = names_fingerprint
+    entry.hierarchy_fingerprint = saved_pose.hierarchy_fingerprint
+    if names_fingerprint:
+        saved_pose_entries[key] = entry
+    return entry
+
+def checkSaveCompatibitility(armature, saved_pose, log=None):
+    """
+    Returns true if the pose defined by saved_pose can be restored to armature,
+    that is if armature and saved_pose have bones with the same names
+    Warns if the bones were reparented since the pose was saved (the pose can still be restored)
+    """
+    if not log:
+        log = logging_util.getLogger('rigging_helpers')
+    entry = get_saved_pose_entry(saved_pose)
+    bones = armature.data.bones
+    if len(bones) != len(entry.name_to_index) or any(bone.name not in entry.name_to_index for bone in bones):
+        return False
+    if entry.hierarchy_fingerprint and entry.hierarchy_fingerprint != armature_fingerprints(armature)[1]:
+        log.warning('Bones of armature {} have different parents than when saved pose {} was saved, '
+            'restoring the pose may not give the expected result', armature.name, saved_pose.name)
+    return True
+
+def restoreSavedPose(armature, saved_pose, invert=False):
+    """
+    Set the armature's pose from the provided saved pose
+    pose bones of armature without a saved bone of the same name are left as they are
     invert=True inverts the pose before setting it on the armature
     """
+    import numpy
+    # assume eg checkSaveCompatibitility() has been called somewhere
+    entry = get_saved_pose_entry(saved_pose)
+    # the transforms are read each time, only the bone names are cached
+    saved_pose_locations, saved_pose_rotation_quaternions = saved_pose_arrays(saved_pose)
+    pose_bones = armature.pose.bones
+    # indices in pose_bones of the bones to restore, and the corresponding indices in entry
+    restored = []
+    order = []
+    for i, bone in enumerate(pose_bones):
+        saved_index = entry.name_to_index.get(bone.name)
+        if saved_index is not None:
+            restored.append(i)
+            order.append(saved_index)
+    if len(restored) < len(pose_bones):
+        logging_util.getLogger('rigging_helpers').debug('{} bones of armature {} are not in saved pose {}, left as they are',
+            len(pose_bones) - len(restored), armature.name, saved_pose.name)
+    # start from the current pose, for bones not restored to be set to their own values
+    locations = numpy.empty(len(pose_bones) * 3, dtype=numpy.float32)
+    rotation_quaternions = numpy.empty(len(pose_bones) * 4, dtype=numpy.float32)
+    pose_bones.foreach_get('location', locations)
+    pose_bones.foreach_get('rotation_quaternion', rotation_quaternions)
+    locations = locations.reshape(-1, 3)
+    rotation_quaternions = rotation_quaternions.reshape(-1, 4)
+    saved_locations = saved_pose_locations[order].astype(numpy.float64)
+    saved_rotation_quaternions = saved_pose_rotation_quaternions[order].astype(numpy.float64)
+    if invert:
+        # inverse quaternion is the conjugate divided by the squared norm
+        saved_rotation_quaternions[:,1:] *= -1
+        saved_rotation_quaternions /= (saved_rotation_quaternions ** 2).sum(axis=1)[:,numpy.newaxis]
+        # rotate the negated locations by the inverted quaternions (normalized)
+        q = saved_rotation_quaternions / numpy.linalg.norm(saved_rotation_quaternions, axis=1)[:,numpy.newaxis]
+        w = q[:,:1]
+        u = q[:,1:]
+        v = -saved_locations
+        t = 2 * numpy.cross(u, v)
+        saved_locations = v + w * t + numpy.cross(u, t)
+    locations[restored] = saved_locations
+    rotation_quaternions[restored] = saved_rotation_quaternions
     # 421fixme test setting .location when not 0,0,0 , test if order of setting it matters
-    for saved_bone in saved_bones:
-        # assume eg checkSaveCompatibitility() has been called somewhere
-        bone = armature.pose.bones[saved_bone.bone_name]
-        location = mathutils.Vector(saved_bone.location)
-        rotation_quaternion = mathutils.Quaternion(saved_bone.rotation_quaternion)
-        if invert:
-            location *= (-1)
-            rotation_quaternion.invert()
-            location.rotate(rotation_quaternion)
-        bone.location = location
-        rotation_mode_prev = bone.rotation_mode
-        # convert from quaternion in rotation_quaternion to any mode
-        bone.rotation_mode = 'QUATERNION'
-        bone.rotation_quaternion = rotation_quaternion
-        bone.rotation_mode = rotation_mode_prev
+    pose_bones.foreach_set('location', locations.ravel())
+    pose_bones.foreach_set('rotation_quaternion', rotation_quaternions.ravel())
+    # convert from quaternion in rotation_quaternion to the other modes
+    for i, rotation_quaternion in zip(restored, saved_rotation_quaternions.tolist()):
+        bone = pose_bones[i]
+        if bone.rotation_mode == 'QUATERNION':
+            continue
+        rotation_quaternion = mathutils.Quaternion(rotation_quaternion).normalized()
+        if bone.rotation_mode == 'AXIS_ANGLE':
+            axis, angle = rotation_quaternion.to_axis_angle()
+            bone.rotation_axis_angle = (angle, axis.x, axis.y, axis.z)
+        else: # Euler
+            bone.rotation_euler = rotation_quaternion.to_euler(bone.rotation_mode)
 
 def fold_unfold(scene, armature, do_folding, saved_pose, log=None):
+    fold_unfold_armatures(scene, [(armature, do_folding, saved_pose)], log=log)
+
+def fold_unfold_armatures(scene, armatures_folding, log=None):
+    """
+    (Un)fold several armatures and the meshs rigged to them at once
+    armatures_folding is a list of (armature, do_folding, saved_pose) tuples
+    Modifiers visibility is set for all meshs before converting them, so that (in 2.80+)
+    the depsgraph is only evaluated once
+    """
     if not log:
         log = logging_util.getLogger('rigging_helpers')
 
-    meshs = (obj for obj in scene.objects
-        if obj.type == 'MESH' and obj.find_armature() == armature)
+    armatures = [armature for armature, do_folding, saved_pose in armatures_folding]
 
-    # set pose
+    # set poses
     log.trace('restoreSavedPose')
-    if do_folding:
-        # armature/mesh are UNFOLDED, set folded pose
-        # saved_pose.type can only be 'UNFOLDEDpose_foldedRest' or 'foldedPose_UNFOLDEDrest'
-        restoreSavedPose(armature, saved_pose.bones, invert=saved_pose.type != 'foldedPose_UNFOLDEDrest')
-    else:
-        # armature/mesh are folded, set UNFOLDED pose
-        restoreSavedPose(armature, saved_pose.bones, invert=saved_pose.type != 'UNFOLDEDpose_foldedRest')
+    for armature, do_folding, saved_pose in armatures_folding:
+        if do_folding:
+            # armature/mesh are UNFOLDED, set folded pose
+            # saved_pose.type can only be 'UNFOLDEDpose_foldedRest' or 'foldedPose_UNFOLDEDrest'
+            restoreSavedPose(armature, saved_pose, invert=saved_pose.type != 'foldedPose_UNFOLDEDrest')
+        else:
+            # armature/mesh are folded, set UNFOLDED pose
+            restoreSavedPose(armature, saved_pose, invert=saved_pose.type != 'UNFOLDEDpose_foldedRest')
 
     # if not called, modifiers are applied with the wrong pose by to_mesh
     if hasattr(scene, 'update'): # < 2.80
@@ -226,9 +456,14 @@ def fold_unfold(scene, armature, do_folding, saved_pose, log=None):
     else: # 2.80+
         pass
 
-    # (UN)fold rigged meshs
-    for mesh in meshs:
-        # find the armature deform modifier
+    # find rigged meshs and their armature deform modifier
+    meshs = []
+    for mesh in scene.objects:
+        if mesh.type != 'MESH':
+            continue
+        armature = mesh.find_armature()
+        if armature not in armatures:
+            continue
         armature_deform_modifier_candidates = [
             modifier for modifier in mesh.modifiers
             if modifier.type == 'ARMATURE' and modifier.object == armature
@@ -241,52 +476,62 @@ def fold_unfold(scene, armature, do_folding, saved_pose, log=None):
             log.warn('More than one armature deform modifier on mesh {} using armature {}: {}',
                         mesh.name, armature.name, armature_deform_modifier_candidates)
         armature_deform_modifier = armature_deform_modifier_candidates[0]
-        log.debug('armature_deform_modifier.name = {}', armature_deform_modifier.name)
-        # make only armature_deform_modifier active
-        armature_deform_modifier_show_viewport_user = armature_deform_modifier.show_viewport
-        temporarily_disabled_modifiers = [
-            modifier for modifier in mesh.modifiers
-                if modifier != armature_deform_modifier
-                    and modifier.show_viewport]
-        for modifier in temporarily_disabled_modifiers:
-            modifier.show_viewport = False
-        armature_deform_modifier.show_viewport = True
-        log.trace('{} to_mesh...', mesh.name)
+        log.debug('{} armature_deform_modifier.name = {}', mesh.name, armature_deform_modifier.name)
+        meshs.append((mesh, armature_deform_modifier))
+
+    # (modifier, show_viewport) to restore
+    modifiers_show_viewport_user = []
+    try:
+        # make only armature_deform_modifier active, on all meshs
+        for mesh, armature_deform_modifier in meshs:
+            for modifier in mesh.modifiers:
+                show_viewport = modifier == armature_deform_modifier
+                if modifier.show_viewport != show_viewport:
+                    modifiers_show_viewport_user.append((modifier, modifier.show_viewport))
+                    modifier.show_viewport = show_viewport
+
+        # (UN)fold rigged meshs
         # replace mesh data by mesh with modifier-applied
-        if not hasattr(mesh, 'evaluated_get'): # < 2.80
-            mesh.data = mesh.to_mesh(scene, True, calc_tessface=False, settings='PREVIEW')
-        else: # 2.80+
+        if meshs and hasattr(meshs[0][0], 'evaluated_get'): # 2.80+
             # 2.80+ to_mesh: The result is temporary and can not be used by objects from the main database
             # using new_from_object instead (with evaluated_get's result /!\, not mesh directly) works
             log.trace('evaluated_depsgraph_get')
             depsgraph = bpy.context.evaluated_depsgraph_get()
-            log.trace('evaluated_get')
-            mesh_evaluated = mesh.evaluated_get(depsgraph)
-            log.trace('new_from_object')
-            mesh.data = bpy.data.meshes.new_from_object(mesh_evaluated)
-        # restore modifier visibility
+            # create all new meshs from the same evaluation before assigning any
+            new_meshs_data = []
+            for mesh, armature_deform_modifier in meshs:
+                log.trace('{} new_from_object', mesh.name)
+                new_meshs_data.append(bpy.data.meshes.new_from_object(mesh.evaluated_get(depsgraph)))
+            for (mesh, armature_deform_modifier), mesh_data in zip(meshs, new_meshs_data):
+                mesh.data = mesh_data
+        else: # < 2.80
+            for mesh, armature_deform_modifier in meshs:
+                log.trace('{} to_mesh...', mesh.name)
+                mesh.data = mesh.to_mesh(scene, True, calc_tessface=False, settings='PREVIEW')
         log.trace('to_mesh done')
-        for modifier in temporarily_disabled_modifiers:
-            modifier.show_viewport = True
-        armature_deform_modifier.show_viewport = armature_deform_modifier_show_viewport_user
+    finally:
+        # restore modifier visibility
+        for modifier, show_viewport in modifiers_show_viewport_user:
+            modifier.show_viewport = show_viewport
 
-    # (UN)fold armature, apply pose as rest pose
+    # (UN)fold armatures, apply pose as rest pose
     # store current context
-    armature_mode_user = armature.mode
     selected_objects_user = bpy.context.selected_objects[:]
     active_object_user = blender_version_compatibility.get_active_object(bpy.context)
-    # switch context to only armature active/selected and in pose mode
-    while bpy.context.selected_objects:
-        blender_version_compatibility.set_object_select(bpy.context.selected_objects[0], False)
-    blender_version_compatibility.set_object_select(armature, True)
-    # use bpy.context.scene instead of scene
-    blender_version_compatibility.set_active_object(bpy.context, armature)
-    bpy.ops.object.mode_set(mode='POSE')
-    # call "Apply Pose as Rest Pose" operator
-    bpy.ops.pose.armature_apply()
+    for armature in armatures:
+        armature_mode_user = armature.mode
+        # switch context to only armature active/selected and in pose mode
+        while bpy.context.selected_objects:
+            blender_version_compatibility.set_object_select(bpy.context.selected_objects[0], False)
+        blender_version_compatibility.set_object_select(armature, True)
+        # use bpy.context.scene instead of scene
+        blender_version_compatibility.set_active_object(bpy.context, armature)
+        bpy.ops.object.mode_set(mode='POSE')
+        # call "Apply Pose as Rest Pose" operator
+        bpy.ops.pose.armature_apply()
+        bpy.ops.object.mode_set(mode=armature_mode_user)
+        blender_version_compatibility.set_object_select(armature, False)
     # restore context
-    bpy.ops.object.mode_set(mode=armature_mode_user)
-    blender_version_compatibility.set_object_select(armature, False)
     # everything is deselected, now select what was previously selected
     for obj in selected_objects_user:
         blender_version_compatibility.set_object_select(obj, True)
@@ -372,7 +617,9 @@ class OBJEX_OT_autofold_save_pose(bpy.types.Operator, AutofoldOperator):
                 return {'FINISHED'} # still allow the user to pick a name (and save)
 
             var_pose = var_armature_pose(armature)
-            var_rest = var_armature_rest(armature)
+            rest_points = armature_rest_points(armature)
+            var_rest = var_armature_rest(armature, rest_points)
+            log.debug('is_folded_guess = {}', is_folded_guess(armature, rest_points))
             # UNFOLDED positions are usually more spread out
             if var_pose.length > var_rest.length:
                 self.type = 'UNFOLDEDpose_foldedRest'
@@ -420,6 +667,7 @@ class OBJEX_OT_autofold_save_pose(bpy.types.Operator, AutofoldOperator):
 
             saved_pose.name = self.pose_name
             saved_pose.type = self.type
+            saved_pose.names_fingerprint, saved_pose.hierarchy_fingerprint = armature_fingerprints(armature)
 
             self.pose_name_current = saved_pose.name
 
@@ -483,6 +731,7 @@ class OBJEX_OT_autofold_delete_pose(bpy.types.Operator, AutofoldOperator):
         pose_index = scene.objex_bonus.saved_poses.find(self.pose_name)
         if pose_index < 0: # not found
             return {'CANCELLED'}
+        saved_pose_entries.pop(scene.objex_bonus.saved_poses[pose_index].as_pointer(), None)
         scene.objex_bonus.saved_poses.remove(pose_index)
         return {'FINISHED'}
 
@@ -523,11 +772,11 @@ class OBJEX_OT_autofold_restore_pose(bpy.types.Operator, AutofoldOperator):
                 log.warn('Must choose a pose')
                 return {'CANCELLED'}
 
-            if not checkSaveCompatibitility(armature, saved_pose):
+            if not checkSaveCompatibitility(armature, saved_pose, log):
                 log.warn('Saved pose {} cannot be used with armature {}', saved_pose.name, armature.name)
                 return {'CANCELLED'}
 
-            restoreSavedPose(armature, saved_pose.bones)
+            restoreSavedPose(armature, saved_pose)
 
             return {'FINISHED'}
         finally:
@@ -558,49 +807,66 @@ class OBJEX_OT_autofold_fold_unfold(bpy.types.Operator, AutofoldOperator):
             name='Pose',
             description='The saved pose position to use',
         )
+    selected_armatures = bpy.props.BoolProperty(
+            name='All selected',
+            description='Fold/Unfold all selected armatures (and armatures of selected meshs) at once, '
+                        'each with its default saved pose unless a pose is set',
+            default=False
+        )
 
     def execute(self, context):
         log = self.startLogging()
         try:
             scene = context.scene
-            armature = self.get_armature(context)
-
-            if self.pose_name:
-                # self.pose_name should be valid thanks to prop_search
-                saved_pose = scene.objex_bonus.saved_poses[self.pose_name]
+            if self.selected_armatures:
+                armatures = []
+                for obj in context.selected_objects:
+                    armature = obj if obj.type == 'ARMATURE' else obj.find_armature() if obj.type == 'MESH' else None
+                    if armature and armature not in armatures:
+                        armatures.append(armature)
             else:
-                try:
-                    saved_pose = scene.objex_bonus.saved_poses[armature.data.objex_bonus.fold_unfold_saved_pose_index]
-                except IndexError:
-                    log.warn('Select a pose to use among the saved poses\n'
-                        '(if there are no saved poses available you must save a pose first)')
-                    return {'CANCELLED'}
+                armatures = [self.get_armature(context)]
 
-            if not checkSaveCompatibitility(armature, saved_pose):
-                log.warn('Saved pose {} cannot be used with armature {}', saved_pose.name, armature.name)
-                return {'CANCELLED'}
-
-            if self.action == 'SWITCH':
-                if is_folded_guess(armature):
-                    # assume currently folded
-                    do_folding = False # unfold
+            armatures_folding = []
+            for armature in armatures:
+                if self.pose_name:
+                    # self.pose_name should be valid thanks to prop_search
+                    saved_pose = scene.objex_bonus.saved_poses[self.pose_name]
                 else:
-                    # assume currently unfolded
-                    do_folding = True # fold
-            else: # FOLD, UNFOLD
-                do_folding = (self.action == 'FOLD')
-            log.info('Folding' if do_folding else 'Unfolding')
+                    try:
+                        saved_pose = scene.objex_bonus.saved_poses[armature.data.objex_bonus.fold_unfold_saved_pose_index]
+                    except IndexError:
+                        log.warn('Select a pose to use among the saved poses for armature {}\n'
+                            '(if there are no saved poses available you must save a pose first)', armature.name)
+                        return {'CANCELLED'}
+
+                if not checkSaveCompatibitility(armature, saved_pose, log):
+                    log.warn('Saved pose {} cannot be used with armature {}', saved_pose.name, armature.name)
+                    return {'CANCELLED'}
 
-            fold_unfold(scene, armature, do_folding, saved_pose=saved_pose, log=log)
+                if self.action == 'SWITCH':
+                    if is_folded_guess(armature):
+                        # assume currently folded
+                        do_folding = False # unfold
+                    else:
+                        # assume currently unfolded
+                        do_folding = True # fold
+                else: # FOLD, UNFOLD
+                    do_folding = (self.action == 'FOLD')
+                log.info('{} {}', 'Folding' if do_folding else 'Unfolding', armature.name)
+                armatures_folding.append((armature, do_folding, saved_pose))
+
+            fold_unfold_armatures(scene, armatures_folding, log=log)
             # 421todo also fold/unfold actions?
 
-            if self.action == 'SWITCH' and do_folding != is_folded_guess(armature):
-                from_folded_state, to_folded_state = ('UNFOLDED', 'folded') if do_folding else ('folded', 'UNFOLDED')
-                log.warn('It was guessed that the armature was initially {from_folded_state} and had to be {to_folded_state},\n'
-                    'but now that the armature should be {to_folded_state} it is still guessed as {from_folded_state}.\n'
-                    'Results of this switch fold/unfold operation may be wrong,\n'
-                    'you may have to avoid using the Switch feature.'
-                        .format(from_folded_state=from_folded_state, to_folded_state=to_folded_state))
+            for armature, do_folding, saved_pose in armatures_folding:
+                if self.action == 'SWITCH' and do_folding != is_folded_guess(armature):
+                    from_folded_state, to_folded_state = ('UNFOLDED', 'folded') if do_folding else ('folded', 'UNFOLDED')
+                    log.warn('It was guessed that the armature {armature} was initially {from_folded_state} and had to be {to_folded_state},\n'
+                        'but now that the armature should be {to_folded_state} it is still guessed as {from_folded_state}.\n'
+                        'Results of this switch fold/unfold operation may be wrong,\n'
+                        'you may have to avoid using the Switch feature.'
+                            .format(armature=armature.name, from_folded_state=from_folded_state, to_folded_state=to_folded_state))
 
             return {'FINISHED'}
         finally:
@@ -611,6 +877,7 @@ class OBJEX_OT_autofold_fold_unfold(bpy.types.Operator, AutofoldOperator):
         armature = self.get_armature(context)
 
         self.layout.prop(self, 'action')
+        self.layout.prop(self, 'selected_armatures')
 
         default_to_saved_pose = None
         if not self.pose_name:
@@ -629,17 +896,31 @@ classes = (
     OBJEX_OT_mesh_find_multiassigned_vertices,
     OBJEX_OT_mesh_find_unassigned_vertices,
     OBJEX_OT_mesh_list_vertex_groups,
+    OBJEX_OT_rig_health_report,
     OBJEX_OT_autofold_save_pose,
     OBJEX_OT_autofold_delete_pose,
     OBJEX_OT_autofold_restore_pose,
     OBJEX_OT_autofold_fold_unfold,
 )
 
+@bpy.app.handlers.persistent
+def clear_saved_pose_entries(*args):
+    # saved poses pointers change (and may be reused) on file load and undo/redo
+    saved_pose_entries.clear()
+
 def register():
     for clazz in classes:
         blender_version_compatibility.make_annotations(clazz)
         bpy.utils.register_class(clazz)
+    handlers = bpy.app.handlers
+    for handler_list in (handlers.load_post, handlers.undo_post, handlers.redo_post):
+        handler_list.append(clear_saved_pose_entries)
 
 def unregister():
+    handlers = bpy.app.handlers
+    for handler_list in (handlers.load_post, handlers.undo_post, handlers.redo_post):
+        if clear_saved_pose_entries in handler_list:
+            handler_list.remove(clear_saved_pose_entries)
+    saved_pose_entries.clear()
     for clazz in reversed(classes):
         bpy.utils.unregister_class(clazz)